@@ -0,0 +1,185 @@
+"""Vectorized order analytics for the admin reports.
+
+Orders are streamed once into columnar frames (one row per order, one row per
+order line) and every report is computed from those frames with pandas/NumPy
+operations instead of per-order Python loops. Reports return plain JSON-ready
+dicts so the server can cache and serve them directly.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+ORDER_FIELDS = ["id", "user_id", "created_at", "status", "total_amount", "discount_amount", "final_amount", "discount_code"]
+LINE_FIELDS = ["order_id", "product_id", "product_name", "quantity", "revenue"]
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+def records(df: pd.DataFrame) -> list:
+    """DataFrame rows as JSON-native dicts (numpy scalars and NaN converted)"""
+    return json.loads(df.to_json(orient="records", date_format="iso"))
+
+
+class FrameBuilder:
+    """Accumulates projected order documents column by column"""
+
+    def __init__(self):
+        self.orders = {field: [] for field in ORDER_FIELDS + ["customer_name"]}
+        self.lines = {field: [] for field in LINE_FIELDS}
+
+    def add(self, order: dict):
+        for field in ORDER_FIELDS:
+            self.orders[field].append(order.get(field))
+        self.orders["customer_name"].append((order.get("customer") or {}).get("full_name"))
+        for item in order.get("items", ()):
+            self.lines["order_id"].append(order["id"])
+            self.lines["product_id"].append(item["product_id"])
+            self.lines["product_name"].append(item.get("product_name") or item["product_id"])
+            self.lines["quantity"].append(item["quantity"])
+            self.lines["revenue"].append(item["price"] * item["quantity"])
+
+    def build(self, tz):
+        """Typed frames in local time with cancelled orders excluded"""
+        orders = pd.DataFrame(self.orders)
+        orders["created_at"] = pd.to_datetime(orders["created_at"], utc=True, format="ISO8601").dt.tz_convert(tz)
+        for field in ("total_amount", "discount_amount", "final_amount"):
+            orders[field] = pd.to_numeric(orders[field]).fillna(0.0)
+        orders = orders[orders["status"] != "cancelled"].reset_index(drop=True)
+
+        lines = pd.DataFrame(self.lines).astype({"quantity": "int64", "revenue": "float64"})
+        lines = lines[lines["order_id"].isin(orders["id"])].reset_index(drop=True)
+        return orders, lines
+
+
+def _score(values: pd.Series, bins: int = 5) -> np.ndarray:
+    # Rank first so ties and small customer bases still spread across all scores
+    ranks = values.rank(method="first", pct=True).to_numpy()
+    return np.clip(np.ceil(ranks * bins), 1, bins).astype(int)
+
+
+def rfm_segments(orders: pd.DataFrame, lines: pd.DataFrame) -> dict:
+    """Recency / frequency / monetary scores (1-5) and a segment per customer"""
+    if orders.empty:
+        return {"segments": [], "customers": []}
+    now = pd.Timestamp.now(tz=orders["created_at"].dt.tz)
+    customers = orders.groupby("user_id").agg(
+        customer_name=("customer_name", "last"),
+        last_order=("created_at", "max"),
+        frequency=("id", "count"),
+        monetary=("final_amount", "sum"),
+    )
+    customers["recency_days"] = (now - customers["last_order"]).dt.days
+    customers["r_score"] = _score(-customers["recency_days"])
+    customers["f_score"] = _score(customers["frequency"])
+    customers["m_score"] = _score(customers["monetary"])
+
+    r, f = customers["r_score"], customers["f_score"]
+    customers["segment"] = np.select(
+        [(r >= 4) & (f >= 4), f >= 4, (r >= 4) & (customers["frequency"] == 1), r >= 3, (r <= 2) & (f >= 3)],
+        ["Champions", "Loyal", "New", "Potential", "At Risk"],
+        default="Hibernating",
+    )
+
+    segments = customers.groupby("segment").agg(
+        customers=("frequency", "size"),
+        orders=("frequency", "sum"),
+        revenue=("monetary", "sum"),
+        avg_recency_days=("recency_days", "mean"),
+    ).sort_values("revenue", ascending=False)
+    customers = customers.reset_index().sort_values(["r_score", "f_score", "m_score"], ascending=False)
+    return {
+        "segments": records(segments.reset_index()),
+        "customers": records(customers),
+    }
+
+
+def co_purchase(orders: pd.DataFrame, lines: pd.DataFrame, top: int = 50) -> dict:
+    """Product x product matrix of orders containing both, plus the strongest pairs by lift"""
+    if lines.empty:
+        return {"orders": 0, "products": [], "matrix": [], "pairs": []}
+    basket = pd.crosstab(lines["order_id"], lines["product_id"]).clip(upper=1)
+    x = basket.to_numpy(dtype=np.int64)
+    matrix = x.T @ x
+    support = np.diag(matrix)
+    n_orders = x.shape[0]
+
+    i, j = np.triu_indices(len(support), k=1)
+    together = matrix[i, j]
+    keep = together > 0
+    i, j, together = i[keep], j[keep], together[keep]
+    lift = together * n_orders / (support[i] * support[j])
+    order = np.lexsort((-together, -lift))[:top]
+
+    product_ids = basket.columns.to_numpy()
+    names = lines.drop_duplicates("product_id").set_index("product_id")["product_name"].reindex(product_ids).to_numpy()
+    pairs = pd.DataFrame({
+        "product_a": product_ids[i[order]],
+        "name_a": names[i[order]],
+        "product_b": product_ids[j[order]],
+        "name_b": names[j[order]],
+        "orders_together": together[order],
+        "support": together[order] / n_orders,
+        "confidence_a_to_b": together[order] / support[i[order]],
+        "confidence_b_to_a": together[order] / support[j[order]],
+        "lift": lift[order],
+    })
+    return {
+        "orders": n_orders,
+        "products": [{"product_id": pid, "name": name, "orders": int(count)} for pid, name, count in zip(product_ids, names, support)],
+        "matrix": matrix.tolist(),
+        "pairs": records(pairs),
+    }
+
+
+def discount_effectiveness(orders: pd.DataFrame, lines: pd.DataFrame) -> dict:
+    """Discounted vs full-price baskets overall and per discount code"""
+    if orders.empty:
+        return {"overall": [], "codes": []}
+    df = orders.assign(
+        discounted=orders["discount_amount"] > 0,
+        discount_code=orders["discount_code"].fillna("(none)"),
+    )
+    aggregations = dict(
+        orders=("id", "count"),
+        customers=("user_id", "nunique"),
+        gross_revenue=("total_amount", "sum"),
+        discount_total=("discount_amount", "sum"),
+        revenue=("final_amount", "sum"),
+        avg_basket=("total_amount", "mean"),
+    )
+    overall = df.groupby("discounted").agg(**aggregations)
+    overall["order_share"] = overall["orders"] / overall["orders"].sum()
+
+    codes = df[df["discounted"]].groupby("discount_code").agg(**aggregations)
+    codes["discount_rate"] = codes["discount_total"] / codes["gross_revenue"]
+    codes["revenue_per_discount"] = codes["revenue"] / codes["discount_total"]
+    codes = codes.sort_values("revenue", ascending=False)
+    return {"overall": records(overall.reset_index()), "codes": records(codes.reset_index())}
+
+
+def hourly_demand(orders: pd.DataFrame, lines: pd.DataFrame) -> dict:
+    """Orders and revenue by local hour of day, overall and per weekday"""
+    counts = np.zeros((7, 24), dtype=np.int64)
+    revenue = np.zeros((7, 24))
+    if orders.empty:
+        days = 0
+    else:
+        weekday = orders["created_at"].dt.dayofweek.to_numpy()
+        hour = orders["created_at"].dt.hour.to_numpy()
+        np.add.at(counts, (weekday, hour), 1)
+        np.add.at(revenue, (weekday, hour), orders["final_amount"].to_numpy())
+        days = orders["created_at"].dt.normalize().nunique()
+
+    by_hour = pd.DataFrame({
+        "hour": np.arange(24),
+        "orders": counts.sum(axis=0),
+        "revenue": revenue.sum(axis=0),
+    })
+    by_hour["avg_orders_per_day"] = by_hour["orders"] / days if days else 0.0
+    return {
+        "days": int(days),
+        "by_hour": records(by_hour),
+        "weekdays": WEEKDAYS,
+        "orders_by_weekday_hour": counts.tolist(),
+        "revenue_by_weekday_hour": revenue.tolist(),
+    }
@@ -0,0 +1,152 @@
+"""Columnar order exports (Parquet or Arrow IPC).
+
+Orders are written one record batch at a time, so an export of the full order
+history never holds more than one batch of rows in memory. Each export is two
+typed tables: one row per order and one row per order line.
+"""
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FORMATS = {"parquet": "parquet", "arrow": "arrow"}
+
+TIMESTAMP = pa.timestamp("us", tz="UTC")
+
+ORDERS_SCHEMA = pa.schema([
+    ("order_id", pa.string()),
+    ("order_number", pa.string()),
+    ("created_at", TIMESTAMP),
+    ("updated_at", TIMESTAMP),
+    ("status", pa.string()),
+    ("user_id", pa.string()),
+    ("customer_name", pa.string()),
+    ("customer_whatsapp", pa.string()),
+    ("customer_email", pa.string()),
+    ("item_count", pa.int32()),
+    ("total_amount", pa.float64()),
+    ("shipping_fee", pa.float64()),
+    ("discount_amount", pa.float64()),
+    ("discount_code", pa.string()),
+    ("final_amount", pa.float64()),
+    ("payment_type", pa.string()),
+    ("payment_amount", pa.float64()),
+    ("has_payment_proof", pa.bool_()),
+    ("delivery_type", pa.string()),
+    ("delivery_address", pa.string()),
+    ("pickup_location", pa.string()),
+    ("pickup_date", pa.string()),
+    ("notes", pa.string()),
+])
+
+LINES_SCHEMA = pa.schema([
+    ("order_id", pa.string()),
+    ("order_number", pa.string()),
+    ("created_at", TIMESTAMP),
+    ("line_number", pa.int32()),
+    ("product_id", pa.string()),
+    ("product_name", pa.string()),
+    ("variant_summary", pa.string()),
+    ("quantity", pa.int32()),
+    ("unit_price", pa.float64()),
+    ("line_total", pa.float64()),
+])
+
+
+def _timestamp(value):
+    if isinstance(value, str):
+        return datetime.fromisoformat(value)
+    return value
+
+
+def order_columns(orders: list) -> tuple:
+    """Column dicts for the orders and order-lines tables from enriched order documents"""
+    rows = {field.name: [] for field in ORDERS_SCHEMA}
+    lines = {field.name: [] for field in LINES_SCHEMA}
+    for order in orders:
+        created_at = _timestamp(order["created_at"])
+        items = order.get("items", [])
+        rows["order_id"].append(order["id"])
+        rows["order_number"].append(order.get("order_number"))
+        rows["created_at"].append(created_at)
+        rows["updated_at"].append(_timestamp(order.get("updated_at")))
+        rows["status"].append(order.get("status"))
+        rows["user_id"].append(order.get("user_id"))
+        rows["customer_name"].append(order.get("customer_name"))
+        rows["customer_whatsapp"].append(order.get("customer_whatsapp"))
+        rows["customer_email"].append(order.get("customer_email"))
+        rows["item_count"].append(sum(item["quantity"] for item in items))
+        for field in ("total_amount", "shipping_fee", "discount_amount", "final_amount", "payment_amount"):
+            rows[field].append(float(order.get(field) or 0))
+        rows["discount_code"].append(order.get("discount_code"))
+        rows["payment_type"].append(order.get("payment_type"))
+        rows["has_payment_proof"].append(bool(order.get("has_payment_proof")))
+        for field in ("delivery_type", "delivery_address", "pickup_location", "pickup_date", "notes"):
+            rows[field].append(order.get(field))
+
+        for number, item in enumerate(items, start=1):
+            lines["order_id"].append(order["id"])
+            lines["order_number"].append(order.get("order_number"))
+            lines["created_at"].append(created_at)
+            lines["line_number"].append(number)
+            lines["product_id"].append(item["product_id"])
+            lines["product_name"].append(item.get("product_name"))
+            lines["variant_summary"].append(item.get("variant_summary"))
+            lines["quantity"].append(item["quantity"])
+            lines["unit_price"].append(float(item["price"]))
+            lines["line_total"].append(float(item["price"]) * item["quantity"])
+    return rows, lines
+
+
+class TableWriter:
+    """Appends record batches to one Parquet or Arrow IPC file"""
+
+    def __init__(self, path: Path, schema: pa.Schema, fmt: str):
+        self.path = path
+        self.schema = schema
+        if fmt == "parquet":
+            self._sink = None
+            self._writer = pq.ParquetWriter(str(path), schema, compression="zstd")
+        else:
+            self._sink = pa.OSFile(str(path), "wb")
+            self._writer = pa.ipc.new_file(self._sink, schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+
+    def write(self, columns: dict):
+        if columns[self.schema.names[0]]:
+            self._writer.write_batch(pa.RecordBatch.from_pydict(columns, schema=self.schema))
+
+    def close(self):
+        self._writer.close()
+        if self._sink:
+            self._sink.close()
+
+
+class OrderExportWriter:
+    """Writes the orders and order-lines tables side by side, one batch of orders at a time"""
+
+    def __init__(self, directory: Path, fmt: str):
+        extension = FORMATS[fmt]
+        self.orders = TableWriter(directory / f"orders.{extension}", ORDERS_SCHEMA, fmt)
+        self.lines = TableWriter(directory / f"order_lines.{extension}", LINES_SCHEMA, fmt)
+        self.rows_written = 0
+
+    def write_batch(self, orders: list):
+        rows, lines = order_columns(orders)
+        self.orders.write(rows)
+        self.lines.write(lines)
+        self.rows_written += len(orders)
+
+    def close(self) -> list:
+        self.orders.close()
+        self.lines.close()
+        return [self.orders.path, self.lines.path]
+
+
+def bundle(paths: list, destination: Path) -> Path:
+    """Zip the table files together; they are already compressed, so store them as-is"""
+    with zipfile.ZipFile(destination, "w", compression=zipfile.ZIP_STORED) as archive:
+        for path in paths:
+            archive.write(path, arcname=path.name)
+    return destination
@@ -0,0 +1,87 @@
+"""Image resizing run in worker processes.
+
+Only Pillow is imported here so pool workers start quickly and never touch the
+server's database client. Renditions take and return file paths, keeping the
+traffic between processes small; payment proofs are capped uploads and travel
+as bytes.
+"""
+import io
+import os
+
+from PIL import Image, ImageOps
+
+FORMATS = {"webp": ("WEBP", "image/webp"), "jpeg": ("JPEG", "image/jpeg")}
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def _prepare(image: Image.Image, fmt: str) -> Image.Image:
+    if fmt == "jpeg" and _has_alpha(image):
+        # JPEG has no alpha channel: flatten onto white like the storefront background
+        rgba = image.convert("RGBA")
+        flattened = Image.new("RGB", rgba.size, (255, 255, 255))
+        flattened.paste(rgba, mask=rgba.getchannel("A"))
+        return flattened
+    if fmt == "webp" and _has_alpha(image):
+        return image if image.mode == "RGBA" else image.convert("RGBA")
+    return image if image.mode == "RGB" else image.convert("RGB")
+
+
+def _write(image: Image.Image, fp, fmt: str, quality: int):
+    """Encode without the source metadata (EXIF incl. GPS, XMP, comments)"""
+    image = _prepare(image, fmt)
+    # Pillow writes some info keys (e.g. comment) back out; keep only what affects rendering
+    image.info = {key: image.info[key] for key in ("icc_profile", "transparency") if key in image.info}
+    if fmt == "jpeg":
+        image.save(fp, "JPEG", quality=quality, optimize=True, progressive=True)
+    else:
+        image.save(fp, "WEBP", quality=quality, method=4)
+
+
+def _encode(image: Image.Image, fmt: str, quality: int) -> bytes:
+    buffer = io.BytesIO()
+    _write(image, buffer, fmt, quality)
+    return buffer.getvalue()
+
+
+def _save(image: Image.Image, dest_path: str, fmt: str, quality: int) -> int:
+    """Write atomically (temp file + rename); returns the size in bytes"""
+    tmp_path = f"{dest_path}.{os.getpid()}.tmp"
+    try:
+        _write(image, tmp_path, fmt, quality)
+        os.replace(tmp_path, dest_path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(dest_path)
+
+
+def _open(source, max_size: int) -> Image.Image:
+    try:
+        source = Image.open(source)
+    except Image.DecompressionBombError as e:
+        raise ValueError(str(e)) from None
+    with source:
+        # Let JPEG decode at a reduced scale when the output is much smaller than the source
+        source.draft("RGB", (max_size, max_size))
+        return ImageOps.exif_transpose(source)
+
+
+def render_rendition(source_path: str, dest_path: str, width: int, fmt: str, quality: int) -> int:
+    """Scale the source down to at most `width` pixels wide and write it as fmt"""
+    with _open(source_path, width) as image:
+        if image.width > width:
+            image = image.resize((width, max(1, round(image.height * width / image.width))), Image.Resampling.LANCZOS)
+        return _save(image, dest_path, fmt, quality)
+
+
+def compress_payment_proof(data: bytes, max_size: int, thumbnail_size: int, quality: int) -> tuple:
+    """Re-encode an uploaded proof as JPEG fitting max_size, plus a thumbnail; returns both as bytes"""
+    with _open(io.BytesIO(data), max_size) as image:
+        image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+        proof = _encode(image, "jpeg", quality)
+        image.thumbnail((thumbnail_size, thumbnail_size), Image.Resampling.LANCZOS)
+        return proof, _encode(image, "jpeg", quality)
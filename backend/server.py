@@ -1,30 +1,213 @@
-from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, UploadFile, File, Form, Depends, Request, Header, status
+from fastapi.encoders import jsonable_encoder
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+import pymongo
+from pymongo import monitoring, UpdateOne, UpdateMany, ReplaceOne, ReturnDocument
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
 import os
+import sys
+import time
+import asyncio
+import threading
+import traceback
+import cProfile
+import pstats
+import json
+import contextvars
 import logging
+from collections import defaultdict, deque, OrderedDict
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict, EmailStr
 from typing import List, Optional
 import uuid
 from datetime import datetime, timezone, timedelta
+import math
+import functools
+import multiprocessing
+import random
+import hashlib
+import gzip
+import urllib.parse
 import bcrypt
+import brotli
 import jwt
 import base64
 import csv
 import io
-from fastapi.responses import StreamingResponse
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import httpx
+from starlette.background import BackgroundTask
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response, FileResponse, JSONResponse
+import analytics
+import exports
+import imaging
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
+# Pool sizing is per process: with N uvicorn workers the server sees up to N * MONGO_MAX_POOL_SIZE connections
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000'))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000'))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', '0')) or None  # 0 = no socket timeout
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '0')) or None  # 0 = wait forever
+MONGO_MAX_TIME_MS = int(os.getenv('MONGO_MAX_TIME_MS', '10000'))  # default server-side budget per query
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Tracks connection pool occupancy per server from pymongo pool events"""
+
+    def __init__(self):
+        self.pools = {}
+        # Events arrive on the driver's executor threads; += on a shared dict isn't atomic
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _key(address) -> str:
+        return f"{address[0]}:{address[1]}"
+
+    def _add(self, address, **deltas):
+        with self.lock:
+            pool = self.pools.setdefault(self._key(address), {"size": 0, "checked_out": 0, "wait_queue": 0, "checkout_failures": 0, "cleared": 0})
+            for field, delta in deltas.items():
+                pool[field] += delta
+
+    def pool_created(self, event):
+        self._add(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(event.address, cleared=1)
+
+    def pool_closed(self, event):
+        with self.lock:
+            self.pools.pop(self._key(event.address), None)
+
+    def connection_created(self, event):
+        self._add(event.address, size=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(event.address, size=-1)
+
+    def connection_check_out_started(self, event):
+        self._add(event.address, wait_queue=1)
+
+    def connection_check_out_failed(self, event):
+        self._add(event.address, wait_queue=-1, checkout_failures=1)
+
+    def connection_checked_out(self, event):
+        self._add(event.address, wait_queue=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(event.address, checked_out=-1)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {address: dict(pool) for address, pool in self.pools.items()}
+
+pool_stats = PoolStats()
+
+# Time limit for each Mongo operation, in seconds; set per request by the query budget middleware
+query_timeout: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('query_timeout', default=None)
+
+class BudgetedMongoClient(pymongo.MongoClient):
+    """Applies query_timeout to every operation as the driver's per-operation timeoutMS.
+
+    pymongo turns timeoutMS into maxTimeMS on each command and bounds server selection and pool
+    waits by it, starting afresh for every operation. Reading it from the context (Motor runs each
+    call in a copy of the caller's) gives each route class its own limit. Being a limit and not a
+    deadline, it is harmless in background tasks that inherit it from a request.
+    """
+
+    @property
+    def _timeout(self) -> Optional[float]:
+        return query_timeout.get()
+
+    @_timeout.setter
+    def _timeout(self, value):
+        # MongoClient.__init__ stores timeoutMS here; this client doesn't take that option
+        pass
+
+class BudgetedMotorClient(AsyncIOMotorClient):
+    __delegate_class__ = BudgetedMongoClient
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+client = BudgetedMotorClient(
+    mongo_url,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+    event_listeners=[pool_stats]
+)
 db = client[os.environ['DB_NAME']]
 
+# Indexes the app relies on; created at startup and verified by /readyz
+REQUIRED_INDEXES = {
+    "users": [
+        ([("id", 1)], {"unique": True}),
+        ([("whatsapp", 1)], {}),
+        ([("email", 1)], {}),
+    ],
+    "products": [
+        ([("id", 1)], {"unique": True}),
+        ([("active", 1), ("category", 1)], {}),
+    ],
+    "carts": [
+        ([("user_id", 1)], {"unique": True}),
+    ],
+    "orders": [
+        ([("id", 1)], {"unique": True}),
+        ([("user_id", 1), ("created_at", -1)], {}),
+        ([("created_at", -1)], {}),
+        ([("updated_at", 1), ("id", 1)], {}),
+    ],
+    "discounts": [
+        ([("code", 1), ("active", 1)], {}),
+    ],
+    "addresses": [
+        ([("user_id", 1)], {}),
+    ],
+    "stock_holds": [
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+        ([("user_id", 1)], {}),
+    ],
+    "idempotency_keys": [
+        ([("key", 1)], {"unique": True}),
+        ([("expires_at", 1)], {"expireAfterSeconds": 0}),
+    ],
+    "sales_daily": [
+        ([("date", 1)], {"unique": True}),
+    ],
+    "export_jobs": [
+        ([("id", 1)], {"unique": True}),
+        ([("params_key", 1), ("created_at", -1)], {}),
+    ],
+    "image_sources": [
+        ([("key", 1)], {"unique": True}),
+    ],
+    "leases": [
+        ([("id", 1)], {"unique": True}),
+    ],
+}
+
+def index_name(keys) -> str:
+    return '_'.join(f"{field}_{direction}" for field, direction in keys)
+
 # JWT settings
 JWT_SECRET = os.getenv('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
@@ -38,6 +221,289 @@ app = FastAPI()
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
 
+# Metrics
+class Metrics:
+    """Small in-process metrics registry rendered in Prometheus text format"""
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return (name, tuple(sorted(labels.items())))
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        with self._lock:
+            self.counters[self._key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        with self._lock:
+            hist = self.histograms.setdefault(self._key(name, labels), {"buckets": [0] * len(self.BUCKETS), "sum": 0.0, "count": 0})
+            for i, bound in enumerate(self.BUCKETS):
+                if value <= bound:
+                    hist["buckets"][i] += 1
+            hist["sum"] += value
+            hist["count"] += 1
+
+    @staticmethod
+    def _labels(labels, extra=None):
+        pairs = list(labels) + (extra or [])
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in pairs) + '}'
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{name}{self._labels(labels)} {value}")
+            for (name, labels), hist in sorted(self.histograms.items()):
+                for bound, count in zip(self.BUCKETS, hist["buckets"]):
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {count}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {hist['count']}")
+                lines.append(f"{name}_sum{self._labels(labels)} {hist['sum']}")
+                lines.append(f"{name}_count{self._labels(labels)} {hist['count']}")
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+
+# Event loop watchdog
+LOOP_WATCHDOG_INTERVAL = float(os.getenv('LOOP_WATCHDOG_INTERVAL', '0.25'))  # seconds between heartbeats
+LOOP_WATCHDOG_THRESHOLD = float(os.getenv('LOOP_WATCHDOG_THRESHOLD', '0.1'))  # lag that counts as a stall
+
+class LoopWatchdog:
+    """Measures event loop lag and captures the stack of whatever is blocking the loop.
+
+    A heartbeat task on the loop records how late each timer fires. A separate
+    thread watches the heartbeat; when it stops beating for longer than the
+    threshold, the loop thread's current stack is the code that is blocking it.
+    """
+
+    def __init__(self, interval: float, threshold: float, history: int = 50):
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=history)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._last_beat = time.monotonic()
+        self._loop_thread_id = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._monitor, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _heartbeat(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - started - self.interval)
+            self._last_beat = now
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            metrics.set('event_loop_lag_current_seconds', lag)
+            metrics.set('event_loop_lag_max_seconds', self.max_lag)
+            metrics.observe('event_loop_lag_seconds', lag)
+
+    def _monitor(self):
+        reported = False
+        while not self._stop.wait(self.threshold / 2):
+            blocked_for = time.monotonic() - self._last_beat - self.interval
+            if blocked_for <= self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            # Capture once per stall: the loop thread is still inside the blocking call
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = ''.join(traceback.format_stack(frame)) if frame else ''
+            self.stalls.append({
+                "detected_at": datetime.now(timezone.utc).isoformat(),
+                "blocked_for": round(blocked_for, 4),
+                "stack": stack
+            })
+            metrics.inc('event_loop_stalls_total')
+            logger.warning("Event loop blocked for %.3fs, current stack:\n%s", blocked_for, stack)
+            reported = True
+
+    def snapshot(self) -> dict:
+        return {
+            "interval": self.interval,
+            "threshold": self.threshold,
+            "last_lag": self.last_lag,
+            "max_lag": self.max_lag,
+            "stalls": list(self.stalls)
+        }
+
+loop_watchdog = LoopWatchdog(LOOP_WATCHDOG_INTERVAL, LOOP_WATCHDOG_THRESHOLD)
+
+# Request coalescing
+class SingleFlight:
+    """Concurrent identical reads share one in-flight call and its result (or exception).
+
+    The shared call runs as its own task, so a caller that disconnects doesn't cancel it for
+    the others. Results are shared objects: callers may only make idempotent changes to them.
+    """
+
+    def __init__(self):
+        self.flights = {}
+
+    async def do(self, group: str, key, fn):
+        flight_key = (group, key)
+        task = self.flights.get(flight_key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.flights[flight_key] = task
+            task.add_done_callback(lambda _: self.flights.pop(flight_key, None))
+            metrics.inc('singleflight_calls_total', group=group)
+        else:
+            metrics.inc('singleflight_coalesced_total', group=group)
+        return await asyncio.shield(task)
+
+singleflight = SingleFlight()
+
+# Storefront cache
+# Public catalog reads are served stale-while-revalidate: fresh entries are served as-is, stale
+# ones are served while a background task refreshes them, and when Mongo errors or is slower
+# than STOREFRONT_REFRESH_TIMEOUT the last good value is served for up to STOREFRONT_STALE_IF_ERROR.
+# Entries are per worker; admin writes invalidate this worker's entries, other workers catch
+# up within STOREFRONT_FRESH_SECONDS. Stock is overlaid per response (see LiveStock).
+STOREFRONT_FRESH_SECONDS = float(os.getenv('STOREFRONT_FRESH_SECONDS', '30'))
+STOREFRONT_STALE_SECONDS = float(os.getenv('STOREFRONT_STALE_SECONDS', '300'))
+STOREFRONT_STALE_IF_ERROR_SECONDS = float(os.getenv('STOREFRONT_STALE_IF_ERROR_SECONDS', '86400'))
+STOREFRONT_REFRESH_TIMEOUT = float(os.getenv('STOREFRONT_REFRESH_TIMEOUT', '1'))
+STOREFRONT_CACHE_MAX_ENTRIES = int(os.getenv('STOREFRONT_CACHE_MAX_ENTRIES', '2000'))
+
+class StaleWhileRevalidateCache:
+    """LRU of loader results with fresh, stale and stale-if-error windows"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (group, key) -> {"value", "stored_at", "invalidated"}
+        self.refreshing = set()
+        # Last resort when a load fails with nothing cached: an object with derive(group, key) and age()
+        self.fallback = None
+
+    def _store(self, cache_key, value, age: float = 0.0):
+        if value is None:
+            # Don't cache misses: a product created on another worker would 404 here until expiry
+            self.entries.pop(cache_key, None)
+            return
+        self.entries[cache_key] = {"value": value, "stored_at": time.monotonic() - age, "invalidated": False}
+        self.entries.move_to_end(cache_key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def peek(self, group: str, key):
+        """The fresh value for group/key if there is one, without loading"""
+        entry = self.entries.get((group, key))
+        if entry and not entry['invalidated'] and time.monotonic() - entry['stored_at'] < STOREFRONT_FRESH_SECONDS:
+            return entry['value']
+        return None
+
+    def put(self, group: str, key, value):
+        self._store((group, key), value)
+
+    def seed(self, group: str, key, value, captured_at: datetime):
+        """Store a value captured earlier (e.g. on disk) with its real age; too old to serve is skipped"""
+        age = max((datetime.now(timezone.utc) - captured_at).total_seconds(), 0.0)
+        if (group, key) not in self.entries and age < STOREFRONT_STALE_IF_ERROR_SECONDS:
+            self._store((group, key), value, age=age)
+
+    def invalidate(self, *groups):
+        """Force the next read of these groups to reload; the old value stays as an error fallback"""
+        for (group, _), entry in self.entries.items():
+            if group in groups:
+                entry['invalidated'] = True
+
+    async def get(self, group: str, key, loader):
+        """(value, age in seconds) for group/key, loading through singleflight when needed"""
+        cache_key = (group, key)
+        entry = self.entries.get(cache_key)
+        age = time.monotonic() - entry['stored_at'] if entry else None
+        if entry and not entry['invalidated']:
+            self.entries.move_to_end(cache_key)
+            if age < STOREFRONT_FRESH_SECONDS:
+                metrics.inc('storefront_cache_total', group=group, result='fresh')
+                return entry['value'], age
+            if age < STOREFRONT_STALE_SECONDS:
+                metrics.inc('storefront_cache_total', group=group, result='stale')
+                self._refresh_in_background(group, key, loader)
+                return entry['value'], age
+
+        try:
+            if entry and age < STOREFRONT_STALE_IF_ERROR_SECONDS:
+                # Something to fall back on: don't make the customer wait out a slow database
+                value = await asyncio.wait_for(singleflight.do(group, key, loader), STOREFRONT_REFRESH_TIMEOUT)
+            else:
+                value = await singleflight.do(group, key, loader)
+        except (PyMongoError, asyncio.TimeoutError) as e:
+            if entry and age < STOREFRONT_STALE_IF_ERROR_SECONDS:
+                # A slow load keeps running in its flight; let a background refresh store the result
+                self._refresh_in_background(group, key, loader)
+                metrics.inc('storefront_cache_total', group=group, result='stale_if_error')
+                logger.warning("Serving stale %s (%.0fs old) after load failed: %s", group, age, str(e) or type(e).__name__)
+                return entry['value'], age
+            value = self.fallback.derive(group, key) if self.fallback else None
+            if value is not None:
+                metrics.inc('storefront_cache_total', group=group, result='snapshot')
+                logger.warning("Serving %s from the catalog snapshot after load failed: %s", group, str(e) or type(e).__name__)
+                return value, self.fallback.age()
+            raise
+        metrics.inc('storefront_cache_total', group=group, result='miss')
+        self._store(cache_key, value)
+        return value, 0.0
+
+    def _refresh_in_background(self, group: str, key, loader):
+        cache_key = (group, key)
+        if cache_key in self.refreshing:
+            return
+        self.refreshing.add(cache_key)
+
+        async def refresh():
+            try:
+                self._store(cache_key, await singleflight.do(group, key, loader))
+            except Exception as e:
+                metrics.inc('storefront_cache_refresh_failures_total', group=group)
+                logger.warning("Background refresh of %s failed: %s", group, e)
+            finally:
+                self.refreshing.discard(cache_key)
+
+        asyncio.get_running_loop().create_task(refresh())
+
+storefront_cache = StaleWhileRevalidateCache(STOREFRONT_CACHE_MAX_ENTRIES)
+
+async def cached_read(response: Response, group: str, key, loader):
+    value, age = await storefront_cache.get(group, key, loader)
+    response.headers['Age'] = str(int(age))
+    return value
+
 # Helper functions
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
@@ -57,11 +523,14 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     try:
         token = credentials.credentials
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
-        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    # Single-purpose tokens (e.g. the order stream's) are not sessions
+    if payload.get('purpose'):
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
 
 async def get_admin_user(user = Depends(get_current_user)):
     if not user.get('is_admin'):
@@ -126,6 +595,10 @@ class Product(BaseModel):
     requires_customization: bool = False
     customization_options: Optional[dict] = None
     stock: int = 100
+    # Stock minus other customers' cart holds; computed per response, never stored
+    available_stock: Optional[int] = None
+    # Resized image URLs ({"src", "webp", "jpeg"} srcsets); computed per response, never stored
+    image_renditions: Optional[dict] = None
     active: bool = True
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -153,9 +626,13 @@ class ProductUpdate(BaseModel):
 
 class CartItem(BaseModel):
     product_id: str
-    quantity: int
+    quantity: int = Field(gt=0)
     customization: Optional[dict] = None
     price: float
+    # Snapshot of the product when the line was added, so carts and orders render without product lookups
+    product_name: Optional[str] = None
+    image_url: Optional[str] = None
+    variant_summary: Optional[str] = None
 
 class Cart(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -166,14 +643,25 @@ class Cart(BaseModel):
 
 class CartItemAdd(BaseModel):
     product_id: str
-    quantity: int
+    quantity: int = Field(gt=0)
     customization: Optional[dict] = None
 
+class CustomerSnapshot(BaseModel):
+    full_name: str
+    whatsapp: str
+    email: str
+
+class UserProfileUpdate(BaseModel):
+    email: Optional[EmailStr] = None
+    whatsapp: Optional[str] = None
+    full_name: Optional[str] = None
+
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     order_number: str
     user_id: str
+    customer: Optional[CustomerSnapshot] = None  # copied from the user at checkout so admin reads need no join
     items: List[CartItem]
     total_amount: float
     shipping_fee: float
@@ -181,11 +669,13 @@ class Order(BaseModel):
     final_amount: float
     payment_type: str = "full"  # full or dp50 (down payment 50%)
     payment_amount: float = 0  # Amount to pay based on payment type
+    discount_code: Optional[str] = None
     delivery_type: str  # delivery or pickup
     delivery_address: Optional[str] = None
     pickup_location: Optional[str] = None
     pickup_date: Optional[str] = None
     payment_proof: Optional[str] = None
+    payment_proof_thumbnail: Optional[str] = None
     status: str = "pending"  # pending, confirmed, processing, completed, cancelled
     notes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -340,14 +830,223 @@ async def get_me(current_user = Depends(get_current_user)):
     
     return UserResponse(**user_doc)
 
+@api_router.put("/auth/me", response_model=UserResponse)
+async def update_me(profile: UserProfileUpdate, current_user = Depends(get_current_user)):
+    update_data = {k: v for k, v in profile.model_dump().items() if v is not None}
+    conflicts = [{k: update_data[k]} for k in ('email', 'whatsapp') if k in update_data]
+    if conflicts:
+        existing = await db.users.find_one({"$or": conflicts, "id": {"$ne": current_user['user_id']}}, {"_id": 0, "id": 1})
+        if existing:
+            raise HTTPException(status_code=400, detail="Email or WhatsApp already in use")
+    
+    if update_data:
+        result = await db.users.update_one({"id": current_user['user_id']}, {"$set": update_data})
+        if result.matched_count == 0:
+            raise HTTPException(status_code=404, detail="User not found")
+        # Keep the customer snapshot on past orders in step with the profile
+        await sync_customer_snapshot(current_user['user_id'])
+    
+    return await get_me(current_user)
+
+# Media worker pool
+# CPU-heavy image work runs in a small process pool so it neither blocks the event loop nor
+# competes for the GIL. Workers are spawned rather than forked: the server process has driver
+# and watchdog threads that a fork would copy in an unknown state.
+MEDIA_WORKERS = int(os.getenv('MEDIA_WORKERS', '2'))
+media_pool: Optional[ProcessPoolExecutor] = None
+
+async def run_in_media_pool(fn, *args):
+    global media_pool
+    if media_pool is None:
+        media_pool = ProcessPoolExecutor(max_workers=MEDIA_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    pool = media_pool
+    started = time.perf_counter()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool for the next job
+        if media_pool is pool:
+            media_pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        metrics.observe('media_job_seconds', time.perf_counter() - started, job=fn.__name__)
+
+# Product images
+# Product image_url values point at full-size originals. Responses reference renditions at fixed
+# widths instead, served from /api/images/{key}/{width}.{fmt} where key is a hash of the source
+# URL. Each source is fetched (or decoded, for data: URLs) once and kept on local disk under its
+# content hash; renditions are rendered on first request in the media pool and cached beside it.
+IMAGE_CACHE_DIR = Path(os.getenv('IMAGE_CACHE_DIR', str(ROOT_DIR / 'image_cache')))
+IMAGE_BASE_URL = os.getenv('IMAGE_BASE_URL', '/api/images')  # point at a CDN in front of the API if there is one
+IMAGE_WIDTHS = (320, 640, 1280)
+IMAGE_DEFAULT_WIDTH = 640
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '80'))
+IMAGE_FETCH_TIMEOUT = float(os.getenv('IMAGE_FETCH_TIMEOUT', '15'))
+IMAGE_MAX_SOURCE_BYTES = int(os.getenv('IMAGE_MAX_SOURCE_BYTES', str(20 * 1024 * 1024)))
+IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+@functools.lru_cache(maxsize=4096)
+def image_key(url: str) -> str:
+    return hashlib.sha256(url.encode()).hexdigest()[:32]
+
+registered_image_keys = set()  # keys this worker knows are in image_sources
+unregistered_image_urls = {}  # key -> url, registered by the next background flush
+image_registration_task: Optional[asyncio.Task] = None
+
+def image_renditions(url: Optional[str]) -> Optional[dict]:
+    """Rendition URLs for a registered source; None (clients use image_url) until it is registered"""
+    if not url:
+        return None
+    key = image_key(url)
+    if key not in registered_image_keys:
+        # Products written outside the API (seed scripts, direct edits) are registered on first sight
+        schedule_image_registration(key, url)
+        return None
+    base = f"{IMAGE_BASE_URL}/{key}"
+    return {
+        "src": f"{base}/{IMAGE_DEFAULT_WIDTH}.jpeg",
+        **{fmt: ", ".join(f"{base}/{width}.{fmt} {width}w" for width in IMAGE_WIDTHS) for fmt in imaging.FORMATS}
+    }
+
+def present_products(products: List[dict], cached: bool = True) -> List[dict]:
+    """Fill in the per-response product fields: live stock for cached documents, availability and renditions"""
+    if cached:
+        live_stock.overlay(products)
+    for product in with_availability(products):
+        product['image_renditions'] = image_renditions(product.get('image_url'))
+    return products
+
+async def register_image_sources(urls):
+    """Record which URL each image key stands for, so /api/images can resolve it"""
+    now = datetime.now(timezone.utc).isoformat()
+    writes = [
+        UpdateOne({"key": image_key(url)}, {"$setOnInsert": {"key": image_key(url), "url": url, "created_at": now}}, upsert=True)
+        for url in set(urls) if url
+    ]
+    if writes:
+        await db.image_sources.bulk_write(writes, ordered=False)
+        registered_image_keys.update(image_key(url) for url in urls if url)
+
+def schedule_image_registration(key: str, url: str):
+    global image_registration_task
+    unregistered_image_urls[key] = url
+    if image_registration_task is None or image_registration_task.done():
+        image_registration_task = asyncio.get_running_loop().create_task(flush_image_registrations())
+
+async def flush_image_registrations():
+    while unregistered_image_urls:
+        urls = list(unregistered_image_urls.values())
+        unregistered_image_urls.clear()
+        try:
+            await register_image_sources(urls)
+        except PyMongoError as e:
+            # Dropped; the next response that includes these products schedules them again
+            logger.warning("Could not register %d image sources: %s", len(urls), e)
+            return
+
+async def register_product_images():
+    urls = [product['image_url'] async for product in db.products.find({}, {"_id": 0, "image_url": 1}) if product.get('image_url')]
+    await register_image_sources(urls)
+
+async def fetch_image_source(url: str) -> bytes:
+    if url.startswith('data:'):
+        header, _, payload = url.partition(',')
+        if not header.endswith(';base64'):
+            raise ValueError("Only base64 data URLs are supported")
+        return base64.b64decode(payload)
+    if not url.startswith(('http://', 'https://')):
+        raise ValueError("Unsupported image URL")
+    async with httpx.AsyncClient(timeout=IMAGE_FETCH_TIMEOUT, follow_redirects=True) as http:
+        async with http.stream('GET', url) as response:
+            response.raise_for_status()
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > IMAGE_MAX_SOURCE_BYTES:
+                    raise ValueError(f"Image is larger than {IMAGE_MAX_SOURCE_BYTES} bytes")
+                chunks.append(chunk)
+    return b''.join(chunks)
+
+def write_file_atomic(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+class ImageStore:
+    """Source originals and renditions on local disk, named by source content hash"""
+
+    def __init__(self, directory: Path):
+        self.originals = directory / 'originals'
+        self.renditions = directory / 'renditions'
+        self.content_hashes = {}  # image key -> content hash of its source
+
+    async def original(self, key: str) -> Path:
+        content_hash = self.content_hashes.get(key)
+        if content_hash and (self.originals / content_hash).exists():
+            return self.originals / content_hash
+        source = await db.image_sources.find_one({"key": key}, {"_id": 0})
+        if not source:
+            raise HTTPException(status_code=404, detail="Image not found")
+        content_hash = source.get('content_hash')
+        if not content_hash or not (self.originals / content_hash).exists():
+            content_hash = await self.ingest(source)
+        self.content_hashes[key] = content_hash
+        return self.originals / content_hash
+
+    async def ingest(self, source: dict) -> str:
+        try:
+            data = await fetch_image_source(source['url'])
+        except (httpx.HTTPError, ValueError) as e:
+            metrics.inc('image_ingest_total', result='error')
+            logger.warning("Could not fetch image source %s: %s", source['key'], e)
+            raise HTTPException(status_code=502, detail="Image source unavailable")
+        content_hash = hashlib.sha256(data).hexdigest()
+        await asyncio.to_thread(write_file_atomic, self.originals / content_hash, data)
+        await db.image_sources.update_one(
+            {"key": source['key']},
+            {"$set": {"content_hash": content_hash, "size": len(data), "ingested_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        metrics.inc('image_ingest_total', result='ok')
+        return content_hash
+
+    async def rendition(self, key: str, width: int, fmt: str) -> Path:
+        original = await self.original(key)
+        path = self.renditions / f"{original.name}-{width}.{fmt}"
+        if path.exists():
+            metrics.inc('image_renditions_total', result='hit')
+            return path
+        self.renditions.mkdir(parents=True, exist_ok=True)
+        try:
+            size = await run_in_media_pool(imaging.render_rendition, str(original), str(path), width, fmt, IMAGE_QUALITY)
+        except (OSError, ValueError) as e:
+            metrics.inc('image_renditions_total', result='error')
+            logger.warning("Could not render image %s at %s %s: %s", key, width, fmt, e)
+            raise HTTPException(status_code=422, detail="Image source is not a supported image")
+        metrics.inc('image_renditions_total', result='rendered')
+        logger.info("Rendered image %s at %s %s (%d bytes)", key, width, fmt, size)
+        return path
+
+image_store = ImageStore(IMAGE_CACHE_DIR)
+
+@api_router.get("/images/{key}/{width:int}.{fmt}")
+async def get_image(key: str, width: int, fmt: str):
+    if width not in IMAGE_WIDTHS or fmt not in imaging.FORMATS:
+        raise HTTPException(status_code=404, detail="Image not found")
+    path = await singleflight.do('image_rendition', (key, width, fmt), lambda: image_store.rendition(key, width, fmt))
+    # Names change whenever the source URL does, so clients may cache renditions forever
+    return FileResponse(path, media_type=imaging.FORMATS[fmt][1], headers={"Cache-Control": IMAGE_CACHE_CONTROL})
+
 # Product endpoints
-@api_router.get("/products/featured", response_model=List[Product])
-async def get_featured_products(limit: int = 6):
-    """Get random featured products for homepage"""
+PRODUCT_PROJECTION = {"_id": 0, "stock_reservations": 0}
+
+async def load_featured_products(limit: int) -> List[dict]:
     # Use MongoDB aggregation to get random active products
     pipeline = [
         {"$match": {"active": {"$ne": False}}},
-        {"$sample": {"size": limit}}
+        {"$sample": {"size": limit}},
+        {"$project": PRODUCT_PROJECTION}
     ]
     products = await db.products.aggregate(pipeline).to_list(limit)
     for product in products:
@@ -356,36 +1055,90 @@ async def get_featured_products(limit: int = 6):
             product['created_at'] = datetime.fromisoformat(product['created_at'])
     return products
 
-@api_router.get("/products", response_model=List[Product])
-async def get_products(category: Optional[str] = None, include_inactive: bool = False):
+@api_router.get("/products/featured", response_model=List[Product])
+async def get_featured_products(response: Response, limit: int = 6):
+    """Get random featured products for homepage"""
+    products = await cached_read(response, 'featured', limit, lambda: load_featured_products(limit))
+    return present_products(products)
+
+PRODUCT_BATCH_MAX_IDS = 100
+
+async def load_products_by_ids(product_ids: tuple) -> List[dict]:
+    products = await db.products.find({"id": {"$in": list(product_ids)}}, PRODUCT_PROJECTION).to_list(len(product_ids))
+    for product in products:
+        if isinstance(product['created_at'], str):
+            product['created_at'] = datetime.fromisoformat(product['created_at'])
+    return products
+
+@api_router.get("/products/batch", response_model=List[Product])
+async def get_products_batch(ids: str):
+    """Products for a comma-separated list of ids, in request order; unknown ids are left out"""
+    product_ids = list(dict.fromkeys(product_id.strip() for product_id in ids.split(',') if product_id.strip()))
+    if len(product_ids) > PRODUCT_BATCH_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {PRODUCT_BATCH_MAX_IDS} ids per request")
+    
+    # Fresh per-product entries first, then the cached active catalog, then one $in for the rest
+    catalog = storefront_cache.peek('products', None) or []
+    catalog_by_id = {product['id']: product for product in catalog}
+    found = {}
+    for product_id in product_ids:
+        product = storefront_cache.peek('product', product_id) or catalog_by_id.get(product_id)
+        if product:
+            found[product_id] = product
+    missing = tuple(product_id for product_id in product_ids if product_id not in found)
+    metrics.inc('product_batch_ids_total', len(found), source='cache')
+    if missing:
+        metrics.inc('product_batch_ids_total', len(missing), source='database')
+        for product in await singleflight.do('products_batch', missing, lambda: load_products_by_ids(missing)):
+            storefront_cache.put('product', product['id'], product)
+            found[product['id']] = product
+    return present_products([found[product_id] for product_id in product_ids if product_id in found])
+
+async def load_products(category: Optional[str], include_inactive: bool) -> List[dict]:
     # By default, only return active products
     query = {} if include_inactive else {"active": {"$ne": False}}
     if category:
         query["category"] = category
     
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
+    products = await db.products.find(query, PRODUCT_PROJECTION).to_list(1000)
     for product in products:
         if isinstance(product['created_at'], str):
             product['created_at'] = datetime.fromisoformat(product['created_at'])
     return products
 
+@api_router.get("/products", response_model=List[Product])
+async def get_products(response: Response, category: Optional[str] = None, include_inactive: bool = False):
+    if include_inactive:
+        # The admin catalog view must reflect edits immediately, so it is never served stale
+        products = await singleflight.do('products', (category, include_inactive), lambda: load_products(category, include_inactive))
+    else:
+        products = await cached_read(response, 'products', category, lambda: load_products(category, False))
+    return present_products(products, cached=not include_inactive)
+
+async def load_product(product_id: str) -> Optional[dict]:
+    product = await db.products.find_one({"id": product_id}, PRODUCT_PROJECTION)
+    if product and isinstance(product['created_at'], str):
+        product['created_at'] = datetime.fromisoformat(product['created_at'])
+    return product
+
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
+async def get_product(product_id: str, response: Response):
+    product = await cached_read(response, 'product', product_id, lambda: load_product(product_id))
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
-    
-    if isinstance(product['created_at'], str):
-        product['created_at'] = datetime.fromisoformat(product['created_at'])
-    return product
+    return present_products([product])[0]
 
 @api_router.post("/products", response_model=Product)
 async def create_product(product_data: ProductCreate, admin = Depends(get_admin_user)):
     product = Product(**product_data.model_dump())
-    doc = product.model_dump()
+    doc = product.model_dump(exclude={'available_stock', 'image_renditions'})
     doc['created_at'] = doc['created_at'].isoformat()
     
     await db.products.insert_one(doc)
+    await register_image_sources([product.image_url])
+    storefront_cache.invalidate('products', 'featured')
+    catalog_snapshot.schedule_capture()
+    product.image_renditions = image_renditions(product.image_url)
     return product
 
 @api_router.put("/products/{product_id}", response_model=Product)
@@ -397,19 +1150,291 @@ async def update_product(product_id: str, product_data: ProductUpdate, admin = D
     update_data = {k: v for k, v in product_data.model_dump().items() if v is not None}
     if update_data:
         await db.products.update_one({"id": product_id}, {"$set": update_data})
+        if 'image_url' in update_data:
+            await register_image_sources([update_data['image_url']])
+        if 'stock' in update_data:
+            live_stock.invalidate()
+        storefront_cache.invalidate('products', 'featured', 'product')
+        catalog_snapshot.schedule_capture()
     
-    updated = await db.products.find_one({"id": product_id}, {"_id": 0})
+    updated = await db.products.find_one({"id": product_id}, PRODUCT_PROJECTION)
     if isinstance(updated['created_at'], str):
         updated['created_at'] = datetime.fromisoformat(updated['created_at'])
-    return Product(**updated)
+    return Product(**present_products([updated], cached=False)[0])
 
 @api_router.delete("/products/{product_id}")
 async def delete_product(product_id: str, admin = Depends(get_admin_user)):
     result = await db.products.delete_one({"id": product_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Product not found")
+    storefront_cache.invalidate('products', 'featured', 'product')
+    catalog_snapshot.schedule_capture()
     return {"message": "Product deleted"}
 
+# Line item snapshots
+LINE_SNAPSHOT_PROJECTION = {"_id": 0, "id": 1, "name": 1, "image_url": 1}
+
+def variant_summary(customization: Optional[dict]) -> Optional[str]:
+    """Render a line's customization as text, e.g. "cookies: Kaastengel, Nastar; babka: Chocolate"""
+    if not customization:
+        return None
+    parts = []
+    if customization.get('variant_types'):
+        for variant_type, variants in customization['variant_types'].items():
+            variants = variants if isinstance(variants, list) else [variants]
+            if variants:
+                parts.append(f"{variant_type}: {', '.join(variants)}")
+    else:
+        variants = customization.get('variants') or customization.get('selected_variants')
+        if variants:
+            parts.append(', '.join(variants) if isinstance(variants, list) else str(variants))
+    return '; '.join(parts) or None
+
+def line_snapshot(product: dict, customization: Optional[dict]) -> dict:
+    return {
+        "product_name": product['name'],
+        "image_url": product.get('image_url'),
+        "variant_summary": variant_summary(customization)
+    }
+
+async def fill_line_snapshots(items: List[dict], refresh: bool = False) -> List[dict]:
+    """Fill name, image and variant summary on lines missing them using one $in product lookup"""
+    stale = [item for item in items if refresh or not item.get('product_name')]
+    product_ids = list({item['product_id'] for item in stale})
+    if not product_ids:
+        return items
+    products = await db.products.find({"id": {"$in": product_ids}}, LINE_SNAPSHOT_PROJECTION).to_list(len(product_ids))
+    products_by_id = {product['id']: product for product in products}
+    for item in stale:
+        product = products_by_id.get(item['product_id'])
+        if product:
+            item.update(line_snapshot(product, item.get('customization')))
+    return items
+
+# Cart stock holds
+# Adding to the cart holds that quantity for CART_HOLD_MINUTES. Holds live in stock_holds with a
+# TTL index on expires_at, so MongoDB drops abandoned ones without a cron job. Every worker keeps
+# the active holds in memory, synced by a change stream (polling on standalone mongod), so
+# availability is stock minus held quantity without aggregating holds per request.
+CART_HOLD_MINUTES = float(os.getenv('CART_HOLD_MINUTES', '15'))  # 0 disables holds
+STOCK_HOLD_POLL_INTERVAL = float(os.getenv('STOCK_HOLD_POLL_INTERVAL', '5'))
+
+def stock_hold_id(user_id: str, product_id: str) -> str:
+    return f"{user_id}:{product_id}"
+
+def as_utc(value: datetime) -> datetime:
+    # Motor returns naive datetimes that are already UTC
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+class StockHolds:
+    """Per-worker view of the active holds on each product"""
+
+    def __init__(self):
+        self.by_product = defaultdict(dict)  # product_id -> {hold_id: (quantity, expires_at)}
+        self.products = {}  # hold_id -> product_id, since delete events only carry the _id
+        self.mode = None
+        self._task = None
+
+    def apply(self, hold: dict):
+        self.discard(hold['_id'])
+        self.products[hold['_id']] = hold['product_id']
+        self.by_product[hold['product_id']][hold['_id']] = (hold['quantity'], as_utc(hold['expires_at']))
+
+    def discard(self, hold_id: str):
+        product_id = self.products.pop(hold_id, None)
+        if product_id is not None:
+            holds = self.by_product[product_id]
+            holds.pop(hold_id, None)
+            if not holds:
+                del self.by_product[product_id]
+
+    def discard_user(self, user_id: str):
+        for hold_id in [hold_id for hold_id in self.products if hold_id.startswith(f"{user_id}:")]:
+            self.discard(hold_id)
+
+    def held(self, product_id: str, exclude: Optional[str] = None) -> int:
+        """Quantity held by unexpired holds; the TTL monitor can lag, so expiry is checked here too"""
+        now = datetime.now(timezone.utc)
+        return sum(
+            quantity for hold_id, (quantity, expires_at) in self.by_product.get(product_id, {}).items()
+            if expires_at > now and hold_id != exclude
+        )
+
+    def available(self, product: dict, exclude: Optional[str] = None) -> int:
+        return max(product.get('stock', 0) - self.held(product['id'], exclude), 0)
+
+    async def load(self):
+        holds = await db.stock_holds.find({"expires_at": {"$gt": datetime.now(timezone.utc)}}).to_list(None)
+        self.by_product.clear()
+        self.products.clear()
+        for hold in holds:
+            self.apply(hold)
+        metrics.set('stock_holds_active', len(self.products))
+
+    async def start(self):
+        # The watcher reloads on its own, so it must run even when this initial load fails
+        self.watch()
+        await self.load()
+
+    def watch(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._supervise())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def _supervise(self):
+        while True:
+            try:
+                await self._run()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.inc('stock_hold_watcher_restarts_total')
+                logger.error("Stock hold watcher failed, restarting: %s", e)
+                self.mode = None
+                await asyncio.sleep(STOCK_HOLD_POLL_INTERVAL)
+
+    async def _run(self):
+        try:
+            await self._watch_change_stream()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("Stock hold change stream unavailable (%s), polling instead", e)
+        await self._poll()
+
+    async def _watch_change_stream(self):
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace", "delete"]}}}]
+        while True:
+            try:
+                async with db.stock_holds.watch(pipeline, full_document='updateLookup') as stream:
+                    self.mode = 'change_stream'
+                    # Reload once the stream is open so nothing between snapshot and stream is missed
+                    await self.load()
+                    async for change in stream:
+                        hold = change.get('fullDocument')
+                        if hold:
+                            self.apply(hold)
+                        else:
+                            self.discard(change['documentKey']['_id'])
+                        metrics.set('stock_holds_active', len(self.products))
+            except PyMongoError as e:
+                # Standalone servers reject $changeStream outright; anything else is retried
+                if self.mode is None or getattr(e, 'code', None) == 40573:
+                    raise
+                logger.warning("Stock hold change stream interrupted, reopening: %s", e)
+                await asyncio.sleep(1)
+
+    async def _poll(self):
+        self.mode = 'polling'
+        while True:
+            await asyncio.sleep(STOCK_HOLD_POLL_INTERVAL)
+            try:
+                await self.load()
+            except Exception as e:
+                logger.warning("Stock hold poll failed: %s", e)
+
+stock_holds = StockHolds()
+
+# Live stock
+# Cached catalog documents can be minutes old while stock moves with every checkout, so
+# storefront responses take stock from a small id -> stock map instead, much like holds are
+# overlaid from memory. The map is reloaded in the background once it is older than
+# STOREFRONT_STOCK_FRESH_SECONDS and right after this worker changes stock.
+STOREFRONT_STOCK_FRESH_SECONDS = float(os.getenv('STOREFRONT_STOCK_FRESH_SECONDS', '2'))
+
+class LiveStock:
+    """Per-worker map of current stock levels, overlaid onto cached product documents"""
+
+    def __init__(self):
+        self.levels = {}
+        self.loaded_at = None
+        self._task = None
+        self._pending = False
+
+    def overlay(self, products: List[dict]) -> List[dict]:
+        if self.loaded_at is None or time.monotonic() - self.loaded_at >= STOREFRONT_STOCK_FRESH_SECONDS:
+            self.schedule_refresh()
+        for product in products:
+            stock = self.levels.get(product['id'])
+            if stock is not None:
+                product['stock'] = stock
+        return products
+
+    def invalidate(self):
+        self.loaded_at = None
+        self.schedule_refresh()
+
+    def schedule_refresh(self):
+        """Reload in the background; a change arriving mid-load triggers one more run"""
+        if self._task and not self._task.done():
+            self._pending = True
+            return
+        self._task = asyncio.get_running_loop().create_task(self._refresh())
+
+    async def _refresh(self):
+        while True:
+            self._pending = False
+            try:
+                products = await db.products.find({}, {"_id": 0, "id": 1, "stock": 1}).to_list(None)
+            except PyMongoError as e:
+                # Keep overlaying the last levels and try again after the freshness window
+                self.loaded_at = time.monotonic()
+                metrics.inc('live_stock_refresh_failures_total')
+                logger.warning("Could not refresh live stock levels: %s", e)
+                return
+            self.levels = {product['id']: product.get('stock', 0) for product in products}
+            self.loaded_at = time.monotonic()
+            if not self._pending:
+                return
+
+live_stock = LiveStock()
+
+def with_availability(products: List[dict]) -> List[dict]:
+    for product in products:
+        product['available_stock'] = stock_holds.available(product)
+    return products
+
+async def set_stock_hold(user_id: str, product_id: str, quantity: int) -> Optional[datetime]:
+    """Hold quantity of a product for the user's cart and restart its expiry; 0 releases the hold"""
+    if CART_HOLD_MINUTES <= 0:
+        return None
+    hold_id = stock_hold_id(user_id, product_id)
+    if quantity <= 0:
+        await db.stock_holds.delete_one({"_id": hold_id})
+        stock_holds.discard(hold_id)
+        return None
+    now = datetime.now(timezone.utc)
+    hold = {
+        "_id": hold_id,
+        "user_id": user_id,
+        "product_id": product_id,
+        "quantity": quantity,
+        "updated_at": now.isoformat(),
+        # BSON date, not an ISO string: the TTL index only expires date values
+        "expires_at": now + timedelta(minutes=CART_HOLD_MINUTES)
+    }
+    await db.stock_holds.replace_one({"_id": hold_id}, hold, upsert=True)
+    # Apply locally too so this worker's next read doesn't wait for the change stream
+    stock_holds.apply(hold)
+    return hold['expires_at']
+
+async def release_stock_holds(user_id: str):
+    await db.stock_holds.delete_many({"user_id": user_id})
+    stock_holds.discard_user(user_id)
+
+def ensure_available(product: dict, user_id: str, quantity: int):
+    """409 unless quantity fits in stock not held by other customers. Best effort: checkout re-checks atomically"""
+    available = stock_holds.available(product, exclude=stock_hold_id(user_id, product['id']))
+    if quantity > available:
+        raise HTTPException(status_code=409, detail=f"Only {available} {product['name']} available")
+
+def cart_quantity(items: List[dict], product_id: str) -> int:
+    return sum(item['quantity'] for item in items if item['product_id'] == product_id)
+
 # Cart endpoints
 @api_router.get("/cart", response_model=Cart)
 async def get_cart(current_user = Depends(get_current_user)):
@@ -422,13 +1447,15 @@ async def get_cart(current_user = Depends(get_current_user)):
     else:
         if isinstance(cart['updated_at'], str):
             cart['updated_at'] = datetime.fromisoformat(cart['updated_at'])
+        # Lines added before snapshots existed
+        await fill_line_snapshots(cart['items'])
         cart = Cart(**cart)
     return cart
 
 @api_router.post("/cart/add")
 async def add_to_cart(item: CartItemAdd, current_user = Depends(get_current_user)):
     # Get product to verify price
-    product = await db.products.find_one({"id": item.product_id}, {"_id": 0})
+    product = await db.products.find_one({"id": item.product_id}, PRODUCT_PROJECTION)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
@@ -461,11 +1488,14 @@ async def add_to_cart(item: CartItemAdd, current_user = Depends(get_current_user
         product_id=item.product_id,
         quantity=item.quantity,
         customization=item.customization,
-        price=price
+        price=price,
+        **line_snapshot(product, item.customization)
     )
     
     # Get or create cart
     cart = await db.carts.find_one({"user_id": current_user['user_id']}, {"_id": 0})
+    held_quantity = cart_quantity(cart['items'] if cart else [], item.product_id) + item.quantity
+    ensure_available(product, current_user['user_id'], held_quantity)
     if not cart:
         cart = Cart(user_id=current_user['user_id'], items=[cart_item.model_dump()])
         doc = cart.model_dump()
@@ -488,7 +1518,8 @@ async def add_to_cart(item: CartItemAdd, current_user = Depends(get_current_user
             {"$set": {"items": cart['items'], "updated_at": datetime.now(timezone.utc).isoformat()}}
         )
     
-    return {"message": "Item added to cart"}
+    hold_expires_at = await set_stock_hold(current_user['user_id'], item.product_id, held_quantity)
+    return {"message": "Item added to cart", "hold_expires_at": hold_expires_at.isoformat() if hold_expires_at else None}
 
 @api_router.delete("/cart/item/{product_id}")
 async def remove_from_cart(product_id: str, current_user = Depends(get_current_user)):
@@ -499,6 +1530,7 @@ async def remove_from_cart(product_id: str, current_user = Depends(get_current_u
             {"user_id": current_user['user_id']},
             {"$set": {"items": cart['items'], "updated_at": datetime.now(timezone.utc).isoformat()}}
         )
+    await set_stock_hold(current_user['user_id'], product_id, 0)
     return {"message": "Item removed from cart"}
 
 class CartItemUpdate(BaseModel):
@@ -511,6 +1543,7 @@ async def update_cart_item_quantity(product_id: str, update_data: CartItemUpdate
         raise HTTPException(status_code=404, detail="Cart not found")
     
     # Find and update the item
+    previous_quantity = cart_quantity(cart['items'], product_id)
     item_found = False
     for item in cart['items']:
         if item['product_id'] == product_id:
@@ -525,10 +1558,17 @@ async def update_cart_item_quantity(product_id: str, update_data: CartItemUpdate
     if not item_found:
         raise HTTPException(status_code=404, detail="Item not found in cart")
     
+    held_quantity = cart_quantity(cart['items'], product_id)
+    if held_quantity > previous_quantity:
+        product = await db.products.find_one({"id": product_id}, {"_id": 0, "id": 1, "name": 1, "stock": 1})
+        if product:
+            ensure_available(product, current_user['user_id'], held_quantity)
+    
     await db.carts.update_one(
         {"user_id": current_user['user_id']},
         {"$set": {"items": cart['items'], "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    await set_stock_hold(current_user['user_id'], product_id, held_quantity)
     return {"message": "Cart updated"}
 
 @api_router.post("/cart/clear")
@@ -537,26 +1577,346 @@ async def clear_cart(current_user = Depends(get_current_user)):
         {"user_id": current_user['user_id']},
         {"$set": {"items": [], "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
+    await release_stock_holds(current_user['user_id'])
     return {"message": "Cart cleared"}
 
+# Stock reservation
+# Checkout decrements stock for all lines in one bulk write, each conditional on enough stock.
+# Every successful decrement also pushes the order id onto a marker list on the product, so a
+# partial failure can undo exactly the decrements that applied and nothing else. The list is not
+# capped (a flash sale can have any number of checkouts in flight); markers are pulled once the
+# order commits.
+
+def stock_quantities(items: List[dict]) -> dict:
+    quantities = defaultdict(int)
+    for item in items:
+        quantities[item['product_id']] += item['quantity']
+    return quantities
+
+async def release_stock(reservation_id: str, quantities: dict, expected: Optional[int] = None) -> int:
+    """Undo a reservation's decrements; `expected` is how many lines it reserved (default: all)"""
+    result = await db.products.bulk_write([
+        UpdateOne(
+            {"id": product_id, "stock_reservations": reservation_id},
+            {"$inc": {"stock": quantity}, "$pull": {"stock_reservations": reservation_id}}
+        )
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+    live_stock.invalidate()
+    expected = len(quantities) if expected is None else expected
+    if result.modified_count < expected:
+        # A marker went missing, so that stock could not be returned; needs a manual stock check
+        metrics.inc('stock_release_misses_total', expected - result.modified_count)
+        logger.error("Stock release for %s restored %d of %d lines", reservation_id, result.modified_count, expected)
+    return result.modified_count
+
+async def settle_stock_reservation(reservation_id: str, product_ids):
+    """Drop the reservation markers once the order is committed and can no longer roll back"""
+    try:
+        await db.products.update_many({"id": {"$in": list(product_ids)}}, {"$pull": {"stock_reservations": reservation_id}})
+    except PyMongoError as e:
+        # Only leaves a stale marker behind; stock is already correct
+        logger.warning("Could not clear stock reservation markers for %s: %s", reservation_id, e)
+
+async def reserve_stock(reservation_id: str, items: List[dict], held: Optional[dict] = None):
+    """Decrement stock for every line or for none of them; 409 names the short products.
+
+    `held` maps product ids to quantities other customers hold in their carts, which stay untouchable.
+    """
+    quantities = stock_quantities(items)
+    if not quantities:
+        return
+    held = held or {}
+    result = await db.products.bulk_write([
+        UpdateOne(
+            {"id": product_id, "stock": {"$gte": quantity + held.get(product_id, 0)}},
+            {
+                "$inc": {"stock": -quantity},
+                "$push": {"stock_reservations": reservation_id}
+            }
+        )
+        for product_id, quantity in quantities.items()
+    ], ordered=False)
+    if result.modified_count == len(quantities):
+        metrics.inc('stock_reservations_total', result='reserved')
+        live_stock.invalidate()
+        return
+    
+    # Compensate the lines that did reserve, then report the ones that could not
+    await release_stock(reservation_id, quantities, expected=result.modified_count)
+    metrics.inc('stock_reservations_total', result='insufficient')
+    products = await db.products.find({"id": {"$in": list(quantities)}}, {"_id": 0, "id": 1, "name": 1, "stock": 1}).to_list(len(quantities))
+    products_by_id = {product['id']: product for product in products}
+    short = []
+    for product_id, quantity in quantities.items():
+        product = products_by_id.get(product_id)
+        if not product:
+            short.append(f"{product_id} (no longer available)")
+        elif product.get('stock', 0) - held.get(product_id, 0) < quantity:
+            short.append(f"{product['name']} (only {max(product.get('stock', 0) - held.get(product_id, 0), 0)} left)")
+    raise HTTPException(status_code=409, detail=f"Insufficient stock: {', '.join(short) or 'please try again'}")
+
+async def return_stock(items: List[dict]):
+    """Unconditionally put stock back, e.g. when an order is cancelled"""
+    quantities = stock_quantities(items)
+    if quantities:
+        await db.products.bulk_write([
+            UpdateOne({"id": product_id}, {"$inc": {"stock": quantity}})
+            for product_id, quantity in quantities.items()
+        ], ordered=False)
+        live_stock.invalidate()
+
+# Sales rollups
+# One sales_daily document per local calendar day, maintained with $inc as orders are
+# placed and change status, so dashboards read days rather than orders. Like the analytics
+# reports, the headline figures (orders, revenue, items, products) leave cancelled orders out;
+# those only show up under statuses.cancelled and status_revenue.cancelled.
+SALES_TZ = timezone(timedelta(hours=float(os.getenv('SALES_TZ_OFFSET_HOURS', '7'))))  # WIB
+
+def sales_day(created_at) -> str:
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    if created_at.tzinfo is None:
+        created_at = created_at.replace(tzinfo=timezone.utc)
+    return created_at.astimezone(SALES_TZ).date().isoformat()
+
+def order_rollup_update(order: dict, sign: int = 1) -> dict:
+    status = order.get('status', 'pending')
+    final_amount = order.get('final_amount', 0)
+    inc = defaultdict(int)
+    inc[f'statuses.{status}'] += sign
+    inc[f'status_revenue.{status}'] += sign * final_amount
+    if status == 'cancelled':
+        return {"$inc": dict(inc), "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}}
+    inc['orders'] += sign
+    inc['revenue'] += sign * final_amount
+    inc['gross_revenue'] += sign * order.get('total_amount', 0)
+    inc['discount_total'] += sign * (order.get('discount_amount') or 0)
+    names = {}
+    for item in order.get('items', []):
+        inc['items_sold'] += sign * item['quantity']
+        inc[f"products.{item['product_id']}.quantity"] += sign * item['quantity']
+        inc[f"products.{item['product_id']}.revenue"] += sign * item['price'] * item['quantity']
+        if item.get('product_name'):
+            names[f"products.{item['product_id']}.name"] = item['product_name']
+    return {"$inc": dict(inc), "$set": {**names, "updated_at": datetime.now(timezone.utc).isoformat()}}
+
+async def record_order_rollup(order: dict):
+    try:
+        await db.sales_daily.update_one({"date": sales_day(order['created_at'])}, order_rollup_update(order), upsert=True)
+    except PyMongoError as e:
+        # The order is already placed; a rebuild from /admin/analytics/sales/rebuild repairs the rollup
+        logger.error("Failed to record sales rollup for order %s: %s", order.get('id'), e)
+
+def status_rollup_update(order: dict, new_status: str) -> dict:
+    """Move an order from its current status to new_status; cancelling takes it out of the totals"""
+    removed = order_rollup_update(order, -1)
+    added = order_rollup_update({**order, "status": new_status})
+    inc = defaultdict(int, removed['$inc'])
+    for path, value in added['$inc'].items():
+        inc[path] += value
+    # Between two open statuses only the status fields move
+    return {"$inc": {path: value for path, value in inc.items() if value}, "$set": added['$set']}
+
+async def record_status_rollup(order: dict, new_status: str):
+    if order.get('status', 'pending') == new_status:
+        return
+    try:
+        await db.sales_daily.update_one({"date": sales_day(order['created_at'])}, status_rollup_update(order, new_status), upsert=True)
+    except PyMongoError as e:
+        logger.error("Failed to record status rollup for order %s: %s", order.get('id'), e)
+
+# Idempotency keys
+# Clients send `Idempotency-Key` on order creation and payment-proof upload so retries over flaky
+# connections replay the first response instead of repeating the work. Keys are scoped to the
+# user and route, claimed with a unique insert, and expire through a TTL index.
+IDEMPOTENCY_TTL_HOURS = float(os.getenv('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_LOCK_SECONDS = float(os.getenv('IDEMPOTENCY_LOCK_SECONDS', '60'))  # reclaim keys left pending by a crash
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+
+def request_fingerprint(*parts) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part if isinstance(part, bytes) else str(part).encode())
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+async def claim_idempotency_key(key: str, fingerprint: str) -> Optional[dict]:
+    """Claim key for this request; returns the stored record when another request already holds it"""
+    now = datetime.now(timezone.utc)
+    record = {
+        "key": key,
+        "fingerprint": fingerprint,
+        "status": "pending",
+        "locked_at": now.isoformat(),
+        "created_at": now.isoformat(),
+        # BSON date, not an ISO string: the TTL index only expires date values
+        "expires_at": now + timedelta(hours=IDEMPOTENCY_TTL_HOURS)
+    }
+    try:
+        await db.idempotency_keys.insert_one(record)
+        return None
+    except DuplicateKeyError:
+        pass
+    stale = (now - timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)).isoformat()
+    reclaimed = await db.idempotency_keys.update_one(
+        {"key": key, "fingerprint": fingerprint, "status": "pending", "locked_at": {"$lt": stale}},
+        {"$set": {"locked_at": now.isoformat()}}
+    )
+    if reclaimed.modified_count:
+        return None
+    return await db.idempotency_keys.find_one({"key": key}, {"_id": 0}) or {"status": "pending", "fingerprint": fingerprint}
+
+async def settle_idempotency_key(key: str, outcome: Optional[dict] = None):
+    """Store the outcome for replay, or free the key (outcome None) so a retry runs the request again"""
+    async def settle():
+        if outcome is None:
+            await db.idempotency_keys.delete_one({"key": key})
+        else:
+            await db.idempotency_keys.update_one({"key": key}, {"$set": {"status": "completed", **outcome}})
+    
+    try:
+        # Shielded so a cancelled request still finishes the write
+        await asyncio.shield(settle())
+    except PyMongoError as e:
+        # The key stays pending until IDEMPOTENCY_LOCK_SECONDS pass, then a retry reclaims it
+        metrics.inc('idempotency_settle_failures_total')
+        logger.warning("Could not settle idempotency key %s: %s", key, e)
+
+async def no_commit_hook(result):
+    pass
+
+async def run_idempotent(idempotency_key: Optional[str], user_id: str, route: str, fingerprint: str, handler):
+    """Run handler(committed) once per key; retries with the same key get the stored response back.
+
+    Handlers whose write is followed by more work call `await committed(response)` as soon as the
+    write is durable: the response is stored for replay then, and a later failure no longer frees
+    the key, since a retry would repeat the write.
+    """
+    if not idempotency_key:
+        return await handler(no_commit_hook)
+    if len(idempotency_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+        raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+    
+    key = f"{user_id}:{route}:{idempotency_key}"
+    existing = await claim_idempotency_key(key, fingerprint)
+    if existing:
+        if existing['fingerprint'] != fingerprint:
+            metrics.inc('idempotency_requests_total', route=route, result='mismatch')
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        if existing['status'] == 'pending':
+            metrics.inc('idempotency_requests_total', route=route, result='in_progress')
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed", headers={"Retry-After": "1"})
+        metrics.inc('idempotency_requests_total', route=route, result='replayed')
+        return JSONResponse(existing['response'], status_code=existing['status_code'], headers={"Idempotent-Replayed": "true"})
+    
+    stored = False
+    
+    async def committed(result):
+        nonlocal stored
+        stored = True
+        await settle_idempotency_key(key, {"status_code": 200, "response": jsonable_encoder(result)})
+        metrics.inc('idempotency_requests_total', route=route, result='stored')
+    
+    try:
+        result = await handler(committed)
+    except HTTPException as e:
+        if stored:
+            raise
+        if e.status_code >= 500:
+            await settle_idempotency_key(key)
+            raise
+        # Client errors are part of the outcome: replay them rather than re-running the request
+        await settle_idempotency_key(key, {"status_code": e.status_code, "response": {"detail": e.detail}})
+        raise
+    except BaseException:
+        # Failed before the write committed: nothing to replay, so free the key for the retry
+        if not stored:
+            await settle_idempotency_key(key)
+        raise
+    if not stored:
+        await committed(result)
+    return result
+
+# Checkout transactions
+# On a replica set the order insert, cart clear and hold release commit together, so a crash
+# can't leave a placed order with a full cart. Stock reservation and the sales rollup stay
+# outside: they update hot shared documents (one product, one day) where transactions would
+# abort on write conflicts under load, and both already recover on their own.
+CHECKOUT_TRANSACTIONS = os.getenv('CHECKOUT_TRANSACTIONS', 'auto')  # auto | off
+transaction_support = {"checked": False, "supported": False}
+
+async def supports_transactions() -> bool:
+    """Multi-document transactions need a replica set or sharded cluster; checked once per worker"""
+    if CHECKOUT_TRANSACTIONS == 'off':
+        return False
+    if not transaction_support['checked']:
+        try:
+            hello = await db.command('hello')
+        except PyMongoError as e:
+            logger.warning("Could not determine transaction support, checking out without: %s", e)
+            return False
+        transaction_support['supported'] = bool(hello.get('setName')) or hello.get('msg') == 'isdbgrid'
+        transaction_support['checked'] = True
+        logger.info("Checkout transactions %s", "enabled" if transaction_support['supported'] else "unavailable (standalone mongod)")
+    return transaction_support['supported']
+
+async def clear_checkout_cart(user_id: str, session=None):
+    await db.carts.update_one(
+        {"user_id": user_id},
+        {"$set": {"items": [], "updated_at": datetime.now(timezone.utc).isoformat()}},
+        session=session
+    )
+    await db.stock_holds.delete_many({"user_id": user_id}, session=session)
+
+async def commit_order(doc: dict, user_id: str, session):
+    # Session operations must run one at a time, so these are sequential by design
+    await db.orders.insert_one(doc, session=session)
+    await clear_checkout_cart(user_id, session)
+
 # Order endpoints
 @api_router.post("/orders", response_model=Order)
-async def create_order(order_data: OrderCreate, current_user = Depends(get_current_user)):
+async def create_order(order_data: OrderCreate, current_user = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
+    return await run_idempotent(
+        idempotency_key,
+        current_user['user_id'],
+        'create_order',
+        request_fingerprint(order_data.model_dump_json()),
+        lambda committed: place_order(order_data, current_user, committed)
+    )
+
+async def active_discount(code: Optional[str]) -> Optional[dict]:
+    if not code:
+        return None
+    return await db.discounts.find_one({"code": code, "active": True}, {"_id": 0})
+
+async def place_order(order_data: OrderCreate, current_user: dict, committed=no_commit_hook) -> Order:
+    started = time.perf_counter()
+    user_id = current_user['user_id']
+    
     # Calculate amounts
     total = sum(item.price * item.quantity for item in order_data.items)
     
+    # Independent reads in one round of concurrent queries: catalog snapshot for the lines
+    # (names come from the catalog, not the client's copy), discount, order count for the
+    # order number, and the customer snapshot so admin views never join back to users
+    items, discount, order_count, user = await asyncio.gather(
+        fill_line_snapshots([item.model_dump() for item in order_data.items], refresh=True),
+        active_discount(order_data.discount_code),
+        db.orders.count_documents({}),
+        db.users.find_one({"id": user_id}, CUSTOMER_SNAPSHOT_PROJECTION)
+    )
+    
     # Shipping fee - no longer calculated, will be informed separately
     shipping_fee = 0
     
     # Discount
     discount_amount = 0
-    if order_data.discount_code:
-        discount = await db.discounts.find_one({"code": order_data.discount_code, "active": True}, {"_id": 0})
-        if discount and total >= discount['min_purchase']:
-            if discount['discount_type'] == 'percentage':
-                discount_amount = total * (discount['discount_value'] / 100)
-            else:
-                discount_amount = discount['discount_value']
+    if discount and total >= discount['min_purchase']:
+        if discount['discount_type'] == 'percentage':
+            discount_amount = total * (discount['discount_value'] / 100)
+        else:
+            discount_amount = discount['discount_value']
     
     final_amount = total + shipping_fee - discount_amount
     
@@ -568,16 +1928,17 @@ async def create_order(order_data: OrderCreate, current_user = Depends(get_curre
         payment_amount = final_amount
     
     # Generate order number
-    order_count = await db.orders.count_documents({}) + 1
-    order_number = f"MB{datetime.now().strftime('%Y%m%d')}{order_count:04d}"
+    order_number = f"MB{datetime.now().strftime('%Y%m%d')}{order_count + 1:04d}"
     
     order = Order(
         order_number=order_number,
-        user_id=current_user['user_id'],
-        items=order_data.items,
+        user_id=user_id,
+        customer=customer_snapshot(user) if user else None,
+        items=items,
         total_amount=total,
         shipping_fee=shipping_fee,
         discount_amount=discount_amount,
+        discount_code=order_data.discount_code if discount_amount else None,
         final_amount=final_amount,
         payment_type=payment_type,
         payment_amount=payment_amount,
@@ -591,28 +1952,88 @@ async def create_order(order_data: OrderCreate, current_user = Depends(get_curre
     doc = order.model_dump()
     doc['created_at'] = doc['created_at'].isoformat()
     doc['updated_at'] = doc['updated_at'].isoformat()
+    doc['stock_reserved'] = True
     
-    await db.orders.insert_one(doc)
+    # Other customers' unexpired cart holds are off limits; this customer's own hold is being spent
+    held = {
+        product_id: stock_holds.held(product_id, exclude=stock_hold_id(user_id, product_id))
+        for product_id in stock_quantities(items)
+    }
+    await reserve_stock(order.id, items, held)
     
-    # Clear cart
-    await db.carts.update_one(
-        {"user_id": current_user['user_id']},
-        {"$set": {"items": [], "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    mode = 'transaction' if await supports_transactions() else 'standalone'
+    try:
+        if mode == 'transaction':
+            async with await client.start_session() as session:
+                await session.with_transaction(lambda session: commit_order(doc, user_id, session))
+        else:
+            await db.orders.insert_one(doc)
+    except BaseException:
+        await release_stock(order.id, stock_quantities(items))
+        raise
+    # The order is placed: from here on nothing may fail the request, or a retry would place it twice
+    await committed(order)
+    await settle_stock_reservation(order.id, stock_quantities(items))
+    if mode == 'standalone':
+        # Without transactions the order stands on its own; clearing the cart is best effort
+        try:
+            await clear_checkout_cart(user_id)
+        except PyMongoError as e:
+            logger.warning("Could not clear the cart of %s after order %s: %s", user_id, order.id, e)
+    stock_holds.discard_user(user_id)
+    await record_order_rollup(doc)
     
+    metrics.observe('checkout_seconds', time.perf_counter() - started, mode=mode)
     return order
 
 @api_router.post("/orders/{order_id}/payment-proof")
-async def upload_payment_proof(order_id: str, file: UploadFile = File(...), current_user = Depends(get_current_user)):
-    # Read file and encode to base64
+async def upload_payment_proof(order_id: str, file: UploadFile = File(...), current_user = Depends(get_current_user), idempotency_key: Optional[str] = Header(None)):
     contents = await file.read()
-    base64_encoded = base64.b64encode(contents).decode('utf-8')
-    file_data = f"data:{file.content_type};base64,{base64_encoded}"
+    return await run_idempotent(
+        idempotency_key,
+        current_user['user_id'],
+        'upload_payment_proof',
+        request_fingerprint(order_id, file.content_type, contents),
+        lambda committed: save_payment_proof(order_id, contents, current_user)
+    )
+
+# Payment proofs
+# Uploads are phone photos of several MB. A media pool worker re-encodes each one as a JPEG
+# without metadata (no GPS or device details), scaled to fit PAYMENT_PROOF_MAX_SIZE, plus a
+# thumbnail that admin listings show instead of the full proof.
+PAYMENT_PROOF_MAX_SIZE = int(os.getenv('PAYMENT_PROOF_MAX_SIZE', '1600'))  # longest side in pixels
+PAYMENT_PROOF_THUMBNAIL_SIZE = int(os.getenv('PAYMENT_PROOF_THUMBNAIL_SIZE', '320'))
+PAYMENT_PROOF_QUALITY = int(os.getenv('PAYMENT_PROOF_QUALITY', '82'))
+PAYMENT_PROOF_MAX_BYTES = int(os.getenv('PAYMENT_PROOF_MAX_BYTES', str(15 * 1024 * 1024)))
+
+def jpeg_data_url(data: bytes) -> str:
+    return f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}"
+
+async def compress_payment_proof(contents: bytes) -> dict:
+    """Fields to store for an uploaded proof: the compressed proof and its thumbnail as data URLs"""
+    proof, thumbnail = await run_in_media_pool(
+        imaging.compress_payment_proof, contents, PAYMENT_PROOF_MAX_SIZE, PAYMENT_PROOF_THUMBNAIL_SIZE, PAYMENT_PROOF_QUALITY
+    )
+    metrics.inc('payment_proof_bytes_total', len(contents), stage='in')
+    metrics.inc('payment_proof_bytes_total', len(proof), stage='out')
+    return {
+        "payment_proof": jpeg_data_url(proof),
+        "payment_proof_thumbnail": jpeg_data_url(thumbnail),
+        "has_payment_proof": True
+    }
+
+async def save_payment_proof(order_id: str, contents: bytes, current_user: dict) -> dict:
+    if len(contents) > PAYMENT_PROOF_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Payment proof is too large")
+    try:
+        fields = await compress_payment_proof(contents)
+    except (OSError, ValueError):
+        raise HTTPException(status_code=400, detail="Payment proof must be an image (JPEG, PNG or WebP)")
     
     # Update order
     result = await db.orders.update_one(
         {"id": order_id, "user_id": current_user['user_id']},
-        {"$set": {"payment_proof": file_data, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {**fields, "updated_at": datetime.now(timezone.utc).isoformat()}}
     )
     
     if result.modified_count == 0:
@@ -620,6 +2041,27 @@ async def upload_payment_proof(order_id: str, file: UploadFile = File(...), curr
     
     return {"message": "Payment proof uploaded"}
 
+async def backfill_payment_proofs() -> int:
+    """Compress proofs uploaded before thumbnails existed, one order at a time"""
+    order_ids = await db.orders.distinct("id", {"payment_proof": {"$ne": None}, "has_payment_proof": {"$ne": True}})
+    updated = 0
+    for order_id in order_ids:
+        order = await db.orders.find_one({"id": order_id}, {"_id": 0, "payment_proof": 1})
+        try:
+            fields = await compress_payment_proof(base64.b64decode(order['payment_proof'].partition(',')[2]))
+        except (OSError, ValueError) as e:
+            # Keep the original; the flag still lets admins open it from the listing
+            logger.warning("Could not compress payment proof of order %s: %s", order_id, e)
+            fields = {"has_payment_proof": True}
+        # Skip orders whose proof was replaced meanwhile; the new upload is already compressed.
+        # Bump updated_at so delta sync and the live feed deliver the new thumbnail.
+        fields['updated_at'] = datetime.now(timezone.utc).isoformat()
+        result = await db.orders.update_one({"id": order_id, "payment_proof": order['payment_proof']}, {"$set": fields})
+        updated += result.modified_count
+    if updated:
+        logger.info("Backfilled payment proof thumbnails on %d orders", updated)
+    return updated
+
 @api_router.get("/orders", response_model=List[Order])
 async def get_orders(current_user = Depends(get_current_user)):
     orders = await db.orders.find({"user_id": current_user['user_id']}, {"_id": 0}).sort("created_at", -1).to_list(1000)
@@ -636,6 +2078,7 @@ async def get_order(order_id: str, current_user = Depends(get_current_user)):
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
+    await fill_line_snapshots(order['items'])
     if isinstance(order['created_at'], str):
         order['created_at'] = datetime.fromisoformat(order['created_at'])
     if isinstance(order['updated_at'], str):
@@ -643,108 +2086,460 @@ async def get_order(order_id: str, current_user = Depends(get_current_user)):
     return order
 
 # Admin endpoints
+CUSTOMER_SNAPSHOT_PROJECTION = {"_id": 0, "id": 1, "full_name": 1, "whatsapp": 1, "email": 1}
+CUSTOMER_BACKFILL_BATCH = 200
+# Listings carry the proof thumbnail; the full proof is fetched per order when opened
+ORDER_LISTING_PROJECTION = {"_id": 0, "payment_proof": 0}
+
+def customer_snapshot(user: dict) -> dict:
+    return CustomerSnapshot(
+        full_name=user.get('full_name', 'Unknown'),
+        whatsapp=user.get('whatsapp', ''),
+        email=user.get('email', '')
+    ).model_dump()
+
+async def attach_customer_info(orders: List[dict]) -> List[dict]:
+    """Flatten each order's customer snapshot into customer_name/whatsapp/email.
+
+    Orders created before snapshots existed fall back to one batched users lookup.
+    """
+    missing = list({order['user_id'] for order in orders if not order.get('customer')})
+    users_by_id = {}
+    if missing:
+        users = await db.users.find({"id": {"$in": missing}}, CUSTOMER_SNAPSHOT_PROJECTION).to_list(len(missing))
+        users_by_id = {user['id']: customer_snapshot(user) for user in users}
+    for order in orders:
+        customer = order.get('customer') or users_by_id.get(order['user_id'], {})
+        order['customer_name'] = customer.get('full_name', 'Unknown')
+        order['customer_whatsapp'] = customer.get('whatsapp') or 'N/A'
+        order['customer_email'] = customer.get('email') or 'N/A'
+    return orders
+
+async def backfill_customer_snapshots() -> int:
+    """Embed customer snapshots on orders that predate them, one user batch at a time"""
+    user_ids = await db.orders.distinct("user_id", {"customer": None})
+    updated = 0
+    for i in range(0, len(user_ids), CUSTOMER_BACKFILL_BATCH):
+        batch = user_ids[i:i + CUSTOMER_BACKFILL_BATCH]
+        users = await db.users.find({"id": {"$in": batch}}, CUSTOMER_SNAPSHOT_PROJECTION).to_list(len(batch))
+        if not users:
+            continue
+        # Bump updated_at so delta sync and the live feed pick the new customer details up
+        now = datetime.now(timezone.utc).isoformat()
+        result = await db.orders.bulk_write([
+            UpdateMany({"user_id": user['id'], "customer": None}, {"$set": {"customer": customer_snapshot(user), "updated_at": now}})
+            for user in users
+        ], ordered=False)
+        updated += result.modified_count
+    if updated:
+        logger.info("Backfilled customer snapshots on %d orders", updated)
+    return updated
+
+async def sync_customer_snapshot(user_id: str):
+    user = await db.users.find_one({"id": user_id}, CUSTOMER_SNAPSHOT_PROJECTION)
+    if user:
+        snapshot = customer_snapshot(user)
+        # Only orders whose snapshot actually changes, so a no-op profile save doesn't resend every order
+        await db.orders.update_many(
+            {"user_id": user_id, "customer": {"$ne": snapshot}},
+            {"$set": {"customer": snapshot, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+
+@api_router.post("/admin/orders/backfill-customers")
+async def backfill_order_customers(admin = Depends(get_admin_user)):
+    return {"updated": await backfill_customer_snapshots()}
+
+@api_router.post("/admin/orders/backfill-payment-proofs")
+async def backfill_order_payment_proofs(admin = Depends(get_admin_user)):
+    updated = await run_under_lease('backfill_payment_proofs', backfill_payment_proofs)
+    if updated is None:
+        raise HTTPException(status_code=409, detail="Payment proof backfill is already running")
+    return {"updated": updated}
+
 @api_router.get("/admin/orders")
 async def get_all_orders(admin = Depends(get_admin_user)):
-    orders = await db.orders.find({}, {"_id": 0}).sort("created_at", -1).to_list(1000)
+    orders = await db.orders.find({}, ORDER_LISTING_PROJECTION).sort("created_at", -1).to_list(1000)
     
-    # Enrich orders with customer info
-    enriched_orders = []
     for order in orders:
         if isinstance(order['created_at'], str):
             order['created_at'] = datetime.fromisoformat(order['created_at'])
         if isinstance(order['updated_at'], str):
             order['updated_at'] = datetime.fromisoformat(order['updated_at'])
-        
-        # Get customer info
-        user = await db.users.find_one({"id": order['user_id']}, {"_id": 0})
-        if user:
-            order['customer_name'] = user.get('full_name', 'Unknown')
-            order['customer_whatsapp'] = user.get('whatsapp', 'N/A')
-            order['customer_email'] = user.get('email', 'N/A')
-        else:
-            order['customer_name'] = 'Unknown'
-            order['customer_whatsapp'] = 'N/A'
-            order['customer_email'] = 'N/A'
-        
-        enriched_orders.append(order)
     
-    return enriched_orders
+    # Enrich orders with customer info
+    return await attach_customer_info(orders)
+
+@api_router.get("/admin/orders/{order_id}/payment-proof")
+async def get_order_payment_proof(order_id: str, admin = Depends(get_admin_user)):
+    order = await db.orders.find_one({"id": order_id}, {"_id": 0, "payment_proof": 1})
+    if not order or not order.get('payment_proof'):
+        raise HTTPException(status_code=404, detail="Payment proof not found")
+    return {"payment_proof": order['payment_proof']}
+
+ORDER_CHANGES_LIMIT = 500
+
+def normalize_watermark(value: str) -> str:
+    """Parse a client watermark into the stored updated_at string format"""
+    try:
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid watermark, expected ISO 8601 timestamp")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc).isoformat()
+
+async def fetch_order_changes(since: str, after_id: Optional[str], limit: int, projection: Optional[dict] = None):
+    """Orders past the (updated_at, id) watermark in change order, plus whether more remain"""
+    if after_id:
+        query = {"$or": [{"updated_at": {"$gt": since}}, {"updated_at": since, "id": {"$gt": after_id}}]}
+    else:
+        query = {"updated_at": {"$gt": since}}
+    orders = await db.orders.find(query, projection or {"_id": 0}).sort([("updated_at", 1), ("id", 1)]).limit(limit + 1).to_list(limit + 1)
+    return orders[:limit], len(orders) > limit
+
+async def latest_order_watermark() -> Optional[dict]:
+    latest = await db.orders.find({}, {"_id": 0, "id": 1, "updated_at": 1}).sort([("updated_at", -1), ("id", -1)]).limit(1).to_list(1)
+    return {"updated_at": latest[0]['updated_at'], "id": latest[0]['id']} if latest else None
+
+@api_router.get("/admin/orders/changes")
+async def get_order_changes(since: Optional[str] = None, after_id: Optional[str] = None, limit: int = ORDER_CHANGES_LIMIT, admin = Depends(get_admin_user)):
+    """Orders created or updated after the (updated_at, id) watermark, oldest change first.
+
+    Poll with the returned watermark; `has_more` means call again immediately.
+    Without `since` only the current watermark is returned.
+    """
+    limit = max(1, min(limit, ORDER_CHANGES_LIMIT))
+    if not since:
+        return {"orders": [], "watermark": await latest_order_watermark(), "has_more": False}
+
+    since = normalize_watermark(since)
+    orders, has_more = await fetch_order_changes(since, after_id, limit, ORDER_LISTING_PROJECTION)
+
+    if orders:
+        watermark = {"updated_at": orders[-1]['updated_at'], "id": orders[-1]['id']}
+    else:
+        watermark = {"updated_at": since, "id": after_id}
+
+    for order in orders:
+        if isinstance(order['created_at'], str):
+            order['created_at'] = datetime.fromisoformat(order['created_at'])
+        if isinstance(order['updated_at'], str):
+            order['updated_at'] = datetime.fromisoformat(order['updated_at'])
+    await attach_customer_info(orders)
+
+    return {"orders": orders, "watermark": watermark, "has_more": has_more}
+
+# Live admin order feed
+# One watcher per worker (a change stream on replica sets, updated_at polling on standalone
+# mongod) fans events out to a bounded queue per connected admin tab. EventSource can't send
+# headers, so the admin first trades their session for a short-lived stream token and puts that
+# in the URL; the session JWT itself never appears in a query string or access log.
+ORDER_FEED_POLL_INTERVAL = float(os.getenv('ORDER_FEED_POLL_INTERVAL', '3'))
+ORDER_FEED_RETRY_MAX_SECONDS = float(os.getenv('ORDER_FEED_RETRY_MAX_SECONDS', '30'))
+ORDER_STREAM_TOKEN_SECONDS = int(os.getenv('ORDER_STREAM_TOKEN_SECONDS', '60'))
+ORDER_STREAM_TOKEN_PURPOSE = 'order_stream'
+ORDER_FEED_HEARTBEAT = float(os.getenv('ORDER_FEED_HEARTBEAT', '15'))
+ORDER_FEED_QUEUE_SIZE = 100
+ORDER_FEED_PROJECTION = ORDER_LISTING_PROJECTION
+
+def order_feed_event(order: dict, event_type: str) -> dict:
+    return {
+        "type": event_type,
+        "id": f"{order['updated_at']}|{order['id']}",
+        "order": order
+    }
+
+class OrderFeed:
+    """Shared order watcher fanned out to every connected admin stream"""
+
+    def __init__(self):
+        self.subscribers = set()
+        self.mode = None
+        self._task = None
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=ORDER_FEED_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        metrics.set('order_feed_subscribers', len(self.subscribers))
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+        metrics.set('order_feed_subscribers', len(self.subscribers))
+        if not self.subscribers:
+            self.stop()
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def publish(self, event: dict):
+        metrics.inc('order_feed_events_total', type=event['type'])
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Slow consumer: drop its backlog and tell it to resync through /admin/orders/changes
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"type": "resync"})
+
+    async def _run(self):
+        try:
+            await self._watch_change_stream()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info("Order change stream unavailable (%s), polling updated_at instead", e)
+        await self._poll()
+
+    async def _watch_change_stream(self):
+        pipeline = [
+            {"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}},
+            {"$project": {"fullDocument._id": 0, "fullDocument.payment_proof": 0, "updateDescription": 0}}
+        ]
+        resume_token = None
+        opened = False
+        delay = 1.0
+        while True:
+            try:
+                async with db.orders.watch(pipeline, full_document='updateLookup', resume_after=resume_token) as stream:
+                    self.mode = 'change_stream'
+                    if opened and resume_token is None:
+                        # Reopened with nothing to resume from: clients catch up through /admin/orders/changes
+                        self.publish({"type": "resync"})
+                    opened = True
+                    delay = 1.0
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        order = change.get('fullDocument')
+                        if not order:
+                            continue
+                        await attach_customer_info([order])
+                        event_type = 'order.created' if change['operationType'] == 'insert' else 'order.updated'
+                        self.publish(order_feed_event(order, event_type))
+            except PyMongoError as e:
+                code = getattr(e, 'code', None)
+                # Standalone servers reject $changeStream outright; anything else is retried
+                if code == 40573:
+                    raise
+                if code in (280, 286):
+                    # Resume point fell out of the oplog: start from now instead
+                    resume_token = None
+                metrics.inc('order_feed_stream_retries_total')
+                logger.warning("Order change stream unavailable, retrying in %.0fs: %s", delay, e)
+                await asyncio.sleep(delay * random.uniform(0.5, 1))
+                delay = min(delay * 2, ORDER_FEED_RETRY_MAX_SECONDS)
+
+    async def _poll(self):
+        self.mode = 'polling'
+        watermark = None
+        while watermark is None:
+            try:
+                watermark = await latest_order_watermark() or {"updated_at": "", "id": None}
+            except PyMongoError as e:
+                logger.warning("Order feed poll failed: %s", e)
+                await asyncio.sleep(ORDER_FEED_POLL_INTERVAL)
+        while True:
+            await asyncio.sleep(ORDER_FEED_POLL_INTERVAL)
+            try:
+                has_more = True
+                while has_more:
+                    orders, has_more = await fetch_order_changes(watermark['updated_at'], watermark['id'], ORDER_CHANGES_LIMIT, ORDER_FEED_PROJECTION)
+                    if not orders:
+                        break
+                    await attach_customer_info(orders)
+                    for order in orders:
+                        event_type = 'order.created' if order['created_at'] > watermark['updated_at'] else 'order.updated'
+                        self.publish(order_feed_event(order, event_type))
+                    watermark = {"updated_at": orders[-1]['updated_at'], "id": orders[-1]['id']}
+            except PyMongoError as e:
+                logger.warning("Order feed poll failed: %s", e)
+
+order_feed = OrderFeed()
+
+def create_stream_token(user_id: str) -> str:
+    payload = {
+        'user_id': user_id,
+        'purpose': ORDER_STREAM_TOKEN_PURPOSE,
+        'exp': datetime.now(timezone.utc) + timedelta(seconds=ORDER_STREAM_TOKEN_SECONDS)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+async def get_stream_admin(request: Request, token: Optional[str] = None):
+    """Admin auth for EventSource: a stream token in ?token=, or a Bearer session header"""
+    if not token:
+        scheme, _, session = request.headers.get('authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not session:
+            raise HTTPException(status_code=401, detail="Not authenticated")
+        user = await get_current_user(HTTPAuthorizationCredentials(scheme=scheme, credentials=session))
+        return await get_admin_user(user)
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    # Session tokens are refused here, so they are never worth putting in a URL
+    if payload.get('purpose') != ORDER_STREAM_TOKEN_PURPOSE:
+        raise HTTPException(status_code=401, detail="Stream token required")
+    return payload
+
+@api_router.post("/admin/orders/stream-token")
+async def issue_stream_token(admin = Depends(get_admin_user)):
+    """Short-lived token for opening /admin/orders/stream; it is checked only when the stream connects"""
+    return {"token": create_stream_token(admin['user_id']), "expires_in": ORDER_STREAM_TOKEN_SECONDS}
+
+def format_sse(event: dict) -> str:
+    lines = [f"event: {event['type']}"]
+    if event.get('id'):
+        lines.append(f"id: {event['id']}")
+    lines.append(f"data: {json.dumps(event, default=str)}")
+    return '\n'.join(lines) + '\n\n'
+
+@api_router.get("/admin/orders/stream")
+async def stream_orders(request: Request, admin = Depends(get_stream_admin)):
+    """Server-Sent Events feed of order.created / order.updated events.
+
+    Reconnecting clients send Last-Event-ID and receive the changes they missed first.
+    """
+    queue = order_feed.subscribe()
+    backlog = []
+    last_event_id = request.headers.get('last-event-id')
+    if last_event_id and '|' in last_event_id:
+        since, _, after_id = last_event_id.partition('|')
+        backlog, has_more = await fetch_order_changes(normalize_watermark(since), after_id, ORDER_CHANGES_LIMIT, ORDER_FEED_PROJECTION)
+        await attach_customer_info(backlog)
+        if has_more:
+            backlog = []
+            queue.put_nowait({"type": "resync"})
+
+    async def events():
+        try:
+            yield "retry: 5000\n\n"
+            for order in backlog:
+                yield format_sse(order_feed_event(order, 'order.updated'))
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), ORDER_FEED_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            order_feed.unsubscribe(queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def reserve_reopened_order(order: dict, reopened_at: str):
+    """Take stock again for an order moved out of cancelled; 409 puts it back to cancelled"""
+    quantities = stock_quantities(order['items'])
+    # Units in customers' carts are off limits here just as they are at checkout
+    held = {product_id: stock_holds.held(product_id) for product_id in quantities}
+    try:
+        await reserve_stock(order['id'], order['items'], held)
+    except (HTTPException, PyMongoError):
+        # Back to cancelled, unless the order was changed again meanwhile
+        await db.orders.update_one(
+            {"id": order['id'], "updated_at": reopened_at},
+            {"$set": {"status": "cancelled", "updated_at": datetime.now(timezone.utc).isoformat()}}
+        )
+        raise
+    await settle_stock_reservation(order['id'], quantities)
 
 @api_router.put("/admin/orders/{order_id}/status")
 async def update_order_status(order_id: str, status_data: OrderStatusUpdate, admin = Depends(get_admin_user)):
-    # Get order and customer info first
-    order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    # Update and read the previous state in one step so the rollup moves the right status
+    updated_at = datetime.now(timezone.utc).isoformat()
+    order = await db.orders.find_one_and_update(
+        {"id": order_id},
+        {"$set": {"status": status_data.status, "updated_at": updated_at}},
+        projection={"_id": 0, "payment_proof": 0},
+        return_document=ReturnDocument.BEFORE
+    )
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    # Get customer info
-    user = await db.users.find_one({"id": order['user_id']}, {"_id": 0})
+    # Cancelling returns reserved stock; reopening a cancelled order has to reserve it again
+    if order.get('stock_reserved') and (order.get('status') == 'cancelled') != (status_data.status == 'cancelled'):
+        if status_data.status == 'cancelled':
+            await return_stock(order['items'])
+        else:
+            await reserve_reopened_order(order, updated_at)
     
-    result = await db.orders.update_one(
-        {"id": order_id},
-        {"$set": {"status": status_data.status, "updated_at": datetime.now(timezone.utc).isoformat()}}
-    )
+    await record_status_rollup(order, status_data.status)
     
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Order not found")
+    # Customer info from the order snapshot; older orders fall back to the users collection
+    customer = order.get('customer')
+    if not customer:
+        user = await db.users.find_one({"id": order['user_id']}, CUSTOMER_SNAPSHOT_PROJECTION)
+        customer = customer_snapshot(user) if user else {}
     
     # Return order details for WhatsApp notification
     return {
         "message": "Order status updated",
         "order_number": order.get('order_number'),
-        "customer_name": user.get('full_name', 'Customer') if user else 'Customer',
-        "customer_whatsapp": user.get('whatsapp', '') if user else '',
+        "customer_name": customer.get('full_name', 'Customer'),
+        "customer_whatsapp": customer.get('whatsapp', ''),
         "final_amount": order.get('final_amount'),
         "new_status": status_data.status
     }
 
+CSV_HEADER = ['Order Number', 'Date', 'Customer', 'WhatsApp', 'Products', 'Total Amount', 'Shipping Fee', 'Discount', 'Final Amount', 'Delivery Type', 'Delivery Address', 'Status']
+
+def csv_row(order: dict) -> list:
+    """One CSV row for an order already enriched with customer info and line snapshots"""
+    created_at = order['created_at']
+    if isinstance(created_at, str):
+        created_at = datetime.fromisoformat(created_at)
+    
+    # Build products string
+    products_list = []
+    for item in order.get('items', []):
+        product_name = item.get('product_name') or item['product_id']
+        products_list.append(f"{product_name} x{item['quantity']}")
+    products_str = '; '.join(products_list)
+    
+    # Get delivery address
+    delivery_address = order.get('delivery_address', '') if order['delivery_type'] == 'delivery' else f"{order.get('pickup_location', '')} ({order.get('pickup_date', '')})"
+    
+    return [
+        order['order_number'],
+        created_at.strftime('%Y-%m-%d %H:%M'),
+        order['customer_name'],
+        order['customer_whatsapp'],
+        products_str,
+        order['total_amount'],
+        order['shipping_fee'],
+        order.get('discount_amount', 0),
+        order['final_amount'],
+        order['delivery_type'],
+        delivery_address,
+        order['status']
+    ]
+
 @api_router.get("/admin/orders/export/csv")
 async def export_orders_csv(admin = Depends(get_admin_user)):
-    orders = await db.orders.find({}, {"_id": 0}).to_list(10000)
+    orders = await db.orders.find({}, {"_id": 0, "payment_proof": 0}).to_list(10000)
+    await attach_customer_info(orders)
+    await fill_line_snapshots([item for order in orders for item in order.get('items', [])])
     
     # Create CSV
     output = io.StringIO()
     writer = csv.writer(output)
     
     # Header with products column
-    writer.writerow(['Order Number', 'Date', 'Customer', 'WhatsApp', 'Products', 'Total Amount', 'Shipping Fee', 'Discount', 'Final Amount', 'Delivery Type', 'Delivery Address', 'Status'])
-    
-    # Rows
-    for order in orders:
-        # Get user info
-        user = await db.users.find_one({"id": order['user_id']}, {"_id": 0})
-        customer_name = user['full_name'] if user else 'Unknown'
-        customer_whatsapp = user['whatsapp'] if user else ''
-        
-        created_at = order['created_at']
-        if isinstance(created_at, str):
-            created_at = datetime.fromisoformat(created_at)
-        
-        # Build products string
-        products_list = []
-        for item in order.get('items', []):
-            product = await db.products.find_one({"id": item['product_id']}, {"_id": 0})
-            product_name = product['name'] if product else item['product_id']
-            products_list.append(f"{product_name} x{item['quantity']}")
-        products_str = '; '.join(products_list)
-        
-        # Get delivery address
-        delivery_address = order.get('delivery_address', '') if order['delivery_type'] == 'delivery' else f"{order.get('pickup_location', '')} ({order.get('pickup_date', '')})"
-        
-        writer.writerow([
-            order['order_number'],
-            created_at.strftime('%Y-%m-%d %H:%M'),
-            customer_name,
-            customer_whatsapp,
-            products_str,
-            order['total_amount'],
-            order['shipping_fee'],
-            order.get('discount_amount', 0),
-            order['final_amount'],
-            order['delivery_type'],
-            delivery_address,
-            order['status']
-        ])
+    writer.writerow(CSV_HEADER)
+    writer.writerows(csv_row(order) for order in orders)
     
     output.seek(0)
     return StreamingResponse(
@@ -753,6 +2548,466 @@ async def export_orders_csv(admin = Depends(get_admin_user)):
         headers={"Content-Disposition": f"attachment; filename=orders_{datetime.now().strftime('%Y%m%d')}.csv"}
     )
 
+# Sales analytics
+SALES_RANGE_MAX_DAYS = 366
+
+def parse_sales_date(value: str, field: str):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid {field}, expected YYYY-MM-DD")
+
+@api_router.get("/admin/analytics/sales")
+async def get_sales_summary(start: str, end: str, admin = Depends(get_admin_user)):
+    """Daily sales rollups between start and end (inclusive, local dates) with range totals"""
+    start_date = parse_sales_date(start, 'start')
+    end_date = parse_sales_date(end, 'end')
+    if end_date < start_date:
+        raise HTTPException(status_code=400, detail="end must not be before start")
+    if (end_date - start_date).days >= SALES_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Range is limited to {SALES_RANGE_MAX_DAYS} days")
+    
+    days = await db.sales_daily.find(
+        {"date": {"$gte": start_date.isoformat(), "$lte": end_date.isoformat()}},
+        {"_id": 0}
+    ).sort("date", 1).to_list(SALES_RANGE_MAX_DAYS)
+    
+    totals = {"orders": 0, "revenue": 0.0, "gross_revenue": 0.0, "discount_total": 0.0, "items_sold": 0}
+    statuses = defaultdict(int)
+    status_revenue = defaultdict(float)
+    products = {}
+    for day in days:
+        for field in totals:
+            totals[field] += day.get(field, 0)
+        for status_name, count in day.get('statuses', {}).items():
+            statuses[status_name] += count
+        for status_name, amount in day.get('status_revenue', {}).items():
+            status_revenue[status_name] += amount
+        for product_id, stats in day.get('products', {}).items():
+            product = products.setdefault(product_id, {"product_id": product_id, "name": stats.get('name'), "quantity": 0, "revenue": 0.0})
+            product['quantity'] += stats.get('quantity', 0)
+            product['revenue'] += stats.get('revenue', 0)
+            product['name'] = stats.get('name') or product['name']
+        day['average_basket'] = day['revenue'] / day['orders'] if day.get('orders') else 0
+    
+    totals['average_basket'] = totals['revenue'] / totals['orders'] if totals['orders'] else 0
+    totals['statuses'] = dict(statuses)
+    totals['status_revenue'] = dict(status_revenue)
+    totals['products'] = sorted(products.values(), key=lambda p: p['revenue'], reverse=True)
+    return {"start": start_date.isoformat(), "end": end_date.isoformat(), "totals": totals, "days": days}
+
+SALES_REBUILD_ATTEMPTS = 3
+SALES_ROLLUP_PROJECTION = {"_id": 0, "id": 1, "created_at": 1, "status": 1, "final_amount": 1, "total_amount": 1, "discount_amount": 1, "items": 1}
+
+def sales_day_range(date: str) -> dict:
+    """created_at bounds (UTC ISO strings) of one local sales day"""
+    start = datetime.fromisoformat(date).replace(tzinfo=SALES_TZ)
+    return {"$gte": start.astimezone(timezone.utc).isoformat(), "$lt": (start + timedelta(days=1)).astimezone(timezone.utc).isoformat()}
+
+async def compute_sales_rollups(query: dict) -> dict:
+    """Daily rollup documents (nested like the $inc-maintained ones) for the matching orders"""
+    rollups = {}
+    async for order in db.orders.find(query, SALES_ROLLUP_PROJECTION):
+        day = rollups.setdefault(sales_day(order['created_at']), {})
+        update = order_rollup_update(order)
+        for path, value in list(update['$inc'].items()) + list(update['$set'].items()):
+            if path == 'updated_at':
+                continue
+            *parents, field = path.split('.')
+            node = day
+            for parent in parents:
+                node = node.setdefault(parent, {})
+            node[field] = node.get(field, 0) + value if path in update['$inc'] else value
+    return rollups
+
+async def write_sales_rollups(rollups: dict, started: str) -> List[str]:
+    """Replace each day unless an order touched it after `started`; returns the days skipped"""
+    if not rollups:
+        return []
+    now = datetime.now(timezone.utc).isoformat()
+    days = list(rollups)
+    try:
+        await db.sales_daily.bulk_write([
+            # A day updated since the scan began fails the filter, and its upsert hits the unique date index
+            ReplaceOne({"date": date, "updated_at": {"$lt": started}}, {"date": date, **rollups[date], "updated_at": now}, upsert=True)
+            for date in days
+        ], ordered=False)
+    except BulkWriteError as e:
+        conflicts = [error for error in e.details['writeErrors'] if error['code'] == 11000]
+        if len(conflicts) < len(e.details['writeErrors']):
+            raise
+        return [days[error['index']] for error in conflicts]
+    return []
+
+@api_router.post("/admin/analytics/sales/rebuild")
+async def rebuild_sales_rollups(admin = Depends(get_admin_user)):
+    """Recompute every daily rollup from the orders collection (backfill or repair).
+
+    Days are replaced in place rather than cleared first, so an interrupted rebuild never leaves
+    sales_daily partly empty. Days that live orders touched while the rebuild ran are rescanned.
+    """
+    started = datetime.now(timezone.utc).isoformat()
+    rollups = await compute_sales_rollups({})
+    rebuilt = set(rollups)
+    skipped = await write_sales_rollups(rollups, started)
+    # Days with no orders left, unless an order arrived for them during the rebuild
+    await db.sales_daily.delete_many({"date": {"$nin": list(rebuilt)}, "updated_at": {"$lt": started}})
+    
+    for _ in range(SALES_REBUILD_ATTEMPTS):
+        if not skipped:
+            break
+        started = datetime.now(timezone.utc).isoformat()
+        rollups = await compute_sales_rollups({"$or": [{"created_at": sales_day_range(date)} for date in skipped]})
+        skipped = await write_sales_rollups(rollups, started)
+    if skipped:
+        logger.warning("Sales rollup rebuild left %d busy days unchanged: %s", len(skipped), ', '.join(skipped))
+    return {"days": len(rebuilt), "skipped_days": skipped}
+
+# Analytics reports
+# Built from the whole order history, so frames and reports are cached per data version
+# (order count + latest updated_at watermark) and recomputed only after orders change.
+ANALYTICS_PROJECTION = {
+    "_id": 0, "id": 1, "user_id": 1, "created_at": 1, "status": 1, "total_amount": 1,
+    "discount_amount": 1, "final_amount": 1, "discount_code": 1, "customer.full_name": 1,
+    "items.product_id": 1, "items.product_name": 1, "items.quantity": 1, "items.price": 1
+}
+ANALYTICS_REPORTS = {
+    "rfm": analytics.rfm_segments,
+    "co-purchase": analytics.co_purchase,
+    "discounts": analytics.discount_effectiveness,
+    "hourly-demand": analytics.hourly_demand,
+}
+analytics_cache = {"version": None, "frames": None, "reports": {}}
+analytics_lock = asyncio.Lock()
+
+async def orders_data_version() -> str:
+    count = await db.orders.estimated_document_count()
+    watermark = await latest_order_watermark() or {}
+    return f"{count}:{watermark.get('updated_at', '')}:{watermark.get('id', '')}"
+
+async def analytics_report(report: str):
+    version = await orders_data_version()
+    async with analytics_lock:
+        if analytics_cache['version'] != version:
+            builder = analytics.FrameBuilder()
+            async for order in db.orders.find({}, ANALYTICS_PROJECTION).batch_size(1000):
+                builder.add(order)
+            frames = await asyncio.to_thread(builder.build, SALES_TZ)
+            analytics_cache.update(version=version, frames=frames, reports={})
+            metrics.inc('analytics_frame_builds_total')
+        if report not in analytics_cache['reports']:
+            analytics_cache['reports'][report] = await asyncio.to_thread(ANALYTICS_REPORTS[report], *analytics_cache['frames'])
+        else:
+            metrics.inc('analytics_report_cache_hits_total', report=report)
+    return version, analytics_cache['reports'][report]
+
+@api_router.get("/admin/analytics/reports/{report}")
+async def get_analytics_report(report: str, admin = Depends(get_admin_user)):
+    """One of: rfm, co-purchase, discounts, hourly-demand"""
+    if report not in ANALYTICS_REPORTS:
+        raise HTTPException(status_code=404, detail=f"Unknown report, expected one of: {', '.join(ANALYTICS_REPORTS)}")
+    version, data = await analytics_report(report)
+    return {"report": report, "data_version": version, **data}
+
+# Columnar exports
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '2000'))
+
+def export_date_query(start: Optional[str], end: Optional[str]) -> dict:
+    """created_at bounds for local (WIB) dates, inclusive, as stored ISO strings"""
+    bounds = {}
+    if start:
+        start_at = datetime.combine(parse_sales_date(start, 'start'), datetime.min.time(), SALES_TZ)
+        bounds["$gte"] = start_at.astimezone(timezone.utc).isoformat()
+    if end:
+        end_at = datetime.combine(parse_sales_date(end, 'end') + timedelta(days=1), datetime.min.time(), SALES_TZ)
+        bounds["$lt"] = end_at.astimezone(timezone.utc).isoformat()
+    return {"created_at": bounds} if bounds else {}
+
+async def iter_export_batches(query: dict, batch_size: int = EXPORT_BATCH_SIZE):
+    """Stream orders oldest first in enriched batches without loading payment proofs"""
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"created_at": 1}},
+        {"$addFields": {"has_payment_proof": {"$gt": ["$payment_proof", None]}}},
+        {"$project": {"_id": 0, "payment_proof": 0}}
+    ]
+    batch = []
+    async for order in db.orders.aggregate(pipeline, batchSize=batch_size):
+        batch.append(order)
+        if len(batch) >= batch_size:
+            yield await enrich_export_batch(batch)
+            batch = []
+    if batch:
+        yield await enrich_export_batch(batch)
+
+async def enrich_export_batch(orders: List[dict]) -> List[dict]:
+    await attach_customer_info(orders)
+    await fill_line_snapshots([item for order in orders for item in order.get('items', [])])
+    return orders
+
+async def write_columnar_export(directory: Path, fmt: str, query: dict, on_batch=None) -> Path:
+    writer = exports.OrderExportWriter(directory, fmt)
+    try:
+        async for batch in iter_export_batches(query):
+            await asyncio.to_thread(writer.write_batch, batch)
+            if on_batch:
+                await on_batch(len(batch))
+    finally:
+        paths = await asyncio.to_thread(writer.close)
+    return await asyncio.to_thread(exports.bundle, paths, directory / f"orders_{fmt}.zip")
+
+@api_router.get("/admin/orders/export/columnar")
+async def export_orders_columnar(format: str = "parquet", start: Optional[str] = None, end: Optional[str] = None, admin = Depends(get_admin_user)):
+    """Zip of typed orders and order_lines tables (Parquet or Arrow IPC), optionally for a date range"""
+    if format not in exports.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format, expected one of: {', '.join(exports.FORMATS)}")
+    query = export_date_query(start, end)
+    
+    directory = Path(tempfile.mkdtemp(prefix="orders_export_"))
+    try:
+        archive = await write_columnar_export(directory, format, query)
+    except BaseException:
+        shutil.rmtree(directory, ignore_errors=True)
+        raise
+    return FileResponse(
+        archive,
+        media_type="application/zip",
+        filename=f"orders_{datetime.now().strftime('%Y%m%d')}_{format}.zip",
+        background=BackgroundTask(shutil.rmtree, directory, ignore_errors=True)
+    )
+
+# Export jobs
+# Large exports run as background jobs that write an artifact to EXPORT_DIR. Job state lives
+# in Mongo so any worker can report progress; identical requests within EXPORT_REUSE_SECONDS
+# share one artifact, and downloads honour Range so interrupted transfers can resume.
+EXPORT_DIR = Path(os.getenv('EXPORT_DIR', str(ROOT_DIR / 'exports')))
+EXPORT_REUSE_SECONDS = int(os.getenv('EXPORT_REUSE_SECONDS', '600'))
+EXPORT_RETENTION_SECONDS = int(os.getenv('EXPORT_RETENTION_SECONDS', str(24 * 3600)))
+EXPORT_STALE_SECONDS = 120  # jobs without a heartbeat this long (queued or running) belong to a dead worker
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', '2'))
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_JOB_FORMATS = ('csv',) + tuple(exports.FORMATS)
+export_semaphore = asyncio.Semaphore(EXPORT_CONCURRENCY)
+export_tasks = set()
+
+class ExportJobCreate(BaseModel):
+    format: str = "csv"
+    start: Optional[str] = None
+    end: Optional[str] = None
+
+async def write_csv_export(directory: Path, query: dict, on_batch=None) -> Path:
+    path = directory / "orders.csv"
+    handle = await asyncio.to_thread(open, path, 'w', newline='', encoding='utf-8')
+    try:
+        writer = csv.writer(handle)
+        writer.writerow(CSV_HEADER)
+        async for batch in iter_export_batches(query):
+            await asyncio.to_thread(writer.writerows, [csv_row(order) for order in batch])
+            if on_batch:
+                await on_batch(len(batch))
+    finally:
+        await asyncio.to_thread(handle.close)
+    return path
+
+def export_job_view(job: dict) -> dict:
+    view = {k: v for k, v in job.items() if k not in ('_id', 'path')}
+    if job.get('status') == 'completed':
+        view['download_url'] = f"/api/admin/exports/{job['id']}/download"
+    return view
+
+async def mark_stale_export(job: dict) -> dict:
+    heartbeat = datetime.fromisoformat(job['heartbeat_at'])
+    if job['status'] in ('queued', 'running') and datetime.now(timezone.utc) - heartbeat > timedelta(seconds=EXPORT_STALE_SECONDS):
+        job['status'] = 'failed'
+        job['error'] = 'Export worker stopped before finishing'
+        await db.export_jobs.update_one({"id": job['id'], "status": {"$in": ["queued", "running"]}}, {"$set": {"status": "failed", "error": job['error']}})
+    return job
+
+async def prune_export_jobs():
+    cutoff = (datetime.now(timezone.utc) - timedelta(seconds=EXPORT_RETENTION_SECONDS)).isoformat()
+    expired = await db.export_jobs.find({"created_at": {"$lt": cutoff}}, {"_id": 0, "id": 1}).to_list(1000)
+    for job in expired:
+        await asyncio.to_thread(shutil.rmtree, EXPORT_DIR / job['id'], True)
+    if expired:
+        await db.export_jobs.delete_many({"id": {"$in": [job['id'] for job in expired]}})
+
+async def heartbeat_queued_export(job_id: str):
+    # A job waiting for export_semaphore is alive; without this it would look stale once the wait passed EXPORT_STALE_SECONDS
+    while True:
+        await asyncio.sleep(EXPORT_STALE_SECONDS / 4)
+        try:
+            await db.export_jobs.update_one({"id": job_id, "status": "queued"}, {"$set": {"heartbeat_at": datetime.now(timezone.utc).isoformat()}})
+        except PyMongoError as e:
+            logger.warning("Could not refresh heartbeat of queued export %s: %s", job_id, e)
+
+async def run_export_job(job: dict):
+    heartbeat = asyncio.get_running_loop().create_task(heartbeat_queued_export(job['id']))
+    try:
+        await export_semaphore.acquire()
+    finally:
+        heartbeat.cancel()
+    try:
+        query = export_date_query(job['start'], job['end'])
+        directory = EXPORT_DIR / job['id']
+        processed = 0
+        
+        async def progress(count: int):
+            nonlocal processed
+            processed += count
+            await db.export_jobs.update_one({"id": job['id']}, {"$set": {
+                "progress.processed": processed,
+                "heartbeat_at": datetime.now(timezone.utc).isoformat()
+            }})
+        
+        try:
+            total = await db.orders.count_documents(query)
+            await db.export_jobs.update_one({"id": job['id']}, {"$set": {
+                "status": "running",
+                "progress.total": total,
+                "started_at": datetime.now(timezone.utc).isoformat(),
+                "heartbeat_at": datetime.now(timezone.utc).isoformat()
+            }})
+            await asyncio.to_thread(directory.mkdir, parents=True, exist_ok=True)
+            if job['format'] == 'csv':
+                path = await write_csv_export(directory, query, progress)
+            else:
+                path = await write_columnar_export(directory, job['format'], query, progress)
+            size = (await asyncio.to_thread(path.stat)).st_size
+            await db.export_jobs.update_one({"id": job['id']}, {"$set": {
+                "status": "completed",
+                "path": str(path),
+                "size": size,
+                "completed_at": datetime.now(timezone.utc).isoformat()
+            }})
+            metrics.inc('export_jobs_total', format=job['format'], status='completed')
+        except Exception as e:
+            logger.exception("Export job %s failed", job['id'])
+            await asyncio.to_thread(shutil.rmtree, directory, True)
+            await db.export_jobs.update_one({"id": job['id']}, {"$set": {"status": "failed", "error": str(e)}})
+            metrics.inc('export_jobs_total', format=job['format'], status='failed')
+    finally:
+        export_semaphore.release()
+
+@api_router.post("/admin/exports")
+async def create_export_job(job_data: ExportJobCreate, admin = Depends(get_admin_user)):
+    if job_data.format not in EXPORT_JOB_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Invalid format, expected one of: {', '.join(EXPORT_JOB_FORMATS)}")
+    export_date_query(job_data.start, job_data.end)  # validate dates up front
+    await prune_export_jobs()
+    
+    params_key = f"{job_data.format}|{job_data.start or ''}|{job_data.end or ''}"
+    reuse_after = (datetime.now(timezone.utc) - timedelta(seconds=EXPORT_REUSE_SECONDS)).isoformat()
+    candidates = await db.export_jobs.find(
+        {"params_key": params_key, "$or": [
+            {"status": {"$in": ["queued", "running"]}},
+            {"status": "completed", "completed_at": {"$gte": reuse_after}}
+        ]},
+        {"_id": 0}
+    ).sort("created_at", -1).to_list(5)
+    for candidate in candidates:
+        candidate = await mark_stale_export(candidate)
+        if candidate['status'] == 'completed' and not Path(candidate['path']).exists():
+            continue
+        if candidate['status'] != 'failed':
+            metrics.inc('export_jobs_reused_total', format=job_data.format)
+            return {**export_job_view(candidate), "reused": True}
+    
+    now = datetime.now(timezone.utc).isoformat()
+    job = {
+        "id": str(uuid.uuid4()),
+        "format": job_data.format,
+        "start": job_data.start,
+        "end": job_data.end,
+        "params_key": params_key,
+        "status": "queued",
+        "progress": {"processed": 0, "total": None},
+        "requested_by": admin['user_id'],
+        "created_at": now,
+        "heartbeat_at": now
+    }
+    await db.export_jobs.insert_one(dict(job))
+    task = asyncio.get_running_loop().create_task(run_export_job(job))
+    export_tasks.add(task)
+    task.add_done_callback(export_tasks.discard)
+    return {**export_job_view(job), "reused": False}
+
+@api_router.get("/admin/exports")
+async def list_export_jobs(admin = Depends(get_admin_user)):
+    jobs = await db.export_jobs.find({}, {"_id": 0}).sort("created_at", -1).to_list(100)
+    return [export_job_view(await mark_stale_export(job)) for job in jobs]
+
+@api_router.get("/admin/exports/{job_id}")
+async def get_export_job(job_id: str, admin = Depends(get_admin_user)):
+    job = await db.export_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return export_job_view(await mark_stale_export(job))
+
+def parse_byte_range(header: str, size: int):
+    """(start, end) inclusive for a single `bytes=` range, None to send the whole file"""
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            suffix = int(last)
+            if suffix <= 0:
+                raise ValueError
+            start, end = max(0, size - suffix), size - 1
+        else:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        raise HTTPException(status_code=416, detail="Invalid range", headers={"Content-Range": f"bytes */{size}"})
+    if start >= size or start > end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+def read_file_range(path: Path, start: int, length: int):
+    with open(path, 'rb') as handle:
+        handle.seek(start)
+        while length > 0:
+            chunk = handle.read(min(EXPORT_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+@api_router.get("/admin/exports/{job_id}/download")
+async def download_export(job_id: str, request: Request, admin = Depends(get_admin_user)):
+    job = await db.export_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job['status'] != 'completed':
+        raise HTTPException(status_code=409, detail=f"Export is {job['status']}")
+    path = Path(job['path'])
+    if not path.exists():
+        raise HTTPException(status_code=410, detail="Export artifact has expired")
+    
+    size = job['size']
+    etag = f'"{job_id}-{size}"'
+    suffix = 'csv' if job['format'] == 'csv' else f"{job['format']}.zip"
+    headers = {
+        "Accept-Ranges": "bytes",
+        "ETag": etag,
+        "Content-Disposition": f"attachment; filename=orders_{job['created_at'][:10].replace('-', '')}.{suffix}"
+    }
+    media_type = "text/csv" if job['format'] == 'csv' else "application/zip"
+    
+    byte_range = None
+    range_header = request.headers.get('range')
+    if range_header and request.headers.get('if-range', etag) == etag:
+        byte_range = parse_byte_range(range_header, size)
+    if byte_range is None:
+        headers["Content-Length"] = str(size)
+        return StreamingResponse(read_file_range(path, 0, size), media_type=media_type, headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(read_file_range(path, start, end - start + 1), status_code=206, media_type=media_type, headers=headers)
+
 # Discount endpoints
 @api_router.post("/admin/discounts", response_model=Discount)
 async def create_discount(discount_data: DiscountCreate, admin = Depends(get_admin_user)):
@@ -896,8 +3151,7 @@ async def update_address(address_id: str, address_data: AddressCreate, current_u
     return {"message": "Address updated"}
 
 # Site Settings endpoints
-@api_router.get("/site-settings")
-async def get_site_settings():
+async def load_site_settings() -> dict:
     settings = await db.site_settings.find_one({"id": "site_settings"}, {"_id": 0})
     if not settings:
         settings = SiteSettings()
@@ -907,6 +3161,20 @@ async def get_site_settings():
         return settings.model_dump()
     return settings
 
+@api_router.get("/site-settings")
+async def get_site_settings(response: Response):
+    return await cached_read(response, 'site_settings', None, load_site_settings)
+
+async def warm_storefront_cache():
+    """Load what the homepage asks for first, so the first visitors after a deploy hit a warm cache"""
+    await asyncio.gather(
+        storefront_cache.get('site_settings', None, load_site_settings),
+        storefront_cache.get('products', None, lambda: load_products(None, False)),
+        storefront_cache.get('featured', 6, lambda: load_featured_products(6))
+    )
+    # Refresh the snapshot from the database so the next cold start begins from current data
+    await catalog_snapshot.capture()
+
 @api_router.put("/admin/site-settings")
 async def update_site_settings(settings_data: SiteSettingsUpdate, admin = Depends(get_admin_user)):
     update_data = {k: v for k, v in settings_data.model_dump().items() if v is not None}
@@ -917,8 +3185,659 @@ async def update_site_settings(settings_data: SiteSettingsUpdate, admin = Depend
         {"$set": update_data},
         upsert=True
     )
+    storefront_cache.invalidate('site_settings')
+    catalog_snapshot.schedule_capture()
     return {"message": "Site settings updated"}
 
+# Catalog snapshot
+# The active catalog and site settings are written to a local JSON file whenever they change.
+# At startup the file seeds the storefront cache before Mongo is reachable, and while Mongo is
+# down it answers storefront reads the cache has nothing for. Writes are atomic (temp file +
+# rename) and skipped when the content hash (the snapshot version) is unchanged.
+CATALOG_SNAPSHOT_PATH = Path(os.getenv('CATALOG_SNAPSHOT_PATH', str(ROOT_DIR / 'snapshots' / 'catalog.json')))
+CATALOG_SNAPSHOT_FORMAT = 1
+
+class CatalogSnapshot:
+    """On-disk copy of the public catalog and site settings"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.data = None
+        self.products_by_id = {}
+        self._task = None
+        self._pending = False
+
+    @staticmethod
+    def _read(path: Path) -> Optional[dict]:
+        if not path.exists():
+            return None
+        data = json.loads(path.read_text())
+        return data if data.get('format') == CATALOG_SNAPSHOT_FORMAT else None
+
+    @staticmethod
+    def _write(path: Path, data: dict):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with tempfile.NamedTemporaryFile('w', dir=path.parent, prefix='.catalog-', suffix='.json', delete=False) as tmp:
+            json.dump(data, tmp, separators=(',', ':'))
+        os.replace(tmp.name, path)
+
+    def _use(self, data: dict):
+        for product in data['products']:
+            if isinstance(product.get('created_at'), str):
+                product['created_at'] = datetime.fromisoformat(product['created_at'])
+        self.data = data
+        self.products_by_id = {product['id']: product for product in data['products']}
+
+    def age(self) -> float:
+        written_at = datetime.fromisoformat(self.data['written_at'])
+        return max((datetime.now(timezone.utc) - written_at).total_seconds(), 0.0)
+
+    def derive(self, group: str, key):
+        """The value a storefront loader would return, computed from the snapshot"""
+        if not self.data:
+            return None
+        products = self.data['products']
+        if group == 'site_settings':
+            return self.data['site_settings']
+        if group == 'products':
+            return [product for product in products if key is None or product.get('category') == key]
+        if group == 'product':
+            return self.products_by_id.get(key)
+        if group == 'featured':
+            return random.sample(products, min(key, len(products)))
+        return None
+
+    async def load(self) -> bool:
+        try:
+            data = await asyncio.to_thread(self._read, self.path)
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable catalog snapshot %s: %s", self.path, e)
+            return False
+        if not data:
+            return False
+        self._use(data)
+        captured_at = datetime.fromisoformat(data['written_at'])
+        if self.age() < STOREFRONT_STALE_IF_ERROR_SECONDS:
+            storefront_cache.seed('site_settings', None, self.derive('site_settings', None), captured_at)
+            storefront_cache.seed('products', None, self.derive('products', None), captured_at)
+            storefront_cache.seed('featured', 6, self.derive('featured', 6), captured_at)
+            for product_id, product in self.products_by_id.items():
+                storefront_cache.seed('product', product_id, product, captured_at)
+        else:
+            logger.info("Catalog snapshot is %.0fs old; kept only as a fallback while Mongo is down", self.age())
+        metrics.set('catalog_snapshot_age_seconds', self.age())
+        logger.info("Loaded catalog snapshot %s (%d products, written %s)", data['version'], len(data['products']), data['written_at'])
+        return True
+
+    async def capture(self):
+        site_settings, products = await asyncio.gather(load_site_settings(), load_products(None, False))
+        content = jsonable_encoder({"site_settings": site_settings, "products": products})
+        version = hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()[:16]
+        if self.data and self.data['version'] == version:
+            return
+        data = {"format": CATALOG_SNAPSHOT_FORMAT, "version": version, "written_at": datetime.now(timezone.utc).isoformat(), **content}
+        await asyncio.to_thread(self._write, self.path, data)
+        self._use(data)
+        metrics.inc('catalog_snapshot_writes_total')
+        metrics.set('catalog_snapshot_age_seconds', 0)
+
+    def schedule_capture(self):
+        """Capture in the background; changes arriving mid-capture trigger one more run"""
+        if self._task and not self._task.done():
+            self._pending = True
+            return
+
+        async def run():
+            while True:
+                self._pending = False
+                try:
+                    await self.capture()
+                except Exception as e:
+                    logger.error("Failed to write catalog snapshot: %s", e)
+                if not self._pending:
+                    break
+
+        self._task = asyncio.get_running_loop().create_task(run())
+
+catalog_snapshot = CatalogSnapshot(CATALOG_SNAPSHOT_PATH)
+storefront_cache.fallback = catalog_snapshot
+
+# Homepage bootstrap
+# One request for everything the homepage needs, gathered concurrently. Each section carries its
+# own ETag; sections whose ETag the client sends in If-None-Match come back without data, and a
+# fully unchanged payload is a 304.
+optional_security = HTTPBearer(auto_error=False)
+
+async def get_optional_user(credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Token payload when a valid bearer token is sent; missing or invalid tokens are anonymous"""
+    if not credentials:
+        return None
+    try:
+        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.InvalidTokenError:
+        return None
+    return None if payload.get('purpose') else payload
+
+def content_etag(data) -> str:
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str).encode()
+    return f'"{hashlib.sha256(encoded).hexdigest()[:32]}"'
+
+async def bootstrap_featured(limit: int):
+    products, _ = await storefront_cache.get('featured', limit, lambda: load_featured_products(limit))
+    return present_products(products)
+
+async def bootstrap_products(category: Optional[str]):
+    products, _ = await storefront_cache.get('products', category, lambda: load_products(category, False))
+    return present_products(products)
+
+async def bootstrap_site_settings():
+    settings, _ = await storefront_cache.get('site_settings', None, load_site_settings)
+    return settings
+
+@api_router.get("/bootstrap")
+async def bootstrap(
+    request: Request,
+    category: Optional[str] = None,
+    include_products: bool = True,
+    featured_limit: int = 6,
+    current_user = Depends(get_optional_user)
+):
+    loaders = {
+        "site_settings": bootstrap_site_settings(),
+        "featured": bootstrap_featured(featured_limit)
+    }
+    if include_products:
+        loaders["products"] = bootstrap_products(category)
+    if current_user:
+        loaders["user"] = get_me(current_user)
+        if not current_user.get('is_admin'):
+            loaders["cart"] = get_cart(current_user)
+    results = await asyncio.gather(*loaders.values(), return_exceptions=True)
+    
+    # Compression weakens ETags (W/"..."); the representation underneath is the same
+    known = {tag.strip().removeprefix('W/') for tag in request.headers.get('if-none-match', '').split(',') if tag.strip()}
+    sections = {}
+    complete = True
+    for name, result in zip(loaders, results):
+        if isinstance(result, (HTTPException, PyMongoError, asyncio.TimeoutError)):
+            # One unavailable section shouldn't take the whole homepage down
+            logger.warning("Bootstrap section %s unavailable: %s", name, getattr(result, 'detail', None) or result)
+            sections[name] = {"error": "unavailable"}
+            complete = False
+            continue
+        if isinstance(result, BaseException):
+            raise result
+        data = jsonable_encoder(result)
+        etag = content_etag(data)
+        sections[name] = {"etag": etag, "not_modified": True} if etag in known else {"etag": etag, "data": data}
+    
+    etag = content_etag(sorted((name, section.get('etag')) for name, section in sections.items()))
+    headers = {
+        "ETag": etag,
+        "Vary": "Authorization",
+        # Anonymous payloads are the same for everyone; personal ones stay in the browser
+        "Cache-Control": f"public, max-age={int(STOREFRONT_FRESH_SECONDS)}" if not current_user else "private, no-cache"
+    }
+    if not complete:
+        headers["Cache-Control"] = "no-store"
+    elif etag in known:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse({"etag": etag, "sections": sections}, headers=headers)
+
+# Flash-sale admission control
+# In flash-sale mode checkout and add-to-cart pass through a bounded admission queue: at most
+# max_in_flight run at once per worker, the rest wait in FIFO order for up to max_wait_seconds
+# and are then turned away with 429, a Retry-After estimate and their queue position.
+ADMISSION_ROUTES = {("POST", "/api/orders"), ("POST", "/api/cart/add")}
+FLASH_SALE_SETTINGS_TTL = float(os.getenv('FLASH_SALE_SETTINGS_TTL', '5'))
+
+class FlashSaleSettings(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    id: str = "flash_sale_settings"
+    enabled: bool = os.getenv('FLASH_SALE_MODE', 'false').lower() in ('1', 'true', 'yes')
+    max_in_flight: int = int(os.getenv('FLASH_SALE_MAX_IN_FLIGHT', '20'))  # per worker
+    max_wait_seconds: float = float(os.getenv('FLASH_SALE_MAX_WAIT_SECONDS', '10'))
+    max_queue: int = int(os.getenv('FLASH_SALE_MAX_QUEUE', '500'))  # per worker
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class FlashSaleSettingsUpdate(BaseModel):
+    enabled: Optional[bool] = None
+    max_in_flight: Optional[int] = Field(default=None, ge=1)
+    max_wait_seconds: Optional[float] = Field(default=None, ge=0)
+    max_queue: Optional[int] = Field(default=None, ge=0)
+
+class AdmissionQueue:
+    """Bounded concurrency with a FIFO wait list; freed slots go straight to the oldest waiter"""
+
+    def __init__(self):
+        self.in_flight = 0
+        self.waiters = deque()
+        self.service_time = 1.0  # moving average of admitted request duration, seconds
+
+    def _report(self):
+        metrics.set('admission_in_flight', self.in_flight)
+        metrics.set('admission_queue_length', len(self.waiters))
+
+    def retry_after(self, position: int, limit: int) -> int:
+        return max(1, math.ceil(position * self.service_time / limit))
+
+    async def acquire(self, limit: int, timeout: float, max_queue: int) -> Optional[int]:
+        """None once admitted, otherwise the queue position the request held when it was turned away"""
+        if self.in_flight < limit and not self.waiters:
+            self.in_flight += 1
+            self._report()
+            return None
+        if len(self.waiters) >= max_queue:
+            return len(self.waiters) + 1
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        self._report()
+        try:
+            # asyncio.wait doesn't cancel the future, so a slot handed over at the deadline isn't lost
+            await asyncio.wait([waiter], timeout=timeout)
+        except asyncio.CancelledError:
+            if waiter.done():
+                self.release(limit)
+            else:
+                self.waiters.remove(waiter)
+                self._report()
+            raise
+        if waiter.done():
+            return None
+        position = self.waiters.index(waiter) + 1
+        self.waiters.remove(waiter)
+        self._report()
+        return position
+
+    def release(self, limit: int, elapsed: Optional[float] = None):
+        if elapsed is not None:
+            self.service_time = 0.8 * self.service_time + 0.2 * elapsed
+        # Hand the slot over rather than freeing it, so new arrivals can't overtake the queue
+        if self.waiters and self.in_flight <= limit:
+            self.waiters.popleft().set_result(True)
+        else:
+            self.in_flight -= 1
+        self._report()
+
+admission_queue = AdmissionQueue()
+flash_sale_cache = {"settings": FlashSaleSettings().model_dump(), "loaded_at": 0.0}
+
+async def flash_sale_settings() -> dict:
+    """Current settings, re-read at most every FLASH_SALE_SETTINGS_TTL seconds so a stampede doesn't hit Mongo for them"""
+    if time.monotonic() - flash_sale_cache["loaded_at"] >= FLASH_SALE_SETTINGS_TTL:
+        flash_sale_cache["loaded_at"] = time.monotonic()
+        try:
+            with pymongo.timeout(1):
+                settings = await db.flash_sale_settings.find_one({"id": "flash_sale_settings"}, {"_id": 0})
+            if settings:
+                flash_sale_cache["settings"] = {**FlashSaleSettings().model_dump(), **settings}
+        except PyMongoError as e:
+            # Keep the last known settings rather than failing checkout over them
+            logger.warning("Failed to refresh flash-sale settings: %s", e)
+    return flash_sale_cache["settings"]
+
+@api_router.get("/admin/flash-sale")
+async def get_flash_sale_settings(admin = Depends(get_admin_user)):
+    flash_sale_cache["loaded_at"] = 0.0
+    settings = await flash_sale_settings()
+    return {
+        **settings,
+        "in_flight": admission_queue.in_flight,
+        "queue_length": len(admission_queue.waiters),
+        "avg_service_seconds": round(admission_queue.service_time, 3)
+    }
+
+@api_router.put("/admin/flash-sale")
+async def update_flash_sale_settings(settings_data: FlashSaleSettingsUpdate, admin = Depends(get_admin_user)):
+    update_data = {k: v for k, v in settings_data.model_dump().items() if v is not None}
+    update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+    
+    await db.flash_sale_settings.update_one(
+        {"id": "flash_sale_settings"},
+        {"$set": update_data},
+        upsert=True
+    )
+    # Other workers pick the change up within FLASH_SALE_SETTINGS_TTL
+    flash_sale_cache["loaded_at"] = 0.0
+    return {"message": "Flash-sale settings updated"}
+
+# Batched sub-requests
+# POST /api/batch runs several read-only GETs through the app in parallel and returns all the
+# responses at once, so a screen can make one round trip instead of a waterfall. Sub-requests
+# pass through the full middleware stack with the caller's credentials, each under the query
+# budget of its own path; the batch itself has no budget, so a slow item fails alone.
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', '20'))
+BATCH_SUBREQUEST_TIMEOUT = float(os.getenv('BATCH_SUBREQUEST_TIMEOUT', '10'))
+BATCH_FORWARDED_HEADERS = (b'authorization', b'accept-language')
+BATCH_RESPONSE_HEADERS = ('content-type', 'etag', 'age', 'cache-control', 'retry-after')
+# Streams and file downloads don't fit in a JSON envelope
+BATCH_EXCLUDED_PREFIXES = ('/api/batch', '/api/images/', '/api/admin/orders/stream', '/api/admin/orders/export', '/api/admin/exports/', '/api/admin/profiles/')
+
+class BatchSubRequest(BaseModel):
+    id: Optional[str] = None
+    path: str  # e.g. "/api/products?category=Cookies"
+    headers: Optional[dict] = None
+
+class BatchRequest(BaseModel):
+    requests: List[BatchSubRequest]
+
+async def run_subrequest(parent: Request, sub: BatchSubRequest) -> dict:
+    url = urllib.parse.urlsplit(sub.path)
+    if not url.path.startswith('/api/') or url.path.startswith(BATCH_EXCLUDED_PREFIXES):
+        return {"id": sub.id, "status": 400, "headers": {}, "body": {"detail": f"{url.path} cannot be batched"}}
+    
+    headers = [(name, value) for name, value in parent.scope['headers'] if name in BATCH_FORWARDED_HEADERS]
+    headers.extend((str(name).lower().encode('latin-1'), str(value).encode('latin-1')) for name, value in (sub.headers or {}).items())
+    scope = {
+        "type": "http",
+        "asgi": parent.scope.get("asgi", {"version": "3.0"}),
+        "http_version": parent.scope.get("http_version", "1.1"),
+        "method": "GET",
+        "scheme": parent.scope.get("scheme", "http"),
+        "server": parent.scope.get("server"),
+        "client": parent.scope.get("client"),
+        "root_path": parent.scope.get("root_path", ""),
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+        "state": dict(parent.scope.get("state", {}))
+    }
+    
+    response_start = {}
+    chunks = []
+    finished = asyncio.Event()
+    request_sent = False
+    
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Like a client that stays connected until the response is complete
+        await finished.wait()
+        return {"type": "http.disconnect"}
+    
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response_start.update(message)
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                finished.set()
+    
+    task = asyncio.get_running_loop().create_task(app(scope, receive, send))
+    try:
+        await asyncio.wait_for(task, BATCH_SUBREQUEST_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {"id": sub.id, "status": 504, "headers": {}, "body": {"detail": "Sub-request timed out"}}
+    finally:
+        finished.set()
+    
+    response_headers = {name.decode('latin-1'): value.decode('latin-1') for name, value in response_start.get("headers", [])}
+    body = b''.join(chunks)
+    if 'json' in response_headers.get('content-type', '') and body:
+        body = json.loads(body)
+    else:
+        body = body.decode('utf-8', errors='replace')
+    return {
+        "id": sub.id,
+        "status": response_start.get("status", 500),
+        "headers": {name: response_headers[name] for name in BATCH_RESPONSE_HEADERS if name in response_headers},
+        "body": body
+    }
+
+@api_router.post("/batch")
+async def batch(batch_data: BatchRequest, request: Request):
+    if not batch_data.requests:
+        return {"responses": []}
+    if len(batch_data.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    metrics.inc('batch_subrequests_total', len(batch_data.requests))
+    responses = await asyncio.gather(*(run_subrequest(request, sub) for sub in batch_data.requests))
+    return {"responses": responses}
+
+# Leases
+# Maintenance that every worker would otherwise repeat at startup runs under a lease in Mongo:
+# the worker that claims it does the work and renews the lease meanwhile, the others skip it.
+# A lease left by a crashed worker expires after LEASE_SECONDS.
+LEASE_SECONDS = float(os.getenv('LEASE_SECONDS', '60'))
+worker_id = str(uuid.uuid4())
+
+async def acquire_lease(name: str) -> bool:
+    now = datetime.now(timezone.utc)
+    try:
+        # The unique index on id turns a race for an unexpired lease into DuplicateKeyError
+        await db.leases.update_one(
+            {"id": name, "expires_at": {"$lte": now}},
+            {"$set": {"holder": worker_id, "acquired_at": now.isoformat(), "expires_at": now + timedelta(seconds=LEASE_SECONDS)}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def renew_lease(name: str):
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        try:
+            result = await db.leases.update_one(
+                {"id": name, "holder": worker_id},
+                {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=LEASE_SECONDS)}}
+            )
+            if not result.matched_count:
+                logger.warning("Lease %s was lost while its task was still running", name)
+        except PyMongoError as e:
+            logger.warning("Could not renew lease %s: %s", name, e)
+
+async def run_under_lease(name: str, task):
+    """Run task on one worker at a time across the deployment; None when the lease is already held"""
+    if not await acquire_lease(name):
+        metrics.inc('lease_runs_total', lease=name, result='skipped')
+        logger.info("%s is already running under its lease, skipping", name)
+        return None
+    renewal = asyncio.get_running_loop().create_task(renew_lease(name))
+    try:
+        result = await task()
+        metrics.inc('lease_runs_total', lease=name, result='ok')
+        return result
+    finally:
+        renewal.cancel()
+        try:
+            await db.leases.delete_one({"id": name, "holder": worker_id})
+        except PyMongoError as e:
+            logger.warning("Could not release lease %s, it expires in %.0fs: %s", name, LEASE_SECONDS, e)
+
+# Health endpoints
+# Async callables run at startup before the worker reports ready; later features register their warmers here
+cache_warmers = {
+    "stock_holds": stock_holds.start,
+    "storefront": warm_storefront_cache,
+    "product_images": register_product_images,
+}
+warmer_status = {}
+index_status = {"status": "pending", "missing": []}  # set by ensure_indexes at startup
+# Startup tasks that fail (Mongo unreachable or slow while the worker boots) are retried with
+# capped exponential backoff, so a worker becomes ready once the database is back
+STARTUP_RETRY_INITIAL_SECONDS = float(os.getenv('STARTUP_RETRY_INITIAL_SECONDS', '1'))
+STARTUP_RETRY_MAX_SECONDS = float(os.getenv('STARTUP_RETRY_MAX_SECONDS', '60'))
+
+async def retry_until_done(name: str, task):
+    delay = STARTUP_RETRY_INITIAL_SECONDS
+    attempt = 1
+    while True:
+        try:
+            result = await task()
+            metrics.inc('startup_task_runs_total', task=name, result='ok')
+            return result
+        except Exception as e:
+            metrics.inc('startup_task_runs_total', task=name, result='error')
+            logger.error("Startup task %s failed (attempt %d), retrying in %.1fs: %s", name, attempt, delay, str(e) or type(e).__name__)
+        # Jitter so workers that failed together don't retry in lockstep
+        await asyncio.sleep(delay * random.uniform(0.5, 1))
+        delay = min(delay * 2, STARTUP_RETRY_MAX_SECONDS)
+        attempt += 1
+
+async def ensure_indexes():
+    failed = []
+    for collection, indexes in REQUIRED_INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, name=index_name(keys), **options)
+            except Exception as e:
+                logger.error("Failed to create index %s on %s: %s", index_name(keys), collection, e)
+                failed.append(f"{collection}.{index_name(keys)}")
+    # Checked once here rather than on every probe: listing indexes costs a round trip per collection
+    missing = failed or await missing_indexes()
+    index_status.update(status="ok" if not missing else "missing", missing=missing)
+    if missing:
+        raise RuntimeError(f"{len(missing)} indexes not created: {', '.join(missing)}")
+
+async def run_cache_warmer(name: str, warmer):
+    async def attempt():
+        try:
+            await warmer()
+        except Exception as e:
+            warmer_status[name] = f"error: {str(e) or type(e).__name__}"
+            raise
+        warmer_status[name] = "ok"
+    await retry_until_done(f"warmer:{name}", attempt)
+
+async def run_cache_warmers():
+    await asyncio.gather(*(run_cache_warmer(name, warmer) for name, warmer in cache_warmers.items()))
+
+async def missing_indexes() -> List[str]:
+    missing = []
+    for collection, indexes in REQUIRED_INDEXES.items():
+        existing = await db[collection].index_information()
+        missing.extend(f"{collection}.{index_name(keys)}" for keys, _ in indexes if index_name(keys) not in existing)
+    return missing
+
+def connection_pool_report() -> dict:
+    pools = pool_stats.snapshot()
+    for address, pool in pools.items():
+        for field in ("size", "checked_out", "wait_queue"):
+            metrics.set(f'mongo_pool_{field}', pool[field], address=address)
+    return {
+        "max_pool_size": MONGO_MAX_POOL_SIZE,
+        "min_pool_size": MONGO_MIN_POOL_SIZE,
+        "wait_queue_timeout_ms": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "max_time_ms": MONGO_MAX_TIME_MS,
+        "pools": pools
+    }
+
+@app.get("/healthz")
+@api_router.get("/healthz")
+async def healthz():
+    """Liveness: the process and its event loop are responsive"""
+    return {"status": "ok", "event_loop_lag": loop_watchdog.last_lag}
+
+@app.get("/readyz")
+@api_router.get("/readyz")
+async def readyz():
+    """Readiness: MongoDB reachable, indexes in place and caches warmed"""
+    try:
+        return await readiness_report()
+    except Exception as e:
+        logger.warning("Readiness probe failed: %s", e)
+        return JSONResponse({"status": "not_ready", "error": str(e) or type(e).__name__}, status_code=503)
+
+async def readiness_report() -> JSONResponse:
+    checks = {}
+    ready = True
+    try:
+        started = time.perf_counter()
+        await asyncio.wait_for(db.command("ping", maxTimeMS=MONGO_MAX_TIME_MS), MONGO_SERVER_SELECTION_TIMEOUT_MS / 1000)
+        checks["mongodb"] = {"status": "ok", "latency_ms": round((time.perf_counter() - started) * 1000, 2)}
+    except Exception as e:
+        ready = False
+        checks["mongodb"] = {"status": "error", "error": str(e) or type(e).__name__}
+
+    checks["indexes"] = dict(index_status)
+    ready = ready and index_status["status"] == "ok"
+
+    warmers = {name: warmer_status.get(name, "pending") for name in cache_warmers}
+    checks["caches"] = {"status": "ok" if all(v == "ok" for v in warmers.values()) else "warming", "warmers": warmers}
+    ready = ready and checks["caches"]["status"] == "ok"
+
+    body = {"status": "ready" if ready else "not_ready", "checks": checks, "connection_pool": connection_pool_report()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
+# Diagnostics endpoints
+@api_router.get("/admin/metrics", response_class=PlainTextResponse)
+async def get_metrics(admin = Depends(get_admin_user)):
+    return metrics.render()
+
+@api_router.get("/admin/diagnostics/event-loop")
+async def get_event_loop_diagnostics(admin = Depends(get_admin_user)):
+    return loop_watchdog.snapshot()
+
+# Request profiling
+# An admin can profile a single live request by sending `X-Profile: 1` (or `?_profile=1`).
+# The profile is stored under PROFILE_DIR and its id returned in `X-Profile-Id`;
+# `X-Profile: download` returns the text report instead of the normal response.
+PROFILE_DIR = Path(os.getenv('PROFILE_DIR', str(ROOT_DIR / 'profiles')))
+PROFILE_REPORT_LINES = int(os.getenv('PROFILE_REPORT_LINES', '60'))
+profile_lock = asyncio.Lock()
+
+def _profile_path(profile_id: str, suffix: str) -> Path:
+    try:
+        uuid.UUID(profile_id)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    path = PROFILE_DIR / f"{profile_id}.{suffix}"
+    if not path.exists():
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return path
+
+def render_profile(path: Path, sort: str = "cumulative") -> str:
+    output = io.StringIO()
+    stats = pstats.Stats(str(path), stream=output)
+    stats.strip_dirs().sort_stats(sort).print_stats(PROFILE_REPORT_LINES)
+    return output.getvalue()
+
+def save_profile(profiler: cProfile.Profile, meta: dict) -> str:
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    profiler.dump_stats(str(PROFILE_DIR / f"{meta['id']}.prof"))
+    (PROFILE_DIR / f"{meta['id']}.json").write_text(json.dumps(meta))
+    return render_profile(PROFILE_DIR / f"{meta['id']}.prof")
+
+async def is_admin_request(request: Request) -> bool:
+    scheme, _, token = request.headers.get('authorization', '').partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return False
+    try:
+        user = await get_current_user(HTTPAuthorizationCredentials(scheme=scheme, credentials=token))
+        await get_admin_user(user)
+    except HTTPException:
+        return False
+    return True
+
+@api_router.get("/admin/profiles")
+async def list_profiles(admin = Depends(get_admin_user)):
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = [json.loads(path.read_text()) for path in PROFILE_DIR.glob('*.json')]
+    return sorted(profiles, key=lambda p: p['created_at'], reverse=True)
+
+@api_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = "text", sort: str = "cumulative", admin = Depends(get_admin_user)):
+    path = _profile_path(profile_id, "prof")
+    if format == "prof":
+        return FileResponse(path, media_type="application/octet-stream", filename=f"profile_{profile_id}.prof")
+    try:
+        report = await asyncio.to_thread(render_profile, path, sort)
+    except KeyError:
+        raise HTTPException(status_code=400, detail=f"Invalid sort key: {sort}")
+    return PlainTextResponse(report)
+
+@api_router.delete("/admin/profiles/{profile_id}")
+async def delete_profile(profile_id: str, admin = Depends(get_admin_user)):
+    _profile_path(profile_id, "prof").unlink()
+    _profile_path(profile_id, "json").unlink(missing_ok=True)
+    return {"message": "Profile deleted"}
+
 # Initialize admin user
 @api_router.post("/admin/init")
 async def init_admin():
@@ -944,12 +3863,277 @@ async def init_admin():
 # Include the router in the main app
 app.include_router(api_router)
 
+# Query time budgets
+# Each route class has a per-query budget that every Mongo operation made while handling the
+# request gets as its own timeout (see BudgetedMongoClient), so an unindexed scan fails fast with
+# a 503 instead of holding a connection. It bounds operations, not the request: handlers are never
+# cancelled halfway through a write, and work a request hands to a background task keeps a usable
+# limit instead of a deadline that is about to pass.
+QUERY_BUDGET_CUSTOMER_MS = int(os.getenv('QUERY_BUDGET_CUSTOMER_MS', '3000'))
+QUERY_BUDGET_ADMIN_MS = int(os.getenv('QUERY_BUDGET_ADMIN_MS', str(MONGO_MAX_TIME_MS)))
+QUERY_BUDGET_REPORTING_MS = int(os.getenv('QUERY_BUDGET_REPORTING_MS', '60000'))
+# Full scans of the order history
+REPORTING_PATH_PREFIXES = ('/api/admin/orders/export', '/api/admin/analytics/reports/', '/api/admin/analytics/sales/rebuild')
+# Batch items are budgeted one by one as they pass back through the middleware
+UNBUDGETED_PATHS = ('/healthz', '/readyz', '/api/healthz', '/api/readyz', '/api/batch')
+
+def query_budget_for(path: str):
+    if path.startswith(REPORTING_PATH_PREFIXES):
+        return 'reporting', QUERY_BUDGET_REPORTING_MS
+    if path.startswith('/api/admin/'):
+        return 'admin', QUERY_BUDGET_ADMIN_MS
+    return 'customer', QUERY_BUDGET_CUSTOMER_MS
+
+def query_budget_exceeded(route_class: str) -> JSONResponse:
+    metrics.inc('query_budget_exceeded_total', route_class=route_class)
+    return JSONResponse(
+        {"detail": "The server is busy, please try again shortly"},
+        status_code=503,
+        headers={"Retry-After": "5"}
+    )
+
+@app.exception_handler(PyMongoError)
+async def mongo_error_handler(request: Request, exc: PyMongoError):
+    if not exc.timeout:
+        raise exc
+    route_class = getattr(request.state, 'query_budget', 'unknown')
+    logger.warning("Query budget exceeded on %s %s (%s): %s", request.method, request.url.path, route_class, exc)
+    return query_budget_exceeded(route_class)
+
+@app.middleware("http")
+async def profile_request(request: Request, call_next):
+    mode = request.headers.get('x-profile') or request.query_params.get('_profile')
+    if not mode or not await is_admin_request(request):
+        return await call_next(request)
+    if profile_lock.locked():
+        # cProfile hooks the whole thread, so only one request is profiled at a time
+        response = await call_next(request)
+        response.headers['X-Profile-Skipped'] = 'busy'
+        return response
+
+    async with profile_lock:
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        profiler.enable()
+        try:
+            response = await call_next(request)
+            # Drain streaming bodies inside the profile so CSV building is included
+            body = b''.join([chunk async for chunk in response.body_iterator])
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+
+    meta = {
+        "id": str(uuid.uuid4()),
+        "method": request.method,
+        "path": request.url.path,
+        "query": str(request.url.query),
+        "status_code": response.status_code,
+        "elapsed": round(elapsed, 4),
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    report = await asyncio.to_thread(save_profile, profiler, meta)
+    metrics.inc('profiled_requests_total')
+    logger.info("Profiled %s %s in %.3fs (profile %s)", request.method, request.url.path, elapsed, meta['id'])
+
+    if mode == 'download':
+        return PlainTextResponse(
+            report,
+            headers={
+                "X-Profile-Id": meta['id'],
+                "Content-Disposition": f"attachment; filename=profile_{meta['id']}.txt"
+            }
+        )
+    headers = dict(response.headers)
+    headers['X-Profile-Id'] = meta['id']
+    return Response(content=body, status_code=response.status_code, headers=headers)
+
+@app.middleware("http")
+async def enforce_query_budget(request: Request, call_next):
+    if request.url.path in UNBUDGETED_PATHS:
+        return await call_next(request)
+    route_class, budget_ms = query_budget_for(request.url.path)
+    request.state.query_budget = route_class
+    token = query_timeout.set(budget_ms / 1000)
+    try:
+        return await call_next(request)
+    finally:
+        query_timeout.reset(token)
+
+@app.middleware("http")
+async def admit_checkout(request: Request, call_next):
+    # Registered after the query budget middleware so it wraps it and rejected requests skip it
+    if (request.method, request.url.path) not in ADMISSION_ROUTES:
+        return await call_next(request)
+    settings = await flash_sale_settings()
+    if not settings['enabled']:
+        return await call_next(request)
+
+    limit = settings['max_in_flight']
+    started = time.perf_counter()
+    position = await admission_queue.acquire(limit, settings['max_wait_seconds'], settings['max_queue'])
+    waited = time.perf_counter() - started
+    metrics.observe('admission_wait_seconds', waited)
+    if position is not None:
+        metrics.inc('admission_total', result='rejected')
+        retry_after = admission_queue.retry_after(position, limit)
+        return JSONResponse(
+            {
+                "detail": "Checkout is very busy right now, please try again shortly",
+                "queue_position": position,
+                "retry_after": retry_after
+            },
+            status_code=429,
+            headers={"Retry-After": str(retry_after), "X-Queue-Position": str(position)}
+        )
+
+    metrics.inc('admission_total', result='queued' if waited > 0.001 else 'immediate')
+    admitted = time.perf_counter()
+    try:
+        return await call_next(request)
+    finally:
+        admission_queue.release(limit, time.perf_counter() - admitted)
+
+# Response compression
+# JSON responses are compressed with brotli or gzip as the client accepts, always at the fast
+# level on the request path. Cacheable payloads (served from the storefront cache or carrying an
+# ETag) are kept in a bounded LRU by body digest, so repeats skip compression entirely; a body that
+# does repeat is recompressed once at the higher level in a thread and served smaller from then on.
+COMPRESSION_MIN_BYTES = int(os.getenv('COMPRESSION_MIN_BYTES', '1024'))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+COMPRESSION_CACHED_GZIP_LEVEL = int(os.getenv('COMPRESSION_CACHED_GZIP_LEVEL', '9'))
+COMPRESSION_CACHED_BROTLI_QUALITY = int(os.getenv('COMPRESSION_CACHED_BROTLI_QUALITY', '9'))
+COMPRESSION_CACHE_MAX_BYTES = int(os.getenv('COMPRESSION_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+COMPRESSION_THREAD_BYTES = 64 * 1024  # compress larger bodies off the event loop
+COMPRESSION_ENCODINGS = ('br', 'gzip')  # server preference when the client rates them equally
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    ratings = {}
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        if coding:
+            ratings[coding.strip()] = quality
+    best = None
+    for coding in COMPRESSION_ENCODINGS:
+        quality = ratings.get(coding, ratings.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (coding, quality)
+    return best[0] if best else None
+
+def compress_body(body: bytes, encoding: str, cached: bool) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=COMPRESSION_CACHED_BROTLI_QUALITY if cached else COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_CACHED_GZIP_LEVEL if cached else COMPRESSION_GZIP_LEVEL, mtime=0)
+
+def recompress_body(data: bytes, encoding: str) -> bytes:
+    """Fast-level bytes recompressed at the cached level"""
+    body = brotli.decompress(data) if encoding == 'br' else gzip.decompress(data)
+    return compress_body(body, encoding, cached=True)
+
+class CompressedBodies:
+    """Compressed bytes keyed by encoding and body digest, evicted by total size.
+
+    Entries are stored at the fast level; the first hit on one schedules its recompression at the
+    cached level off the event loop, so only bodies that repeat pay for the slower setting.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()  # key -> (data, recompressed)
+        self.recompressing = set()
+
+    def get(self, key) -> Optional[bytes]:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        self.entries.move_to_end(key)
+        data, recompressed = entry
+        if not recompressed and key not in self.recompressing:
+            self.recompressing.add(key)
+            asyncio.get_running_loop().create_task(self._recompress(key, data))
+        return data
+
+    def put(self, key, data: bytes, recompressed: bool = False):
+        if len(data) > self.max_bytes:
+            return
+        previous = self.entries.pop(key, None)
+        if previous:
+            self.size -= len(previous[0])
+        self.entries[key] = (data, recompressed)
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, (evicted, _) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+        metrics.set('compression_cache_bytes', self.size)
+
+    async def _recompress(self, key, data: bytes):
+        try:
+            smaller = await asyncio.to_thread(recompress_body, data, key[0])
+        except Exception as e:
+            logger.warning("Could not recompress cached response body: %s", e)
+            return
+        finally:
+            self.recompressing.discard(key)
+        # Skip bodies evicted while the thread ran
+        if key in self.entries:
+            self.put(key, smaller, recompressed=True)
+            metrics.inc('compression_cache_total', result='recompressed')
+
+compressed_bodies = CompressedBodies(COMPRESSION_CACHE_MAX_BYTES)
+
+@app.middleware("http")
+async def compress_response(request: Request, call_next):
+    response = await call_next(request)
+    if not response.headers.get('content-type', '').startswith('application/json'):
+        return response
+    response.headers['Vary'] = ', '.join(filter(None, [response.headers.get('vary'), 'Accept-Encoding']))
+    encoding = negotiate_encoding(request.headers.get('accept-encoding', ''))
+    if not encoding or 'content-encoding' in response.headers or response.status_code in (204, 304):
+        return response
+    
+    body = b''.join([chunk async for chunk in response.body_iterator])
+    headers = dict(response.headers)
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return Response(content=body, status_code=response.status_code, headers=headers)
+    
+    cacheable = 'age' in headers or 'etag' in headers
+    key = (encoding, hashlib.sha256(body).digest()) if cacheable else None
+    compressed = compressed_bodies.get(key) if cacheable else None
+    if compressed is None:
+        if len(body) >= COMPRESSION_THREAD_BYTES:
+            compressed = await asyncio.to_thread(compress_body, body, encoding, False)
+        else:
+            compressed = compress_body(body, encoding, False)
+        if cacheable:
+            compressed_bodies.put(key, compressed)
+            metrics.inc('compression_cache_total', result='miss')
+    else:
+        metrics.inc('compression_cache_total', result='hit')
+    metrics.inc('compression_bytes_total', len(body), encoding=encoding, stage='in')
+    metrics.inc('compression_bytes_total', len(compressed), encoding=encoding, stage='out')
+    
+    headers['content-encoding'] = encoding
+    headers['content-length'] = str(len(compressed))
+    if headers.get('etag', '').startswith('"'):
+        headers['etag'] = f"W/{headers['etag']}"
+    return Response(content=compressed, status_code=response.status_code, headers=headers)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    # Checkout retries read these to wait out the admission queue and in-flight idempotent requests
+    expose_headers=["Retry-After", "X-Queue-Position"],
 )
 
 # Configure logging
@@ -959,6 +4143,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_loop_watchdog():
+    loop_watchdog.start()
+
+@app.on_event("startup")
+async def load_catalog_snapshot():
+    # Before any request is served and without touching Mongo
+    await catalog_snapshot.load()
+
+startup_task: Optional[asyncio.Task] = None
+
+@app.on_event("startup")
+async def prepare_database():
+    # Don't block startup on an unreachable database; /readyz reports until this completes
+    async def prepare():
+        await asyncio.gather(retry_until_done('indexes', ensure_indexes), run_cache_warmers())
+        await retry_until_done('backfill_customer_snapshots', backfill_customer_snapshots)
+        # One worker is enough; the others skip it while the lease is held
+        await retry_until_done('backfill_payment_proofs', lambda: run_under_lease('backfill_payment_proofs', backfill_payment_proofs))
+    global startup_task
+    startup_task = asyncio.get_running_loop().create_task(prepare())
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if startup_task:
+        startup_task.cancel()
+    order_feed.stop()
+    stock_holds.stop()
+    if media_pool is not None:
+        media_pool.shutdown(wait=False, cancel_futures=True)
+    await loop_watchdog.stop()
     client.close()
\ No newline at end of file
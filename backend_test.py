@@ -4,6 +4,7 @@ import json
 import base64
 from datetime import datetime
 import io
+from concurrent.futures import ThreadPoolExecutor
 
 class MilkbitesBakeryAPITester:
     def __init__(self, base_url="https://cake-commerce-4.preview.emergentagent.com/api"):
@@ -436,6 +437,147 @@ class MilkbitesBakeryAPITester:
 
         return success
 
+    def test_stock_no_oversell(self, parallel_orders=200, stock=50):
+        """Fire parallel orders at a limited-stock product and verify it never oversells"""
+        print("\n=== STOCK RESERVATION UNDER CONCURRENCY ===")
+        
+        success, product = self.run_test(
+            "Create Limited Stock Product",
+            "POST",
+            "products",
+            200,
+            data={
+                "name": "Limited Eid Batch Nastar",
+                "description": "Concurrency test product",
+                "price": 75000,
+                "category": "Cookies",
+                "image_url": "https://example.com/nastar.jpg",
+                "stock": stock
+            },
+            headers=self.get_auth_headers(is_admin=True)
+        )
+        if not success:
+            return False
+
+        order_data = {
+            "items": [{"product_id": product['id'], "quantity": 1, "price": 75000}],
+            "delivery_type": "pickup",
+            "pickup_location": "Cilandak",
+            "notes": "Concurrency test order"
+        }
+        headers = {'Content-Type': 'application/json', **self.get_auth_headers()}
+
+        def place_order(_):
+            try:
+                return requests.post(f"{self.base_url}/orders", json=order_data, headers=headers).status_code
+            except Exception:
+                return None
+
+        print(f"   Placing {parallel_orders} parallel orders against stock of {stock}...")
+        with ThreadPoolExecutor(max_workers=50) as pool:
+            statuses = list(pool.map(place_order, range(parallel_orders)))
+
+        accepted = statuses.count(200)
+        rejected = statuses.count(409)
+        print(f"   Accepted: {accepted}, out of stock: {rejected}, other: {parallel_orders - accepted - rejected}")
+
+        success, product = self.run_test(
+            "Get Limited Stock Product",
+            "GET",
+            f"products/{product['id']}",
+            200
+        )
+
+        self.tests_run += 1
+        remaining = product.get('stock') if success else None
+        if remaining is not None and remaining >= 0 and accepted <= stock and accepted + remaining == stock:
+            self.tests_passed += 1
+            print(f"✅ No oversell - {accepted} sold, {remaining} left")
+        else:
+            print(f"❌ Oversell or lost stock - {accepted} sold, {remaining} left of {stock}")
+
+        if success:
+            self.run_test(
+                "Delete Limited Stock Product",
+                "DELETE",
+                f"products/{product['id']}",
+                200,
+                headers=self.get_auth_headers(is_admin=True)
+            )
+        return remaining is not None and accepted + remaining == stock
+
+    def test_rejects_non_positive_quantities(self, stock=5):
+        """Zero or negative quantities must be rejected, not turned into stock increases"""
+        print("\n=== NON-POSITIVE QUANTITIES ===")
+        
+        success, product = self.run_test(
+            "Create Quantity Test Product",
+            "POST",
+            "products",
+            200,
+            data={
+                "name": "Quantity Test Kastengel",
+                "description": "Quantity validation test product",
+                "price": 50000,
+                "category": "Cookies",
+                "image_url": "https://example.com/kastengel.jpg",
+                "stock": stock
+            },
+            headers=self.get_auth_headers(is_admin=True)
+        )
+        if not success:
+            return False
+
+        all_rejected = True
+        for quantity in (0, -3):
+            rejected, _ = self.run_test(
+                f"Add To Cart With Quantity {quantity}",
+                "POST",
+                "cart/add",
+                422,
+                data={"product_id": product['id'], "quantity": quantity},
+                headers=self.get_auth_headers()
+            )
+            all_rejected = all_rejected and rejected
+            rejected, _ = self.run_test(
+                f"Create Order With Quantity {quantity}",
+                "POST",
+                "orders",
+                422,
+                data={
+                    "items": [{"product_id": product['id'], "quantity": quantity, "price": 50000}],
+                    "delivery_type": "pickup",
+                    "pickup_location": "Cilandak"
+                },
+                headers=self.get_auth_headers()
+            )
+            all_rejected = all_rejected and rejected
+
+        success, product = self.run_test(
+            "Get Quantity Test Product",
+            "GET",
+            f"products/{product['id']}",
+            200
+        )
+
+        self.tests_run += 1
+        remaining = product.get('stock') if success else None
+        if remaining == stock:
+            self.tests_passed += 1
+            print(f"✅ Stock unchanged at {remaining}")
+        else:
+            print(f"❌ Stock changed from {stock} to {remaining}")
+
+        if success:
+            self.run_test(
+                "Delete Quantity Test Product",
+                "DELETE",
+                f"products/{product['id']}",
+                200,
+                headers=self.get_auth_headers(is_admin=True)
+            )
+        return all_rejected and remaining == stock
+
 def main():
     print("🧪 Starting Milkbites Bakery API Tests")
     print("=" * 50)
@@ -489,6 +631,12 @@ def main():
         # 10. Customer order tracking
         tester.test_customer_order_tracking()
 
+        # 11. Stock reservation under concurrency
+        tester.test_stock_no_oversell()
+
+        # 12. Quantity validation
+        tester.test_rejects_non_positive_quantities()
+
     except Exception as e:
         print(f"❌ Test execution failed: {str(e)}")
         return 1
@@ -3,6 +3,7 @@ import { Link, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import toast from 'react-hot-toast';
 import { ShoppingCart, Loader2 } from 'lucide-react';
+import ProductImage from './ProductImage';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -79,9 +80,9 @@ const ProductCard = ({ product }) => {
     >
       <Link to={`/product/${product.id}`}>
         <div className="aspect-square overflow-hidden relative">
-          <img
-            src={product.image_url}
-            alt={product.name}
+          <ProductImage
+            product={product}
+            sizes="(min-width: 1024px) 25vw, (min-width: 768px) 33vw, 50vw"
             className="w-full h-full object-cover group-hover:scale-105 transition-transform duration-300"
           />
           {product.requires_customization && (
@@ -0,0 +1,30 @@
+import React from 'react';
+
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+
+// Rendition URLs are relative to the API host unless the backend points them at a CDN
+const absolute = (url) => (url.startsWith('/') ? `${BACKEND_URL}${url}` : url);
+const absoluteSrcSet = (srcSet) => srcSet.split(', ').map(absolute).join(', ');
+
+const ProductImage = ({ product, sizes, className, loading = 'lazy' }) => {
+  const renditions = product.image_renditions;
+  if (!renditions) {
+    return <img src={product.image_url} alt={product.name} className={className} />;
+  }
+  return (
+    <picture>
+      <source type="image/webp" srcSet={absoluteSrcSet(renditions.webp)} sizes={sizes} />
+      <img
+        src={absolute(renditions.src)}
+        srcSet={absoluteSrcSet(renditions.jpeg)}
+        sizes={sizes}
+        alt={product.name}
+        loading={loading}
+        decoding="async"
+        className={className}
+      />
+    </picture>
+  );
+};
+
+export default ProductImage;
@@ -233,6 +233,18 @@ const AdminDashboard = () => {
     setProductDetails(details);
   };
 
+  const handleViewPaymentProof = async (orderId) => {
+    // Listings only carry the thumbnail; load the full proof when it is opened
+    try {
+      const res = await axios.get(`${API}/admin/orders/${orderId}/payment-proof`, {
+        headers: { Authorization: `Bearer ${token}` }
+      });
+      setShowPaymentProof(res.data.payment_proof);
+    } catch (error) {
+      toast.error('Failed to load payment proof');
+    }
+  };
+
   const handleDownloadCSV = async () => {
     try {
       const response = await axios.get(`${API}/admin/orders/export/csv`, {
@@ -1102,15 +1114,25 @@ const AdminDashboard = () => {
               </div>
 
               {/* Payment Proof */}
-              {selectedOrder.payment_proof && (
+              {(selectedOrder.payment_proof_thumbnail || selectedOrder.has_payment_proof) && (
                 <div>
                   <h3 className="font-semibold text-accent mb-3">Payment Proof</h3>
-                  <img 
-                    src={selectedOrder.payment_proof} 
-                    alt="Payment Proof" 
-                    className="w-full max-h-64 object-contain rounded-lg border border-border cursor-pointer"
-                    onClick={() => setShowPaymentProof(selectedOrder.payment_proof)}
-                  />
+                  {selectedOrder.payment_proof_thumbnail ? (
+                    <img 
+                      src={selectedOrder.payment_proof_thumbnail} 
+                      alt="Payment Proof" 
+                      className="w-full max-h-64 object-contain rounded-lg border border-border cursor-pointer"
+                      onClick={() => handleViewPaymentProof(selectedOrder.id)}
+                    />
+                  ) : (
+                    <button
+                      onClick={() => handleViewPaymentProof(selectedOrder.id)}
+                      className="flex items-center gap-2 text-sm text-primary hover:underline"
+                    >
+                      <Eye size={16} />
+                      View payment proof
+                    </button>
+                  )}
                 </div>
               )}
 
@@ -1125,6 +1147,20 @@ const AdminDashboard = () => {
           </div>
         </div>
       )}
+
+      {/* Payment Proof Viewer */}
+      {showPaymentProof && (
+        <div
+          className="fixed inset-0 bg-black/80 z-[60] flex items-center justify-center p-4"
+          onClick={() => setShowPaymentProof(null)}
+        >
+          <img
+            src={showPaymentProof}
+            alt="Payment Proof"
+            className="max-w-full max-h-full object-contain rounded-lg"
+          />
+        </div>
+      )}
     </div>
   );
 };
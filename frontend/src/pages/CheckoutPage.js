@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import toast from 'react-hot-toast';
@@ -9,6 +9,17 @@ import 'react-day-picker/dist/style.css';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
+// Times to wait out a 409 while an earlier attempt with the same Idempotency-Key is still running
+const IN_FLIGHT_RETRIES = 5;
+
+const sleep = (ms) => new Promise((resolve) => setTimeout(resolve, ms));
+
+// The server sends Retry-After (seconds) with 409 for a key still in flight and 429 when checkout is full
+const retryAfter = (response) => response.headers['retry-after'];
+
+// Outcomes the same key may still change: network errors, 5xx, the admission queue and an in-flight 409
+const isRetryable = (response) =>
+  !response || response.status >= 500 || response.status === 429 || (response.status === 409 && Boolean(retryAfter(response)));
 
 const CheckoutPage = () => {
   const [cart, setCart] = useState(null);
@@ -26,6 +37,8 @@ const CheckoutPage = () => {
   const [blockedDates, setBlockedDates] = useState([]);
   const [showDeliveryCalendar, setShowDeliveryCalendar] = useState(false);
   const [showPickupCalendar, setShowPickupCalendar] = useState(false);
+  // Reused when retrying after a network error so the server doesn't create the order twice
+  const idempotencyKey = useRef(crypto.randomUUID());
   const navigate = useNavigate();
   const token = localStorage.getItem('token');
 
@@ -121,6 +134,21 @@ const CheckoutPage = () => {
     }
   };
 
+  const postOrder = async (orderData) => {
+    for (let attempt = 0; ; attempt++) {
+      try {
+        return await axios.post(`${API}/orders`, orderData, {
+          headers: { Authorization: `Bearer ${token}`, 'Idempotency-Key': idempotencyKey.current }
+        });
+      } catch (error) {
+        // An earlier attempt with this key is still running: wait for its outcome instead of placing another
+        const inFlight = error.response?.status === 409 && retryAfter(error.response);
+        if (!inFlight || attempt >= IN_FLIGHT_RETRIES) throw error;
+        await sleep((Number(retryAfter(error.response)) || 1) * 1000);
+      }
+    }
+  };
+
   const handleSubmitOrder = async () => {
     if (deliveryType === 'delivery' && !deliveryAddress) {
       toast.error('Please enter delivery address');
@@ -150,13 +178,15 @@ const CheckoutPage = () => {
         notes
       };
 
-      const response = await axios.post(`${API}/orders`, orderData, {
-        headers: { Authorization: `Bearer ${token}` }
-      });
+      const response = await postOrder(orderData);
 
       toast.success('Order placed successfully');
       navigate(`/payment/${response.data.id}`);
     } catch (error) {
+      // A definite rejection (e.g. out of stock) is final for this key; the next attempt needs a new one
+      if (!isRetryable(error.response)) {
+        idempotencyKey.current = crypto.randomUUID();
+      }
       toast.error(error.response?.data?.detail || 'Failed to create order');
     } finally {
       setLoading(false);
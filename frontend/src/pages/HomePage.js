@@ -54,7 +54,7 @@ const HomePage = () => {
   };
 
   useEffect(() => {
-    fetchSiteSettings();
+    fetchBootstrap();
   }, []);
 
   useEffect(() => {
@@ -67,25 +67,27 @@ const HomePage = () => {
   }, [searchParams]);
 
   useEffect(() => {
-    fetchProducts();
-    fetchFeaturedProducts();
-  }, [activeCategory]);
-
-  const fetchSiteSettings = async () => {
-    try {
-      const response = await axios.get(`${API}/site-settings`);
-      setSiteSettings(response.data);
-    } catch (error) {
-      console.error('Error fetching site settings:', error);
+    // The featured view comes with the bootstrap payload; categories load their own products
+    if (activeCategory !== 'Featured' && activeCategory !== 'All') {
+      fetchProducts();
     }
-  };
+  }, [activeCategory]);
 
-  const fetchFeaturedProducts = async () => {
+  const fetchBootstrap = async () => {
     try {
-      const response = await axios.get(`${API}/products/featured`);
-      setFeaturedProducts(response.data);
+      // Site settings and featured products in one round trip
+      const response = await axios.get(`${API}/bootstrap`, { params: { include_products: false } });
+      const { sections } = response.data;
+      if (sections.site_settings?.data) {
+        setSiteSettings(sections.site_settings.data);
+      }
+      if (sections.featured?.data) {
+        setFeaturedProducts(sections.featured.data);
+      }
     } catch (error) {
-      console.error('Error fetching featured products:', error);
+      console.error('Error fetching homepage data:', error);
+    } finally {
+      setLoading(false);
     }
   };
 
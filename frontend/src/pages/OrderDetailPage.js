@@ -27,15 +27,22 @@ const OrderDetailPage = () => {
       });
       setOrder(response.data);
 
-      // Fetch product details
-      const productIds = [...new Set(response.data.items.map((item) => item.product_id))];
+      // Lines carry a product snapshot; only fetch products for lines without one
       const productDetails = {};
-      for (const id of productIds) {
+      response.data.items.forEach((item) => {
+        if (item.product_name) {
+          productDetails[item.product_id] = { name: item.product_name, image_url: item.image_url, price: item.price };
+        }
+      });
+      const productIds = [...new Set(response.data.items.map((item) => item.product_id))].filter((id) => !productDetails[id]);
+      if (productIds.length > 0) {
         try {
-          const prod = await axios.get(`${API}/products/${id}`);
-          productDetails[id] = prod.data;
+          const prod = await axios.get(`${API}/products/batch`, { params: { ids: productIds.join(',') } });
+          prod.data.forEach((product) => {
+            productDetails[product.id] = product;
+          });
         } catch (err) {
-          console.error(`Failed to fetch product ${id}`);
+          console.error('Failed to fetch products');
         }
       }
       setProducts(productDetails);
@@ -37,12 +37,14 @@ const PaymentPage = () => {
       // Fetch product details for items
       const productIds = [...new Set(response.data.items.map(item => item.product_id))];
       const productDetails = {};
-      for (const id of productIds) {
+      if (productIds.length > 0) {
         try {
-          const prod = await axios.get(`${API}/products/${id}`);
-          productDetails[id] = prod.data;
+          const prod = await axios.get(`${API}/products/batch`, { params: { ids: productIds.join(',') } });
+          prod.data.forEach((product) => {
+            productDetails[product.id] = product;
+          });
         } catch (err) {
-          console.error(`Failed to fetch product ${id}`);
+          console.error('Failed to fetch products');
         }
       }
       setProducts(productDetails);
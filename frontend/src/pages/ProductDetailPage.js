@@ -3,6 +3,7 @@ import { useParams, useNavigate } from 'react-router-dom';
 import axios from 'axios';
 import toast from 'react-hot-toast';
 import Header from '../components/Header';
+import ProductImage from '../components/ProductImage';
 import { Plus, Minus } from 'lucide-react';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
@@ -248,9 +249,10 @@ const ProductDetailPage = () => {
         <div className="grid grid-cols-1 lg:grid-cols-2 gap-12">
           {/* Product Image */}
           <div className="rounded-2xl overflow-hidden shadow-lg">
-            <img
-              src={product.image_url}
-              alt={product.name}
+            <ProductImage
+              product={product}
+              sizes="(min-width: 1024px) 50vw, 100vw"
+              loading="eager"
               className="w-full h-full object-cover"
             />
           </div>
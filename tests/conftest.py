@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Unit tests import the backend modules directly
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend'))
+
+# server.py reads these at import; the client connects lazily, so unit tests never reach Mongo
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'milkbites_unit_tests')
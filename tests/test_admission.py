@@ -0,0 +1,126 @@
+"""
+Milkbites Flash-Sale Admission Unit Tests
+Tests for: bounded in-flight checkout, FIFO hand-over, queue limits, timeouts
+"""
+import asyncio
+
+import server
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestAdmissionQueue:
+    """AdmissionQueue used by the flash-sale middleware"""
+
+    def test_admits_up_to_limit(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            assert await queue.acquire(2, 1, 10) is None
+            assert await queue.acquire(2, 1, 10) is None
+            assert queue.in_flight == 2
+            assert not queue.waiters
+        run(scenario())
+
+    def test_release_hands_slot_to_oldest_waiter(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            await queue.acquire(1, 1, 10)
+            first = asyncio.create_task(queue.acquire(1, 5, 10))
+            await settle()
+            second = asyncio.create_task(queue.acquire(1, 5, 10))
+            await settle()
+            assert len(queue.waiters) == 2
+
+            queue.release(1)
+            assert await first is None
+            assert not second.done()
+            # The slot moved to the waiter instead of being freed
+            assert queue.in_flight == 1
+
+            queue.release(1)
+            assert await second is None
+            queue.release(1)
+            assert queue.in_flight == 0
+        run(scenario())
+
+    def test_new_arrivals_cannot_overtake_waiters(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            await queue.acquire(1, 1, 10)
+            waiter = asyncio.create_task(queue.acquire(1, 5, 10))
+            await settle()
+            queue.release(1)
+            # A request arriving before the waiter wakes must queue behind it
+            late = asyncio.create_task(queue.acquire(1, 5, 10))
+            await settle()
+            assert await waiter is None
+            assert not late.done()
+            queue.release(1)
+            assert await late is None
+        run(scenario())
+
+    def test_timeout_returns_queue_position(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            await queue.acquire(1, 1, 10)
+            first = asyncio.create_task(queue.acquire(1, 0.05, 10))
+            await settle()
+            second = asyncio.create_task(queue.acquire(1, 0.05, 10))
+            assert await first == 1
+            assert await second == 1
+            assert not queue.waiters
+            assert queue.in_flight == 1
+        run(scenario())
+
+    def test_full_queue_turned_away_immediately(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            await queue.acquire(1, 1, 1)
+            waiter = asyncio.create_task(queue.acquire(1, 5, 1))
+            await settle()
+            assert await queue.acquire(1, 5, 1) == 2
+            waiter.cancel()
+            await settle()
+        run(scenario())
+
+    def test_cancelled_waiter_leaves_queue(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            await queue.acquire(1, 1, 10)
+            waiter = asyncio.create_task(queue.acquire(1, 5, 10))
+            await settle()
+            waiter.cancel()
+            await settle()
+            assert not queue.waiters
+            queue.release(1)
+            assert queue.in_flight == 0
+        run(scenario())
+
+    def test_cancelled_after_hand_over_returns_slot(self):
+        async def scenario():
+            queue = server.AdmissionQueue()
+            await queue.acquire(1, 1, 10)
+            waiter = asyncio.create_task(queue.acquire(1, 5, 10))
+            await settle()
+            queue.release(1)  # slot handed to the waiter, which hasn't resumed yet
+            waiter.cancel()
+            await settle()
+            assert waiter.cancelled()
+            assert queue.in_flight == 0
+        run(scenario())
+
+    def test_retry_after_tracks_service_time(self):
+        queue = server.AdmissionQueue()
+        assert queue.retry_after(1, 10) == 1
+        queue.service_time = 2.0
+        assert queue.retry_after(25, 10) == 5
+        queue.in_flight = 1
+        queue.release(10, elapsed=7.0)
+        assert queue.service_time == 3.0
@@ -0,0 +1,209 @@
+"""
+Milkbites Analytics Unit Tests
+Tests for: order frames, RFM segments, co-purchase, discount effectiveness, hourly demand
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import analytics
+
+WIB = timezone(timedelta(hours=7))
+NOW = datetime.now(timezone.utc)
+
+
+def make_order(order_id, user_id, items, created_at=None, status="completed", discount=0, code=None, name=None):
+    total = sum(price * quantity for _, quantity, price in items)
+    return {
+        "id": order_id,
+        "user_id": user_id,
+        "customer": {"full_name": name or f"Customer {user_id}"},
+        "created_at": (created_at or NOW).isoformat(),
+        "status": status,
+        "total_amount": total,
+        "discount_amount": discount,
+        "final_amount": total - discount,
+        "discount_code": code,
+        "items": [
+            {"product_id": product_id, "product_name": product_id.title(), "quantity": quantity, "price": price}
+            for product_id, quantity, price in items
+        ]
+    }
+
+
+def frames(*orders):
+    builder = analytics.FrameBuilder()
+    for order in orders:
+        builder.add(order)
+    return builder.build(WIB)
+
+
+class TestFrameBuilder:
+    """Orders become one row per order and one row per line"""
+
+    def test_builds_typed_frames_in_local_time(self):
+        created_at = datetime(2026, 3, 1, 20, 30, tzinfo=timezone.utc)
+        orders, lines = frames(make_order("o1", "u1", [("nastar", 2, 50000), ("kastengel", 1, 60000)], created_at=created_at))
+        assert list(orders["id"]) == ["o1"]
+        assert orders.loc[0, "created_at"].hour == 3  # 20:30 UTC is 03:30 WIB the next day
+        assert orders.loc[0, "customer_name"] == "Customer u1"
+        assert orders.loc[0, "final_amount"] == 160000
+        assert sorted(lines["product_id"]) == ["kastengel", "nastar"]
+        assert lines["revenue"].sum() == 160000
+
+    def test_excludes_cancelled_orders_and_their_lines(self):
+        orders, lines = frames(
+            make_order("o1", "u1", [("nastar", 1, 50000)]),
+            make_order("o2", "u2", [("kastengel", 3, 60000)], status="cancelled")
+        )
+        assert list(orders["id"]) == ["o1"]
+        assert list(lines["order_id"]) == ["o1"]
+
+    def test_empty_history(self):
+        orders, lines = frames()
+        assert orders.empty
+        assert lines.empty
+
+
+class TestRfmSegments:
+    """Recency / frequency / monetary scores per customer"""
+
+    def test_scores_and_segments(self):
+        orders, lines = frames(
+            *[make_order(f"a{i}", "regular", [("nastar", 1, 50000)], created_at=NOW - timedelta(days=i)) for i in range(5)],
+            make_order("b1", "lapsed", [("nastar", 1, 50000)], created_at=NOW - timedelta(days=200)),
+            make_order("c1", "newcomer", [("kastengel", 4, 60000)], created_at=NOW - timedelta(days=1))
+        )
+        report = analytics.rfm_segments(orders, lines)
+        customers = {customer["user_id"]: customer for customer in report["customers"]}
+        assert customers["regular"]["frequency"] == 5
+        assert customers["regular"]["monetary"] == 250000
+        assert customers["lapsed"]["recency_days"] == 200
+        assert customers["lapsed"]["r_score"] < customers["regular"]["r_score"]
+        assert customers["newcomer"]["m_score"] > customers["lapsed"]["m_score"]
+        assert all(1 <= customer[score] <= 5 for customer in customers.values() for score in ("r_score", "f_score", "m_score"))
+        assert sum(segment["customers"] for segment in report["segments"]) == 3
+        assert sum(segment["revenue"] for segment in report["segments"]) == 540000
+
+    def test_single_customer(self):
+        orders, lines = frames(make_order("o1", "u1", [("nastar", 1, 50000)]))
+        report = analytics.rfm_segments(orders, lines)
+        assert len(report["customers"]) == 1
+        customer = report["customers"][0]
+        assert (customer["r_score"], customer["f_score"], customer["m_score"]) == (5, 5, 5)
+        assert customer["segment"] == "Champions"
+
+    def test_cancelled_orders_do_not_count(self):
+        orders, lines = frames(
+            make_order("o1", "u1", [("nastar", 1, 50000)]),
+            make_order("o2", "u1", [("nastar", 10, 50000)], status="cancelled")
+        )
+        customer = analytics.rfm_segments(orders, lines)["customers"][0]
+        assert customer["frequency"] == 1
+        assert customer["monetary"] == 50000
+
+    def test_empty(self):
+        assert analytics.rfm_segments(*frames()) == {"segments": [], "customers": []}
+
+
+class TestCoPurchase:
+    """Products bought together, with support, confidence and lift"""
+
+    def test_pairs_and_matrix(self):
+        orders, lines = frames(
+            make_order("o1", "u1", [("nastar", 1, 50000), ("kastengel", 1, 60000)]),
+            make_order("o2", "u2", [("nastar", 2, 50000), ("kastengel", 1, 60000)]),
+            make_order("o3", "u3", [("nastar", 1, 50000), ("putri", 1, 55000)]),
+            make_order("o4", "u4", [("putri", 1, 55000)])
+        )
+        report = analytics.co_purchase(orders, lines)
+        assert report["orders"] == 4
+        products = {product["product_id"]: product["orders"] for product in report["products"]}
+        assert products == {"kastengel": 2, "nastar": 3, "putri": 2}
+        # Diagonal is the number of orders containing each product, whatever the quantity
+        ids = [product["product_id"] for product in report["products"]]
+        assert [report["matrix"][k][k] for k in range(len(ids))] == [products[pid] for pid in ids]
+
+        top = report["pairs"][0]
+        assert {top["product_a"], top["product_b"]} == {"kastengel", "nastar"}
+        assert top["orders_together"] == 2
+        assert top["support"] == pytest.approx(0.5)
+        assert top["lift"] == pytest.approx(2 * 4 / (2 * 3))
+        assert {(pair["product_a"], pair["product_b"]) for pair in report["pairs"]} == {("kastengel", "nastar"), ("nastar", "putri")}
+
+    def test_single_product_orders_have_no_pairs(self):
+        report = analytics.co_purchase(*frames(make_order("o1", "u1", [("nastar", 1, 50000)])))
+        assert report["orders"] == 1
+        assert report["pairs"] == []
+        assert report["matrix"] == [[1]]
+
+    def test_cancelled_orders_excluded(self):
+        report = analytics.co_purchase(*frames(
+            make_order("o1", "u1", [("nastar", 1, 50000)]),
+            make_order("o2", "u2", [("nastar", 1, 50000), ("kastengel", 1, 60000)], status="cancelled")
+        ))
+        assert report["orders"] == 1
+        assert [product["product_id"] for product in report["products"]] == ["nastar"]
+
+    def test_empty(self):
+        assert analytics.co_purchase(*frames()) == {"orders": 0, "products": [], "matrix": [], "pairs": []}
+
+
+class TestDiscountEffectiveness:
+    """Discounted vs full-price baskets and per-code performance"""
+
+    def test_overall_and_codes(self):
+        orders, lines = frames(
+            make_order("o1", "u1", [("nastar", 2, 50000)], discount=10000, code="EID10"),
+            make_order("o2", "u2", [("nastar", 4, 50000)], discount=20000, code="EID10"),
+            make_order("o3", "u3", [("nastar", 1, 50000)])
+        )
+        report = analytics.discount_effectiveness(orders, lines)
+        overall = {row["discounted"]: row for row in report["overall"]}
+        assert overall[True]["orders"] == 2
+        assert overall[False]["orders"] == 1
+        assert overall[True]["order_share"] == pytest.approx(2 / 3)
+        assert overall[True]["avg_basket"] == 150000
+
+        (code,) = report["codes"]
+        assert code["discount_code"] == "EID10"
+        assert code["discount_total"] == 30000
+        assert code["discount_rate"] == pytest.approx(30000 / 300000)
+        assert code["revenue_per_discount"] == pytest.approx(270000 / 30000)
+
+    def test_without_discounts(self):
+        report = analytics.discount_effectiveness(*frames(make_order("o1", "u1", [("nastar", 1, 50000)])))
+        assert [row["discounted"] for row in report["overall"]] == [False]
+        assert report["codes"] == []
+
+    def test_empty(self):
+        assert analytics.discount_effectiveness(*frames()) == {"overall": [], "codes": []}
+
+
+class TestHourlyDemand:
+    """Orders and revenue by local hour and weekday"""
+
+    def test_buckets_by_local_hour_and_weekday(self):
+        # Monday 02:00 UTC is Monday 09:00 WIB
+        monday = datetime(2026, 3, 2, 2, 0, tzinfo=timezone.utc)
+        orders, lines = frames(
+            make_order("o1", "u1", [("nastar", 1, 50000)], created_at=monday),
+            make_order("o2", "u2", [("nastar", 2, 50000)], created_at=monday + timedelta(minutes=30)),
+            make_order("o3", "u3", [("nastar", 1, 50000)], created_at=monday + timedelta(days=1))
+        )
+        report = analytics.hourly_demand(orders, lines)
+        assert report["days"] == 2
+        by_hour = {row["hour"]: row for row in report["by_hour"]}
+        assert by_hour[9]["orders"] == 3
+        assert by_hour[9]["revenue"] == 200000
+        assert by_hour[9]["avg_orders_per_day"] == 1.5
+        assert report["orders_by_weekday_hour"][0][9] == 2
+        assert report["orders_by_weekday_hour"][1][9] == 1
+        assert sum(map(sum, report["orders_by_weekday_hour"])) == 3
+
+    def test_empty(self):
+        report = analytics.hourly_demand(*frames())
+        assert report["days"] == 0
+        assert len(report["by_hour"]) == 24
+        assert all(row["orders"] == 0 for row in report["by_hour"])
+        assert report["orders_by_weekday_hour"] == [[0] * 24 for _ in range(7)]
@@ -0,0 +1,104 @@
+"""
+Milkbites Response Compression Unit Tests
+Tests for: Accept-Encoding negotiation, compressed body cache
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+
+import brotli
+import pytest
+
+import server
+
+
+def payload(count=200) -> bytes:
+    return json.dumps([
+        {"id": hashlib.md5(str(n).encode()).hexdigest(), "name": f"Kue Kering #{n}", "price": 45000 + n * 1500, "stock": n * 7 % 31}
+        for n in range(count)
+    ]).encode()
+
+
+class TestNegotiateEncoding:
+    """Picking br or gzip from the client's Accept-Encoding"""
+
+    @pytest.mark.parametrize("header,expected", [
+        ("gzip, deflate, br", "br"),  # equal ratings: server preference
+        ("br", "br"),
+        ("gzip", "gzip"),
+        ("GZIP, Deflate", "gzip"),
+        ("br;q=0.5, gzip;q=0.8", "gzip"),
+        ("br;q=1.0, gzip;q=0.9", "br"),
+        ("*", "br"),
+        ("gzip;q=0.5, *;q=0.8", "br"),  # br rated through the wildcard
+        ("br;q=0, *", "gzip"),
+    ])
+    def test_picks_encoding(self, header, expected):
+        assert server.negotiate_encoding(header) == expected
+
+    @pytest.mark.parametrize("header", ["", "identity", "deflate", "br;q=0, gzip;q=0", "*;q=0", "gzip;q=abc"])
+    def test_no_encoding(self, header):
+        assert server.negotiate_encoding(header) is None
+
+
+class TestCompressBody:
+    """Fast and cached compression levels"""
+
+    @pytest.mark.parametrize("encoding,decompress", [("br", brotli.decompress), ("gzip", gzip.decompress)])
+    def test_round_trip(self, encoding, decompress):
+        body = payload()
+        fast = server.compress_body(body, encoding, False)
+        smaller = server.recompress_body(fast, encoding)
+        assert decompress(fast) == body
+        assert decompress(smaller) == body
+        assert len(fast) < len(body)
+        assert len(smaller) < len(body)
+
+    def test_gzip_is_deterministic(self):
+        # No timestamp in the header, so identical bodies compress to identical bytes
+        assert server.compress_body(payload(), "gzip", False) == server.compress_body(payload(), "gzip", False)
+
+
+class TestCompressedBodies:
+    """LRU of compressed bodies, recompressed on their first hit"""
+
+    def test_first_hit_recompresses_off_loop(self):
+        async def scenario():
+            cache = server.CompressedBodies(1024 * 1024)
+            key = ("br", b"digest")
+            fast = server.compress_body(payload(), "br", False)
+            cache.put(key, fast)
+            assert cache.get(key) == fast
+            assert key in cache.recompressing
+            while cache.recompressing:
+                await asyncio.sleep(0.01)
+            data, recompressed = cache.entries[key]
+            assert recompressed
+            assert brotli.decompress(data) == payload()
+            assert cache.get(key) == data
+            assert not cache.recompressing  # not scheduled again
+        asyncio.run(scenario())
+
+    def test_evicts_least_recently_used(self):
+        async def scenario():
+            cache = server.CompressedBodies(250)
+            cache.put(("gzip", b"a"), b"a" * 100, recompressed=True)
+            cache.put(("gzip", b"b"), b"b" * 100, recompressed=True)
+            cache.get(("gzip", b"a"))
+            cache.put(("gzip", b"c"), b"c" * 100, recompressed=True)
+            assert list(cache.entries) == [("gzip", b"a"), ("gzip", b"c")]
+            assert cache.size == 200
+        asyncio.run(scenario())
+
+    def test_skips_oversized_bodies(self):
+        cache = server.CompressedBodies(10)
+        cache.put(("gzip", b"big"), b"x" * 11)
+        assert not cache.entries
+        assert cache.size == 0
+
+    def test_replacing_entry_keeps_size(self):
+        cache = server.CompressedBodies(1000)
+        cache.put(("br", b"k"), b"x" * 300)
+        cache.put(("br", b"k"), b"x" * 200, recompressed=True)
+        assert cache.size == 200
@@ -0,0 +1,155 @@
+"""
+Milkbites Columnar Export Unit Tests
+Tests for: export schemas, Parquet and Arrow IPC writers, zip bundles, Range downloads
+"""
+import zipfile
+from datetime import datetime, timezone
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from fastapi import HTTPException
+
+import exports
+import server
+
+
+def make_order(number, items=(("nastar", 2, 50000.0),), **fields):
+    return {
+        "id": f"order-{number}",
+        "order_number": f"MB202603010{number:03d}",
+        "created_at": "2026-03-01T10:00:00+00:00",
+        "updated_at": datetime(2026, 3, 1, 11, 0, tzinfo=timezone.utc),
+        "status": "pending",
+        "user_id": "u1",
+        "customer_name": "Sari",
+        "customer_whatsapp": "0811",
+        "customer_email": "sari@example.com",
+        "total_amount": sum(quantity * price for _, quantity, price in items),
+        "shipping_fee": 0,
+        "discount_amount": None,
+        "final_amount": sum(quantity * price for _, quantity, price in items),
+        "payment_type": "full",
+        "payment_amount": 0,
+        "delivery_type": "pickup",
+        "pickup_location": "Cilandak",
+        "items": [
+            {"product_id": product_id, "product_name": product_id.title(), "quantity": quantity, "price": price}
+            for product_id, quantity, price in items
+        ],
+        **fields
+    }
+
+
+def read_table(path, fmt):
+    if fmt == "parquet":
+        return pq.read_table(path)
+    with pa.memory_map(str(path)) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+class TestOrderColumns:
+    """Order documents flattened into the two table layouts"""
+
+    def test_rows_match_schemas(self):
+        rows, lines = exports.order_columns([make_order(1, items=(("nastar", 2, 50000.0), ("kastengel", 1, 60000.0)), has_payment_proof=True)])
+        assert list(rows) == exports.ORDERS_SCHEMA.names
+        assert list(lines) == exports.LINES_SCHEMA.names
+        assert rows["item_count"] == [3]
+        assert rows["discount_amount"] == [0.0]
+        assert rows["has_payment_proof"] == [True]
+        assert rows["created_at"] == [datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)]
+        assert lines["line_number"] == [1, 2]
+        assert lines["line_total"] == [100000.0, 60000.0]
+        # Valid against the schemas, including the ISO string timestamps
+        pa.RecordBatch.from_pydict(rows, schema=exports.ORDERS_SCHEMA)
+        pa.RecordBatch.from_pydict(lines, schema=exports.LINES_SCHEMA)
+
+    def test_order_without_items(self):
+        rows, lines = exports.order_columns([make_order(1, items=())])
+        assert rows["item_count"] == [0]
+        assert all(values == [] for values in lines.values())
+
+
+@pytest.mark.parametrize("fmt", list(exports.FORMATS))
+class TestOrderExportWriter:
+    """Batches written to Parquet or Arrow IPC read back unchanged"""
+
+    def test_round_trip(self, tmp_path, fmt):
+        writer = exports.OrderExportWriter(tmp_path, fmt)
+        writer.write_batch([make_order(n) for n in range(3)])
+        writer.write_batch([])
+        writer.write_batch([make_order(n, items=(("putri", 1, 55000.0),)) for n in range(3, 5)])
+        orders_path, lines_path = writer.close()
+        assert writer.rows_written == 5
+
+        orders = read_table(orders_path, fmt)
+        lines = read_table(lines_path, fmt)
+        assert orders.schema.equals(exports.ORDERS_SCHEMA)
+        assert lines.schema.equals(exports.LINES_SCHEMA)
+        assert orders.column("order_id").to_pylist() == [f"order-{n}" for n in range(5)]
+        assert orders.column("created_at")[0].as_py() == datetime(2026, 3, 1, 10, 0, tzinfo=timezone.utc)
+        assert lines.num_rows == 5
+        assert lines.column("product_id").to_pylist() == ["nastar"] * 3 + ["putri"] * 2
+        assert sum(lines.column("line_total").to_pylist()) == 3 * 100000.0 + 2 * 55000.0
+
+    def test_empty_export_is_readable(self, tmp_path, fmt):
+        writer = exports.OrderExportWriter(tmp_path, fmt)
+        orders_path, lines_path = writer.close()
+        assert read_table(orders_path, fmt).num_rows == 0
+        assert read_table(lines_path, fmt).schema.equals(exports.LINES_SCHEMA)
+
+    def test_tables_are_compressed(self, tmp_path, fmt):
+        orders = [make_order(n, notes="Please pack the jars separately " * 20) for n in range(500)]
+        writer = exports.OrderExportWriter(tmp_path, fmt)
+        writer.write_batch(orders)
+        orders_path, _ = writer.close()
+        uncompressed = pa.Table.from_batches([pa.RecordBatch.from_pydict(exports.order_columns(orders)[0], schema=exports.ORDERS_SCHEMA)]).nbytes
+        assert orders_path.stat().st_size < uncompressed / 5
+
+    def test_bundle(self, tmp_path, fmt):
+        writer = exports.OrderExportWriter(tmp_path, fmt)
+        writer.write_batch([make_order(n) for n in range(2)])
+        paths = writer.close()
+        archive_path = exports.bundle(paths, tmp_path / f"orders_{fmt}.zip")
+
+        extracted = tmp_path / "extracted"
+        with zipfile.ZipFile(archive_path) as archive:
+            assert sorted(archive.namelist()) == sorted(path.name for path in paths)
+            archive.extractall(extracted)
+        assert read_table(extracted / f"orders.{fmt}", fmt).num_rows == 2
+        assert read_table(extracted / f"order_lines.{fmt}", fmt).num_rows == 2
+
+
+class TestParseByteRange:
+    """Single `bytes=` ranges for resuming export downloads"""
+
+    @pytest.mark.parametrize("header,expected", [
+        ("bytes=0-99", (0, 99)),
+        ("bytes=100-", (100, 999)),
+        ("bytes=900-5000", (900, 999)),  # end clamped to the file
+        ("bytes=-100", (900, 999)),  # suffix
+        ("bytes=-5000", (0, 999)),  # suffix longer than the file
+        ("bytes=999-999", (999, 999)),
+        ("Bytes = 10-19", (10, 19)),
+    ])
+    def test_satisfiable(self, header, expected):
+        assert server.parse_byte_range(header, 1000) == expected
+
+    @pytest.mark.parametrize("header", ["items=0-10", "bytes=0-10,20-30", "garbage"])
+    def test_whole_file(self, header):
+        assert server.parse_byte_range(header, 1000) is None
+
+    @pytest.mark.parametrize("header", [
+        "bytes=1000-", "bytes=2000-3000", "bytes=50-10", "bytes=-0", "bytes=a-b", "bytes=-",
+    ])
+    def test_not_satisfiable(self, header):
+        with pytest.raises(HTTPException) as e:
+            server.parse_byte_range(header, 1000)
+        assert e.value.status_code == 416
+        assert e.value.headers["Content-Range"] == "bytes */1000"
+
+    def test_empty_file(self):
+        with pytest.raises(HTTPException) as e:
+            server.parse_byte_range("bytes=0-", 0)
+        assert e.value.status_code == 416
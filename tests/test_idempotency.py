@@ -0,0 +1,172 @@
+"""
+Milkbites Idempotency Key Unit Tests
+Tests for: replaying stored responses, freeing keys on failure, concurrent and mismatched requests
+"""
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError
+
+import server
+
+
+class IdempotencyKeys:
+    """Just enough of the idempotency_keys collection for run_idempotent"""
+
+    def __init__(self):
+        self.records = {}
+
+    async def insert_one(self, record):
+        if record["key"] in self.records:
+            raise DuplicateKeyError("duplicate key")
+        self.records[record["key"]] = dict(record)
+
+    async def find_one(self, query, projection=None):
+        record = self.records.get(query["key"])
+        return dict(record) if record else None
+
+    async def update_one(self, query, update):
+        record = self.records.get(query["key"])
+        matched = record is not None and all(
+            record.get(field) < condition["$lt"] if isinstance(condition, dict) else record.get(field) == condition
+            for field, condition in query.items()
+        )
+        if matched:
+            record.update(update["$set"])
+        return SimpleNamespace(modified_count=int(matched))
+
+    async def delete_one(self, query):
+        self.records.pop(query["key"], None)
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    collection = IdempotencyKeys()
+    monkeypatch.setattr(server, "db", SimpleNamespace(idempotency_keys=collection))
+    return collection
+
+
+def run_idempotent(handler, key="key-1", fingerprint="fp-1"):
+    return asyncio.run(server.run_idempotent(key, "user-1", "orders", fingerprint, handler))
+
+
+class TestRunIdempotent:
+    """run_idempotent around order creation and proof upload"""
+
+    def test_replays_stored_response(self, keys):
+        calls = []
+
+        async def handler(committed):
+            calls.append(1)
+            return {"id": "order-1", "final_amount": 85000}
+
+        assert run_idempotent(handler) == {"id": "order-1", "final_amount": 85000}
+        replay = run_idempotent(handler)
+        assert len(calls) == 1
+        assert replay.status_code == 200
+        assert replay.headers["Idempotent-Replayed"] == "true"
+        assert json.loads(replay.body) == {"id": "order-1", "final_amount": 85000}
+
+    def test_without_key_always_runs(self, keys):
+        calls = []
+
+        async def handler(committed):
+            calls.append(1)
+            return {"ok": True}
+
+        run_idempotent(handler, key=None)
+        run_idempotent(handler, key=None)
+        assert len(calls) == 2
+        assert not keys.records
+
+    def test_client_error_is_replayed(self, keys):
+        calls = []
+
+        async def handler(committed):
+            calls.append(1)
+            raise HTTPException(status_code=400, detail="Cart is empty")
+
+        with pytest.raises(HTTPException):
+            run_idempotent(handler)
+        replay = run_idempotent(handler)
+        assert len(calls) == 1
+        assert replay.status_code == 400
+        assert json.loads(replay.body) == {"detail": "Cart is empty"}
+
+    @pytest.mark.parametrize("error", [HTTPException(status_code=503, detail="Busy"), RuntimeError("connection reset")])
+    def test_failure_before_commit_frees_key(self, keys, error):
+        async def failing(committed):
+            raise error
+
+        async def handler(committed):
+            return {"id": "order-2"}
+
+        with pytest.raises(type(error)):
+            run_idempotent(failing)
+        assert not keys.records
+        assert run_idempotent(handler) == {"id": "order-2"}
+
+    def test_failure_after_commit_replays_committed_response(self, keys):
+        calls = []
+
+        async def handler(committed):
+            calls.append(1)
+            await committed({"id": "order-3"})
+            raise RuntimeError("cart clear failed")
+
+        with pytest.raises(RuntimeError):
+            run_idempotent(handler)
+        replay = run_idempotent(handler)
+        assert len(calls) == 1
+        assert json.loads(replay.body) == {"id": "order-3"}
+
+    def test_different_request_with_same_key_rejected(self, keys):
+        async def handler(committed):
+            return {"id": "order-4"}
+
+        run_idempotent(handler)
+        with pytest.raises(HTTPException) as e:
+            run_idempotent(handler, fingerprint="fp-2")
+        assert e.value.status_code == 422
+
+    def test_in_progress_request_gets_409(self, keys):
+        async def scenario():
+            started, finish = asyncio.Event(), asyncio.Event()
+
+            async def slow(committed):
+                started.set()
+                await finish.wait()
+                return {"id": "order-5"}
+
+            first = asyncio.create_task(server.run_idempotent("key-1", "user-1", "orders", "fp-1", slow))
+            await started.wait()
+            with pytest.raises(HTTPException) as e:
+                await server.run_idempotent("key-1", "user-1", "orders", "fp-1", slow)
+            assert e.value.status_code == 409
+            assert e.value.headers["Retry-After"] == "1"
+            finish.set()
+            assert await first == {"id": "order-5"}
+
+        asyncio.run(scenario())
+
+    def test_stale_pending_key_reclaimed(self, keys):
+        async def handler(committed):
+            return {"id": "order-6"}
+
+        keys.records["user-1:orders:key-1"] = {
+            "key": "user-1:orders:key-1", "fingerprint": "fp-1", "status": "pending",
+            "locked_at": "2020-01-01T00:00:00+00:00", "created_at": "2020-01-01T00:00:00+00:00"
+        }
+        assert run_idempotent(handler) == {"id": "order-6"}
+        assert keys.records["user-1:orders:key-1"]["status"] == "completed"
+
+    def test_rejects_overlong_key(self, keys):
+        async def handler(committed):
+            return {}
+
+        with pytest.raises(HTTPException) as e:
+            run_idempotent(handler, key="k" * (server.IDEMPOTENCY_KEY_MAX_LENGTH + 1))
+        assert e.value.status_code == 400
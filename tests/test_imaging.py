@@ -0,0 +1,146 @@
+"""
+Milkbites Image Processing Unit Tests
+Tests for: product image renditions, payment proof compression
+"""
+import io
+
+import pytest
+from PIL import Image
+
+import imaging
+
+
+def exif_photo(size=(1200, 800), orientation=None, fmt="JPEG", **save_args) -> bytes:
+    """A photo with camera EXIF (make, GPS) and optionally an orientation tag"""
+    image = Image.new("RGB", size, (200, 120, 40))
+    exif = Image.Exif()
+    exif[0x010F] = "PhoneMaker"  # Make
+    exif[0x8825] = {2: (6.0, 10.0, 0.0)}  # GPSInfo: GPSLatitude
+    if orientation:
+        exif[0x0112] = orientation
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, exif=exif, comment=b"taken at home", **save_args)
+    return buffer.getvalue()
+
+
+def transparent_png(size=(400, 400)) -> bytes:
+    image = Image.new("RGBA", size, (0, 0, 0, 0))
+    image.paste((220, 30, 30, 255), (100, 100, 300, 300))
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    return buffer.getvalue()
+
+
+def assert_no_metadata(image: Image.Image):
+    assert not image.getexif()
+    assert "exif" not in image.info
+    assert "comment" not in image.info
+    assert "xmp" not in image.info
+
+
+class TestRenderRendition:
+    """Source images scaled to a width and re-encoded without metadata"""
+
+    @pytest.mark.parametrize("fmt,pil_format", [("jpeg", "JPEG"), ("webp", "WEBP")])
+    def test_scales_to_width_in_format(self, tmp_path, fmt, pil_format):
+        source = tmp_path / "source"
+        source.write_bytes(exif_photo())
+        dest = tmp_path / f"640.{fmt}"
+        size = imaging.render_rendition(str(source), str(dest), 640, fmt, 80)
+        assert size == dest.stat().st_size
+        with Image.open(dest) as image:
+            assert image.format == pil_format
+            assert image.size == (640, 427)
+            assert_no_metadata(image)
+
+    def test_never_upscales(self, tmp_path):
+        source = tmp_path / "source"
+        source.write_bytes(exif_photo(size=(300, 200)))
+        dest = tmp_path / "1280.jpeg"
+        imaging.render_rendition(str(source), str(dest), 1280, "jpeg", 80)
+        with Image.open(dest) as image:
+            assert image.size == (300, 200)
+
+    def test_applies_exif_orientation(self, tmp_path):
+        source = tmp_path / "source"
+        source.write_bytes(exif_photo(size=(1200, 800), orientation=6))  # rotate 90 degrees on display
+        dest = tmp_path / "400.jpeg"
+        imaging.render_rendition(str(source), str(dest), 400, "jpeg", 80)
+        with Image.open(dest) as image:
+            assert image.size == (400, 600)
+            assert_no_metadata(image)
+
+    def test_jpeg_flattens_alpha_onto_white(self, tmp_path):
+        source = tmp_path / "source"
+        source.write_bytes(transparent_png())
+        dest = tmp_path / "200.jpeg"
+        imaging.render_rendition(str(source), str(dest), 200, "jpeg", 90)
+        with Image.open(dest) as image:
+            assert image.mode == "RGB"
+            corner = image.getpixel((2, 2))
+            assert all(channel > 245 for channel in corner)
+
+    def test_webp_keeps_alpha(self, tmp_path):
+        source = tmp_path / "source"
+        source.write_bytes(transparent_png())
+        dest = tmp_path / "200.webp"
+        imaging.render_rendition(str(source), str(dest), 200, "webp", 90)
+        with Image.open(dest) as image:
+            assert image.mode == "RGBA"
+            assert image.getpixel((2, 2))[3] == 0
+
+    def test_not_an_image(self, tmp_path):
+        source = tmp_path / "source"
+        source.write_bytes(b"<html>not found</html>")
+        dest = tmp_path / "320.jpeg"
+        with pytest.raises(OSError):
+            imaging.render_rendition(str(source), str(dest), 320, "jpeg", 80)
+        assert list(tmp_path.iterdir()) == [source]
+
+
+class TestCompressPaymentProof:
+    """Uploaded payment proofs re-encoded as bounded JPEGs with a thumbnail"""
+
+    def test_bounds_proof_and_thumbnail(self):
+        proof, thumb = imaging.compress_payment_proof(exif_photo(size=(3000, 2000)), 1600, 320, 80)
+        with Image.open(io.BytesIO(proof)) as image:
+            assert image.format == "JPEG"
+            assert image.size == (1600, 1067)
+            assert_no_metadata(image)
+        with Image.open(io.BytesIO(thumb)) as image:
+            assert image.format == "JPEG"
+            assert max(image.size) <= 320
+            assert image.size == (320, 213)
+            assert_no_metadata(image)
+
+    def test_portrait_bounded_by_height(self):
+        proof, thumb = imaging.compress_payment_proof(exif_photo(size=(1000, 4000)), 1600, 320, 80)
+        with Image.open(io.BytesIO(proof)) as image:
+            assert image.size == (400, 1600)
+        with Image.open(io.BytesIO(thumb)) as image:
+            assert image.size == (80, 320)
+
+    def test_small_upload_kept_at_size(self):
+        proof, thumb = imaging.compress_payment_proof(exif_photo(size=(600, 400)), 1600, 320, 80)
+        with Image.open(io.BytesIO(proof)) as image:
+            assert image.size == (600, 400)
+        with Image.open(io.BytesIO(thumb)) as image:
+            assert image.size == (320, 213)
+
+    def test_strips_metadata_from_other_formats(self):
+        proof, thumb = imaging.compress_payment_proof(exif_photo(fmt="WEBP"), 1600, 320, 80)
+        for data in (proof, thumb):
+            with Image.open(io.BytesIO(data)) as image:
+                assert image.format == "JPEG"
+                assert_no_metadata(image)
+
+    def test_flattens_transparent_screenshot(self):
+        proof, thumb = imaging.compress_payment_proof(transparent_png(), 1600, 320, 90)
+        for data in (proof, thumb):
+            with Image.open(io.BytesIO(data)) as image:
+                assert image.mode == "RGB"
+                assert all(channel > 245 for channel in image.getpixel((2, 2)))
+
+    def test_not_an_image(self):
+        with pytest.raises(OSError):
+            imaging.compress_payment_proof(b"%PDF-1.4 receipt", 1600, 320, 80)